@@ -2,40 +2,111 @@ import itertools
 import sys
 import io
 
+import numpy as np
+from scipy import spatial
+import shapely
 from shapely import geometry, validation
 
 
-def compare_rings(
-    ax,
-    detail_file,
-    r_old,
-    r_new,
-    marker,
-    i,
-    j,
-    k=None,
-    tolerance=0.0,
-    report_identical=False,
-):
-    """r_old and r_new are LinearRing objects from the geometry
-    module. marker is not used if ax is None.
+def ring_header(i, j, k):
+    """i: shape number, j: polygon number for a multi-polygon or None,
+    k: interior ring number or None for the exterior.
 
     """
 
-    # We need to insert a header before detailed diagnostic, but only
-    # if we find differences, so create a new text stream:
-    detail_subfile = io.StringIO()
+    header = f"\nShape {i}"
 
-    detail_subfile.write(f"\nShape {i}")
     if j is not None:
-        detail_subfile.write(f", part {j}")
+        header += f", part {j}"
 
     if k is None:
-        detail_subfile.write(", exterior:\n")
+        header += ", exterior:\n"
     else:
-        detail_subfile.write(f", interior {k}:\n")
+        header += f", interior {k}:\n"
+
+    return header
+
+
+def ring_pairs(p_old, p_new):
+    """Yield the triplets (k, r_old, r_new) of rings of polygons p_old
+    and p_new to compare, with k None for the exterior.
+
+    """
+
+    yield None, p_old.exterior, p_new.exterior
+
+    for k, (r_old, r_new) in enumerate(zip(p_old.interiors, p_new.interiors)):
+        yield k, r_old, r_new
+
+
+def vertex_distances(rings_old, rings_new):
+    """rings_old and rings_new are arrays of Shapely geometries, with the
+    same length, possibly invalid. Return the array of Hausdorff
+    distances between the sets of vertices of each pair of
+    geometries, that is the largest displacement of a vertex. The
+    distances are computed with a single KD-tree for all the pairs
+    in each direction.
+
+    """
+
+    coords_old, index_old = shapely.get_coordinates(
+        rings_old, return_index=True
+    )
+    coords_new, index_new = shapely.get_coordinates(
+        rings_new, return_index=True
+    )
+    distances = np.zeros(len(rings_old))
+
+    if coords_old.size == 0 or coords_new.size == 0:
+        return distances
+
+    # Separate the pairs along a third axis by more than any distance
+    # within a pair, so that the nearest neighbour of a vertex is in
+    # the same pair. The third coordinates of vertices of a pair are
+    # equal so they do not change the distances within the pair.
+    all_coords = np.concatenate([coords_old, coords_new])
+    gap = 2 * np.max(np.ptp(all_coords, axis=0)) + 1
+    points_old = np.column_stack([coords_old, index_old * gap])
+    points_new = np.column_stack([coords_new, index_new * gap])
+
+    for points, index, other in [
+        (points_old, index_old, points_new),
+        (points_new, index_new, points_old),
+    ]:
+        nearest, _ = spatial.KDTree(other).query(points)
+        np.maximum.at(distances, index, nearest)
 
-    if r_old.equals(r_new):
+    return distances
+
+
+def ring_report(
+    header,
+    equal,
+    n_points,
+    areas,
+    explain,
+    tolerance,
+    report_identical,
+    displacement=None,
+):
+    """Diagnostic on the comparison of two rings. equal tells whether
+    the rings are topologically equal. n_points is the pair of numbers
+    of points of the rings. areas is None or the pair (area of old
+    polygon, area of symmetric difference). explain is None or the pair
+    of explanations of validity of the rings, if one of them is
+    invalid. If displacement is not None then it is the largest
+    displacement of a vertex, compared to tolerance, and areas and
+    explain are ignored. Return the return code and the text to
+    write.
+
+    """
+
+    # We need to insert a header before detailed diagnostic, but only
+    # if we find differences, so create a new text stream:
+    detail_subfile = io.StringIO()
+    detail_subfile.write(header)
+
+    if equal:
         if report_identical:
             detail_subfile.write(
                 "This is just a difference by permutation or ordering.\n"
@@ -43,8 +114,7 @@ def compare_rings(
 
         diff_found = False
     else:
-        len_old = len(r_old.coords)
-        len_new = len(r_new.coords)
+        len_old, len_new = n_points
 
         if len_new != len_old:
             if report_identical:
@@ -52,6 +122,80 @@ def compare_rings(
                     f"Numbers of points differ: {len_old} {len_new}\n"
                 )
 
+        if displacement is not None:
+            if displacement <= tolerance:
+                if report_identical:
+                    detail_subfile.write("Negligible difference\n")
+
+                diff_found = False
+            else:
+                detail_subfile.write(
+                    f"Largest displacement of vertices: {displacement}\n"
+                )
+                diff_found = True
+        elif explain is None:
+            area_old, area_sym_diff = areas
+
+            if area_old != 0:
+                my_diff = area_sym_diff / area_old
+
+                if my_diff <= tolerance:
+                    if report_identical:
+                        detail_subfile.write("Negligible difference\n")
+
+                    diff_found = False
+                else:
+                    detail_subfile.write(
+                        "Area of symmetric difference / area of old "
+                        f"shape: {my_diff}\n"
+                    )
+                    diff_found = True
+            else:
+                detail_subfile.write(
+                    "Area of old shape is 0. \n"
+                    "Note this should never be in a polygon shapefile.\n"
+                )
+                diff_found = True
+        else:
+            detail_subfile.write("Cannot compute symmetric difference.\n")
+            detail_subfile.write(f"old: {explain[0]}\n")
+            detail_subfile.write(f"new: {explain[1]}\n")
+            diff_found = True
+
+    if diff_found or report_identical:
+        text = detail_subfile.getvalue()
+    else:
+        text = ""
+
+    return (1 if diff_found else 0), text
+
+
+def compare_rings(
+    ax,
+    detail_file,
+    r_old,
+    r_new,
+    marker,
+    i,
+    j,
+    k=None,
+    tolerance=0.0,
+    report_identical=False,
+    distance=None,
+):
+    """r_old and r_new are LinearRing objects from the geometry
+    module. marker is not used if ax is None. If distance is not None
+    then the rings are compared on the displacement of vertices, with
+    tolerance distance, instead of the area of symmetric difference.
+
+    """
+
+    equal = r_old.equals(r_new)
+    areas = None
+    explain = None
+    displacement = None
+
+    if not equal:
         if ax:
             my_label = str(i)
             if j is not None:
@@ -81,45 +225,114 @@ def compare_rings(
                 color=l[0].get_color(),
             )
 
-        if r_old.is_valid and r_new.is_valid:
+        if distance is not None:
+            displacement = vertex_distances(
+                np.array([r_old]), np.array([r_new])
+            )[0]
+        elif r_old.is_valid and r_new.is_valid:
             pr_old = geometry.Polygon(r_old)
             pr_new = geometry.Polygon(r_new)
             sym_diff = pr_new.symmetric_difference(pr_old)
+            areas = (pr_old.area, sym_diff.area)
+        else:
+            explain = (
+                validation.explain_validity(r_old),
+                validation.explain_validity(r_new),
+            )
 
-            if pr_old.area != 0:
-                my_diff = sym_diff.area / pr_old.area
+    ret_code, text = ring_report(
+        ring_header(i, j, k),
+        equal,
+        (len(r_old.coords), len(r_new.coords)),
+        areas,
+        explain,
+        tolerance if distance is None else distance,
+        report_identical,
+        displacement,
+    )
+    detail_file.write(text)
+    return ret_code
 
-                if my_diff <= tolerance:
-                    if report_identical:
-                        detail_subfile.write("Negligible difference\n")
 
-                    diff_found = False
-                else:
-                    detail_subfile.write(
-                        "Area of symmetric difference / area of old "
-                        f"shape: {my_diff}\n"
-                    )
-                    diff_found = True
-            else:
-                detail_subfile.write(
-                    "Area of old shape is 0. \n"
-                    "Note this should never be in a polygon shapefile.\n"
-                )
-                diff_found = True
-        else:
-            detail_subfile.write("Cannot compute symmetric difference.\n")
-            explain = validation.explain_validity(r_old)
-            detail_subfile.write(f"old: {explain}\n")
-            explain = validation.explain_validity(r_new)
-            detail_subfile.write(f"new: {explain}\n")
-            diff_found = True
+def compare_ring_arrays(
+    rings_old,
+    rings_new,
+    headers,
+    tolerance=0.0,
+    report_identical=False,
+    distance=None,
+):
+    """rings_old and rings_new are lists of LinearRing objects, with the
+    same length. Compare them pairwise, as compare_rings would without
+    plot, but with vectorized Shapely functions. headers is the list
+    of headers of the diagnostics, see ring_header. Return the list of
+    pairs (return code, text to write).
 
-    if diff_found or report_identical:
-        detail_diag = detail_subfile.getvalue()
-        detail_file.write(detail_diag)
+    """
+
+    n_rings = len(rings_old)
+    r_old = np.empty(n_rings, dtype=object)
+    r_new = np.empty(n_rings, dtype=object)
+    r_old[:] = rings_old
+    r_new[:] = rings_new
+    equal = shapely.equals(r_old, r_new)
+    n_old = shapely.get_num_coordinates(r_old)
+    n_new = shapely.get_num_coordinates(r_new)
+
+    if distance is not None:
+        displacements = np.zeros(n_rings)
+        displacements[~equal] = vertex_distances(
+            r_old[~equal], r_new[~equal]
+        )
+        return [
+            ring_report(
+                headers[i],
+                equal[i],
+                (n_old[i], n_new[i]),
+                None,
+                None,
+                distance,
+                report_identical,
+                displacements[i],
+            )
+            for i in range(n_rings)
+        ]
 
-    return 1 if diff_found else 0
+    valid = shapely.is_valid(r_old) & shapely.is_valid(r_new)
 
+    # Areas of old polygons and of symmetric differences:
+    computed = ~equal & valid
+    area_old = np.zeros(n_rings)
+    area_sym_diff = np.zeros(n_rings)
+    pr_old = shapely.polygons(r_old[computed])
+    pr_new = shapely.polygons(r_new[computed])
+    area_old[computed] = shapely.area(pr_old)
+    area_sym_diff[computed] = shapely.area(
+        shapely.symmetric_difference(pr_new, pr_old)
+    )
+
+    explain = {}
+    invalid = np.flatnonzero(~equal & ~valid)
+
+    if invalid.size != 0:
+        explain_old = shapely.is_valid_reason(r_old[invalid])
+        explain_new = shapely.is_valid_reason(r_new[invalid])
+
+        for i, e_old, e_new in zip(invalid, explain_old, explain_new):
+            explain[i] = (e_old, e_new)
+
+    return [
+        ring_report(
+            headers[i],
+            equal[i],
+            (n_old[i], n_new[i]),
+            (area_old[i], area_sym_diff[i]) if computed[i] else None,
+            explain.get(i),
+            tolerance,
+            report_identical,
+        )
+        for i in range(n_rings)
+    ]
 
 
 def compare_poly(
@@ -132,11 +345,12 @@ def compare_poly(
     marker_iter=itertools.repeat(None),
     tolerance=0.0,
     report_identical=False,
+    distance=None,
 ):
     """p_old and p_new are polygon objects from the geometry module. i:
     shape number j: polygon number for a multi-polygon. If ax is equal
     to None then we do not plot, so we do not set a default value for
-    ax.
+    ax. For distance, see compare_rings.
 
     """
 
@@ -150,6 +364,7 @@ def compare_poly(
         j,
         tolerance=tolerance,
         report_identical=report_identical,
+        distance=distance,
     )
 
     for k, (r_old, r_new) in enumerate(zip(p_old.interiors, p_new.interiors)):
@@ -164,6 +379,7 @@ def compare_poly(
             k,
             tolerance,
             report_identical,
+            distance,
         )
 
     return 0 if ret_code == 0 else 1
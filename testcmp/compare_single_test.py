@@ -2,30 +2,146 @@ import time
 from os import path
 import os
 import sys
+import hashlib
+import json
 
+from . import profiling
+from . import registry
 from . import selective_diff
 
+# Files written by the comparison in the directory of the title, not
+# compared:
+OWN_FILES = [
+    "timing_test_compare.txt",
+    "comparison.txt",
+    "comparison_stamp.json",
+]
 
-def compare_single_test(
-    title, compare_dir, sel_diff_args=None
-):
-    t0 = time.perf_counter()
-    old_dir = path.join(compare_dir, title)
+
+def _effective_args(sel_diff_args, outputs):
+    """Return the options for selective_diff actually used in the
+    comparison, without modifying sel_diff_args.
+
+    """
 
     if sel_diff_args is None:
         sel_diff_args = {"exclude": []}
     else:
         sel_diff_args = {"exclude": []} | sel_diff_args
 
-    sel_diff_args["exclude"] = sel_diff_args["exclude"][:] + [
-        "timing_test_compare.txt",
-        "comparison.txt",
-    ]
+    sel_diff_args["exclude"] = sel_diff_args["exclude"][:] + OWN_FILES
     # (Copy so  we do not modify sel_diff_args["exclude"].)
 
+    if outputs is not None:
+        if sel_diff_args.get("include") is None:
+            sel_diff_args["include"] = outputs[:]
+        else:
+            sel_diff_args["include"] = sel_diff_args["include"] + outputs
+
+    return sel_diff_args
+
+
+def _manifest(directory, follow_links):
+    """Return the sorted list of (relative path, size, modification
+    time) of files in directory, excluding OWN_FILES. If follow_links is
+    true then size and modification time of symbolic links are those of
+    their targets.
+
+    """
+
+    manifest = []
+
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+
+        for filename in sorted(filenames):
+            if filename not in OWN_FILES:
+                full_path = path.join(dirpath, filename)
+
+                try:
+                    stat = (os.stat if follow_links else os.lstat)(full_path)
+                except FileNotFoundError:
+                    # Broken link
+                    stat = os.lstat(full_path)
+
+                manifest.append(
+                    (
+                        path.relpath(full_path, directory),
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                    )
+                )
+
+    return manifest
+
+
+def stamp(title, compare_dir, sel_diff_args):
+    """Return a digest of the manifests of the run directory title and
+    its reference in compare_dir, of the effective options for
+    selective_diff and of the version of comparators.
+
+    """
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps(sel_diff_args, sort_keys=True, default=str).encode())
+    h.update(json.dumps(registry.comparator_version()).encode())
+
+    # Unless only link targets are compared, selective_diff compares
+    # the files that links point to:
+    follow_links = not sel_diff_args.get("link_targets", False)
+
+    for directory in [path.join(compare_dir, title), title]:
+        h.update(json.dumps(_manifest(directory, follow_links)).encode())
+
+    return h.hexdigest()
+
+
+def previous_result(title, compare_dir, sel_diff_args=None, outputs=None):
+    """Return the return code of the last comparison of title if its
+    stamp still matches, so that the comparison need not be done again,
+    None otherwise.
+
+    """
+
+    try:
+        with open(path.join(title, "comparison_stamp.json")) as f_obj:
+            recorded = json.load(f_obj)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    sel_diff_args = _effective_args(sel_diff_args, outputs)
+
+    if recorded["stamp"] != stamp(title, compare_dir, sel_diff_args):
+        return None
+
+    return_code = recorded["return_code"]
+
+    if return_code != 0 and not path.exists(
+        path.join(title, "comparison.txt")
+    ):
+        return None
+
+    return return_code
+
+
+def compare_single_test(
+    title, compare_dir, sel_diff_args=None, outputs=None
+):
+    """outputs is the list of shell patterns for declared outputs of the
+    test, or None if all files are outputs. After the comparison, a
+    stamp is recorded in the file "comparison_stamp.json" of title, for
+    previous_result.
+
+    """
+
+    t0 = time.perf_counter()
+    old_dir = path.join(compare_dir, title)
+    sel_diff_args = _effective_args(sel_diff_args, outputs)
     fname = path.join(title, "comparison.txt")
 
-    with open(fname, "w") as f_obj:
+    with open(fname, "w") as f_obj, profiling.span(
+        "compare_single_test", title
+    ):
         return_code = selective_diff.selective_diff(
             [old_dir, title], **sel_diff_args, file_out=f_obj
         )
@@ -39,6 +155,16 @@ def compare_single_test(
             'See "comparison.txt".'
         )
 
+    # Computed after the comparison, which may write into title:
+    with open(path.join(title, "comparison_stamp.json"), "w") as f_obj:
+        json.dump(
+            {
+                "stamp": stamp(title, compare_dir, sel_diff_args),
+                "return_code": return_code,
+            },
+            f_obj,
+        )
+
     t1 = time.perf_counter()
     line = "Elapsed time for comparison: {:.0f} s\n".format(t1 - t0)
     fname = path.join(title, "timing_test_compare.txt")
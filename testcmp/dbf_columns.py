@@ -0,0 +1,124 @@
+"""Columnar access to dBase files. The fixed-width record area of a dBase
+file is viewed as a NumPy structured array, described by the field
+descriptors of the header, so that whole columns can be compared at
+once without decoding records one by one.
+
+"""
+
+import struct
+
+import numpy as np
+
+# Types of numeric fields:
+NUMERIC = ["N", "F"]
+
+
+class Field:
+    def __init__(self, name, field_type, size, decimal, offset):
+        """offset is the position in bytes of the field in the record,
+        after the deletion flag.
+
+        """
+
+        self.name = name
+        self.field_type = field_type
+        self.size = size
+        self.decimal = decimal
+        self.offset = offset
+
+    def __repr__(self):
+        return (
+            f"Field({self.name!r}, {self.field_type!r}, {self.size}, "
+            f"{self.decimal})"
+        )
+
+
+def read_header(f_obj):
+    """f_obj is a dBase file opened in binary mode. Return the number of
+    records, the length of the header, the length of a record and the
+    list of Field objects, all read from the header.
+
+    """
+
+    f_obj.seek(0)
+    n_records, header_length, record_length = struct.unpack(
+        "<4xIHH20x", f_obj.read(32)
+    )
+    fields = []
+
+    # Skip the deletion flag:
+    offset = 1
+
+    # Field descriptors of 32 bytes each, terminated by 0x0D:
+    for _ in range((header_length - 33) // 32):
+        descriptor = f_obj.read(32)
+
+        if len(descriptor) < 32 or descriptor[0] == 0x0D:
+            break
+
+        name = descriptor[:11].split(b"\0", 1)[0].decode("latin-1")
+        field_type = chr(descriptor[11])
+        size = descriptor[16]
+        fields.append(
+            Field(name, field_type, size, descriptor[17], offset)
+        )
+        offset += size
+
+    return n_records, header_length, record_length, fields
+
+
+def record_array(map_dbf, header):
+    """map_dbf is a memory map of a dBase file, or None for an empty
+    file, header the tuple returned by read_header. Return a structured
+    array over the records, without copy. The deletion flag is field
+    "deletion", the other fields are "f0", "f1", etc. in the order of
+    the field descriptors, as raw bytes. Records truncated by the end
+    of the file are ignored.
+
+    """
+
+    n_records, header_length, record_length, fields = header
+    dtype = np.dtype(
+        {
+            "names": ["deletion"] + [f"f{i}" for i in range(len(fields))],
+            "formats": ["S1"] + [f"S{field.size}" for field in fields],
+            "offsets": [0] + [field.offset for field in fields],
+            "itemsize": record_length,
+        }
+    )
+
+    if map_dbf is None or record_length == 0:
+        count = 0
+    else:
+        count = min(
+            n_records, max(len(map_dbf) - header_length, 0) // record_length
+        )
+
+    if count == 0:
+        return np.empty(0, dtype)
+    else:
+        return np.frombuffer(map_dbf, dtype, count, header_length)
+
+
+def to_float(column):
+    """column is an array of raw bytes of a numeric field. Return the
+    array of floats, with NaN for blank or unreadable values.
+
+    """
+
+    column = np.char.strip(column)
+    values = np.full(column.shape, np.nan)
+    filled = column != b""
+
+    try:
+        values[filled] = column[filled].astype(float)
+    except ValueError:
+        # Some value is not a number, such as "*****", convert one by
+        # one:
+        for i in np.flatnonzero(filled):
+            try:
+                values[i] = float(column[i])
+            except ValueError:
+                pass
+
+    return values
@@ -1,56 +1,28 @@
 import filecmp
+import io
 from os import path
 import pathlib
-import pprint
+import shutil
 import subprocess
 import sys
 import tempfile
 
-from wand import image
-import jsondiff
-import magic
-
 from testcmp import diff_dbf
 from testcmp import diff_gv
+from testcmp import diff_json
+from testcmp import diff_layer
+from testcmp import diff_png
 from testcmp import diff_shp
 from testcmp import nccmp
 from testcmp import diff_txt
 from testcmp import diff_csv
-
-
-def diff_png(path_1, path_2, detail_file):
-    with image.Image(filename=path_1) as image1, image.Image(
-        filename=path_2
-    ) as image2:
-        if image1.signature == image2.signature:
-            # The difference must be only in metadata
-            n_diff = 0
-        else:
-            detail_file.write("\n" + "*" * 10 + "\n\n")
-            detail_file.write(f"diff_png {path_1} {path_2}\n")
-            diff_img, distorsion = image2.compare(image1, metric="absolute")
-            detail_file.write(f"Number of different pixels: {distorsion}\n")
-            filename = path.join(path.dirname(path_2), "diff_image.png")
-            diff_img.save(filename=filename)
-            detail_file.write(f"See {filename}\n\n")
-            n_diff = 1
-
-    return n_diff
-
-
-def diff_json(path_1, path_2, detail_file):
-    with open(path_1) as f_obj_1, open(path_2) as f_obj_2:
-        my_diff = jsondiff.diff(f_obj_1, f_obj_2, load=True, syntax="symmetric")
-
-    if my_diff:
-        detail_file.write("\n" + "*" * 10 + "\n\n")
-        detail_file.write(f"diff_json {path_1} {path_2}\n")
-        pprint.pp(my_diff, stream=detail_file)
-        n_diff = 1
-    else:
-        n_diff = 0
-
-    return n_diff
+from testcmp import diff_rect
+from testcmp import diff_keyed
+from testcmp import diff_budget
+from testcmp import diff_bin
+from testcmp import profiling
+from testcmp import registry
+from testcmp import result_cache
 
 
 def max_diff_nc(path_1, path_2, detail_file):
@@ -112,96 +84,336 @@ def diff_nc_ncdump(path_1, path_2, detail_file, size_lim):
     return min(n_diff, 1)
 
 
+def diff_empty(path_1, path_2, detail_file):
+    detail_file.write("\n" + "*" * 10 + "\n\n")
+    detail_file.write(f"diff {path_1} {path_2}\n")
+    detail_file.write("Old file is empty\n\n")
+    return 1
+
+
+def _name(comparator):
+    return f"{comparator.__module__}.{comparator.__qualname__}"
+
+
+def _read_files(filename):
+    """Return the list of files read when comparing filename: the
+    files of the layer for a shapefile.
+
+    """
+
+    files = [filename]
+
+    if pathlib.PurePath(filename).suffix == ".shp":
+        root = path.splitext(filename)[0]
+        files.extend(
+            root + suffix
+            for suffix in [".shx", ".dbf"]
+            if path.exists(root + suffix)
+        )
+
+    return files
+
+
 class DetailedDiff:
     def __init__(
         self,
         size_lim=50,
-        diff_dbf_pyshp=False,
+        dbf_columns=False,
         diff_csv_option="",
         diff_nc="",
         tolerance=1e-7,
         ign_att=None,
+        budget=None,
+        comparators=None,
+        csv_keys=None,
+        shp_jobs=1,
+        shp_unordered=False,
+        shp_layer=False,
+        shp_distance=None,
+        png_diff_image=False,
+        cache=None,
     ):
+        """If dbf_columns is true, or if dbfdump is not installed, then
+        DBF files are compared with diff_dbf.diff_columns. budget is a
+        diff_budget.Budget instance, shared with the caller, which
+        limits the number of differences reported by comparators
+        having their own limit. comparators is a list of
+        strings "SUFFIX=MODULE:FUNCTION", see module registry. If
+        csv_keys is not None then it is a list of key columns and CSV
+        files are compared with diff_keyed, matching rows on these
+        columns. CSV files lacking a key column are compared as if
+        csv_keys were None. shp_jobs is the number of worker processes
+        comparing records of shapefiles. If shp_unordered is true then shapes of
+        shapefiles are matched whatever their order. If shp_layer is
+        true then the main file, index file and dBase file of a
+        shapefile are compared together, once, with diff_layer. If
+        shp_distance is not None then rings of polygons are compared
+        on the displacement of their vertices, see diff_shp. If
+        png_diff_image is true then a picture of the differences
+        between PNG files is written to diff_image.png, in the
+        directory of the new file. If cache is not None then it is a
+        result_cache.ResultCache instance, where the results of
+        comparators are looked up before running them.
+
+        """
+
         self.size_lim = size_lim
         self.tolerance = tolerance
         self.diff_nc = diff_nc
         self.ign_att = ign_att
+        self.csv_keys = csv_keys
+        self.shp_jobs = shp_jobs
+        self.shp_unordered = shp_unordered
+        self.shp_distance = shp_distance
+        self.png_diff_image = png_diff_image
+        self.cache = cache
+
+        if budget is None:
+            self.budget = diff_budget.Budget()
+        else:
+            self.budget = budget
 
-        if diff_dbf_pyshp:
-            self._diff_dbf = diff_dbf.diff_dbf
+        if dbf_columns or shutil.which("dbfdump") is None:
+            self._diff_dbf = self._diff_dbf_columns
         else:
             self._diff_dbf = self._diff_dbf_dbfdump
 
         if diff_csv_option == "numdiff":
             self._diff_csv = diff_csv.numdiff
         elif diff_csv_option == "max_diff_rect":
-            self._diff_csv = diff_csv.max_diff_rect
+            self._diff_csv = diff_rect.diff_rect
+        elif diff_csv_option == "pyndiff" or shutil.which("ndiff") is None:
+            self._diff_csv = diff_csv.pyndiff
         else:
             self._diff_csv = diff_csv.ndiff
 
+        self._by_suffix = {
+            ".dbf": self._diff_dbf,
+            ".csv": self._diff_csv_file,
+            ".nc": self._diff_nc,
+            ".shp": self._diff_shp,
+            ".png": self._diff_png,
+            ".gv": self._diff_gv,
+            ".json": self._diff_json,
+            ".txt": self._diff_txt,
+        }
+
+        if csv_keys is not None:
+            self._by_suffix[".csv"] = self._diff_csv_keyed
+
+        # Comparators of the files of a shapefile which are not part of
+        # a complete layer:
+        self._not_layer = {
+            suffix: self._by_suffix.get(suffix, self._diff_bin)
+            for suffix in diff_layer.SUFFIXES
+        }
+
+        # Paths without suffix of the old layers already compared:
+        self._layers_done = set()
+
+        if shp_layer:
+            for suffix in diff_layer.SUFFIXES:
+                self._by_suffix[suffix] = self._diff_layer
+
+        # Comparators whose result does not only depend on the contents
+        # of the two files, or which write files, are not cached:
+        self._not_cached = {self._diff_layer}
+
+        if png_diff_image:
+            self._not_cached.add(self._diff_png)
+
+        # Options which may change the result of a comparator, for the
+        # key of the cache:
+        self._options = [
+            size_lim,
+            tolerance,
+            diff_nc,
+            ign_att,
+            csv_keys,
+            shp_unordered,
+            shp_distance,
+            _name(self._diff_dbf),
+            _name(self._diff_csv),
+        ]
+
+        self._by_suffix.update(registry.entry_point_comparators())
+
+        if comparators:
+            self._by_suffix.update(registry.parse_comparators(comparators))
+
     def diff(self, path_1, path_2, detail_file=sys.stdout):
+        """Dispatch on the suffix of path_1 first. Only if the suffix is
+        not registered, probe the content of path_1 with libmagic.
+
+        """
+
         suffix = pathlib.PurePath(path_1).suffix
-        file_type = magic.from_file(path.realpath(path_1))
 
-        if suffix == ".dbf":
-            n_diff = self._diff_dbf(path_1, path_2, detail_file)
-        elif suffix == ".csv":
-            n_diff = self._diff_csv(
+        try:
+            comparator = self._by_suffix[suffix]
+        except KeyError:
+            file_type = registry.file_type(path_1)
+
+            if "text" in file_type:
+                comparator = self._diff_txt
+            elif file_type == "empty":
+                comparator = diff_empty
+            else:
+                comparator = self._diff_bin
+
+        with profiling.span("comparator", _name(comparator)), profiling.span(
+            "file", path_1
+        ):
+            if self.cache is None or comparator in self._not_cached:
+                return comparator(path_1, path_2, detail_file)
+            else:
+                return self._cached(comparator, path_1, path_2, detail_file)
+
+    def _cached(self, comparator, path_1, path_2, detail_file):
+        """Look up the result of comparator in the cache, run comparator
+        only if it is not found.
+
+        """
+
+        key = self.cache.key(
+            _read_files(path_1),
+            _read_files(path_2),
+            _name(comparator),
+            # The limit of differences depends on the remaining budget:
+            self._options + [self.budget.cap(self.size_lim)],
+        )
+        result = self.cache.get(key, path_1, path_2)
+
+        if result is None:
+            report_file = io.StringIO()
+            return_code = comparator(path_1, path_2, report_file)
+            report = report_file.getvalue()
+            self.cache.put(key, path_1, path_2, return_code, report)
+        else:
+            return_code, report = result
+
+        detail_file.write(report)
+        return return_code
+
+    def _diff_csv_file(self, path_1, path_2, detail_file):
+        return self._diff_csv(
+            path_1,
+            path_2,
+            detail_file,
+            tolerance=self.tolerance,
+            size_lim=self.size_lim,
+        )
+
+    def _diff_csv_keyed(self, path_1, path_2, detail_file):
+        if diff_keyed.has_keys(path_1, self.csv_keys) and diff_keyed.has_keys(
+            path_2, self.csv_keys
+        ):
+            return diff_keyed.diff_keyed(
                 path_1,
                 path_2,
                 detail_file,
+                self.csv_keys,
                 tolerance=self.tolerance,
                 size_lim=self.size_lim,
             )
-        elif suffix == ".nc":
-            if self.diff_nc == "ncdump":
-                n_diff = diff_nc_ncdump(
-                    path_1, path_2, detail_file, self.size_lim
-                )
-            elif self.diff_nc == "max_diff_nc":
-                n_diff = max_diff_nc(path_1, path_2, detail_file=detail_file)
-            elif self.diff_nc == "Ziemlinski":
-                n_diff = nccmp_Ziemlinski(
-                    path_1, path_2, detail_file=detail_file
-                )
-            else:
-                n_diff = nccmp.nccmp(
-                    path_1,
-                    path_2,
-                    detail_file=detail_file,
-                    ign_att=self.ign_att,
-                )
-        elif suffix == ".shp":
-            n_diff = diff_shp.diff_shp(
+        else:
+            # Other CSV files of the tree, without the key columns:
+            return self._diff_csv_file(path_1, path_2, detail_file)
+
+    def _diff_nc(self, path_1, path_2, detail_file):
+        if self.diff_nc == "ncdump":
+            n_diff = diff_nc_ncdump(path_1, path_2, detail_file, self.size_lim)
+        elif self.diff_nc == "max_diff_nc":
+            n_diff = max_diff_nc(path_1, path_2, detail_file=detail_file)
+        elif self.diff_nc == "Ziemlinski":
+            n_diff = nccmp_Ziemlinski(path_1, path_2, detail_file=detail_file)
+        else:
+            n_diff = nccmp.nccmp(
                 path_1,
                 path_2,
                 detail_file=detail_file,
-                tolerance=self.tolerance,
-                max_n_diff=self.size_lim // 5,
+                ign_att=self.ign_att,
             )
-        elif suffix == ".png":
-            n_diff = diff_png(path_1, path_2, detail_file)
-        elif suffix == ".gv":
-            n_diff = diff_gv.diff_gv(path_1, path_2, detail_file)
-        elif suffix == ".json":
-            n_diff = diff_json(path_1, path_2, detail_file)
-        elif suffix == ".txt" or "text" in file_type:
-            n_diff = diff_txt.diff_txt(
-                path_1, path_2, self.size_lim, detail_file
-            )
-        elif file_type == "empty":
-            detail_file.write("\n" + "*" * 10 + "\n\n")
-            detail_file.write(f"diff {path_1} {path_2}\n")
-            detail_file.write("Old file is empty\n\n")
-            n_diff = 1
-        else:
-            detail_file.write("\n" + "*" * 10 + "\n\n")
-            detail_file.write(f"diff {path_1} {path_2}\n")
-            detail_file.write("Detailed diff not implemented\n\n")
-            n_diff = 1
 
         return n_diff
 
+    def _diff_shp(self, path_1, path_2, detail_file):
+        return diff_shp.diff_shp(
+            path_1,
+            path_2,
+            detail_file=detail_file,
+            tolerance=self.tolerance,
+            max_n_diff=self.budget.cap(self.size_lim // 5),
+            jobs=self.shp_jobs,
+            unordered=self.shp_unordered,
+            distance=self.shp_distance,
+        )
+
+    def _diff_layer(self, path_1, path_2, detail_file):
+        root_1 = diff_layer.layer_root(path_1)
+        root_2 = diff_layer.layer_root(path_2)
+
+        if not diff_layer.is_layer(root_1) or not diff_layer.is_layer(root_2):
+            suffix = pathlib.PurePath(path_1).suffix
+            return self._not_layer[suffix](path_1, path_2, detail_file)
+
+        if root_1 in self._layers_done:
+            # The difference is already reported by another file of the
+            # layer.
+            return 0
+
+        self._layers_done.add(root_1)
+        return diff_layer.diff_layer(
+            root_1,
+            root_2,
+            detail_file=detail_file,
+            tolerance=self.tolerance,
+            max_n_diff=self.budget.cap(self.size_lim // 5),
+            distance=self.shp_distance,
+        )
+
+    def _diff_gv(self, path_1, path_2, detail_file):
+        return diff_gv.diff_gv(
+            path_1,
+            path_2,
+            detail_file,
+            max_n_diff=self.budget.cap(self.size_lim),
+        )
+
+    def _diff_json(self, path_1, path_2, detail_file):
+        return diff_json.diff_json(
+            path_1,
+            path_2,
+            detail_file,
+            tolerance=self.tolerance,
+            max_n_diff=self.budget.cap(self.size_lim),
+        )
+
+    def _diff_png(self, path_1, path_2, detail_file):
+        if self.png_diff_image:
+            diff_image = path.join(path.dirname(path_2), "diff_image.png")
+        else:
+            diff_image = None
+
+        return diff_png.diff_png(
+            path_1,
+            path_2,
+            detail_file,
+            diff_image,
+            max_boxes=self.size_lim,
+        )
+
+    def _diff_txt(self, path_1, path_2, detail_file):
+        return diff_txt.diff_txt(path_1, path_2, self.size_lim, detail_file)
+
+    def _diff_bin(self, path_1, path_2, detail_file):
+        return diff_bin.diff_bin(path_1, path_2, detail_file, self.size_lim)
+
+    def _diff_dbf_columns(self, path_1, path_2, detail_file):
+        return diff_dbf.diff_columns(
+            path_1, path_2, detail_file, self.tolerance, self.size_lim
+        )
+
     def _diff_dbf_dbfdump(self, path_1, path_2, detail_file):
         f1_dbfdump = tempfile.NamedTemporaryFile("w+")
         f2_dbfdump = tempfile.NamedTemporaryFile("w+")
@@ -0,0 +1,164 @@
+import mmap
+import os
+import sys
+
+import numpy as np
+
+# Size in bytes of the blocks compared at once:
+BLOCK_SIZE = 1 << 24
+
+
+def map_file(f_obj):
+    """Return a read-only memory map of the open file object f_obj, or
+    None if the file is empty (an empty file cannot be mapped).
+
+    """
+
+    size = os.fstat(f_obj.fileno()).st_size
+
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(f_obj.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    if size == 0:
+        return None
+    else:
+        return mmap.mmap(f_obj.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def diff_bin(
+    path_1, path_2, detail_file=sys.stdout, size_lim=50, max_gap=16
+):
+    """Compare path_1 and path_2 as opaque binary files. Report the first
+    differing offset, the number of differing bytes and the ranges of
+    differing bytes, at most size_lim ranges. Ranges separated by at
+    most max_gap identical bytes are coalesced. If the files do not
+    have the same size, the bytes beyond the end of the shorter file
+    count as differing.
+
+    """
+
+    with open(path_1, "rb") as f_obj_1, open(path_2, "rb") as f_obj_2:
+        map_1 = map_file(f_obj_1)
+        map_2 = map_file(f_obj_2)
+        size_1 = 0 if map_1 is None else len(map_1)
+        size_2 = 0 if map_2 is None else len(map_2)
+        n_common = min(size_1, size_2)
+        n_bytes = 0
+        first_offset = None
+        ranges = []
+        n_ranges = 0
+
+        # Last range found, possibly to be extended by the next block:
+        current = None
+
+        for start in range(0, n_common, BLOCK_SIZE):
+            count = min(BLOCK_SIZE, n_common - start)
+            block_1 = np.frombuffer(map_1, np.uint8, count, start)
+            block_2 = np.frombuffer(map_2, np.uint8, count, start)
+            i_diff = np.flatnonzero(block_1 != block_2)
+            del block_1, block_2
+            # (Release the exported buffers so that the maps can be
+            # closed.)
+
+            if i_diff.size != 0:
+                n_bytes += i_diff.size
+                i_diff += start
+
+                if first_offset is None:
+                    first_offset = int(i_diff[0])
+
+                i_break = np.flatnonzero(np.diff(i_diff) > max_gap + 1)
+                starts = i_diff[np.concatenate(([0], i_break + 1))]
+                ends = i_diff[np.concatenate((i_break, [-1]))] + 1
+
+                for r_start, r_end in zip(starts.tolist(), ends.tolist()):
+                    if (
+                        current is not None
+                        and r_start - current[1] <= max_gap
+                    ):
+                        current[1] = r_end
+                    else:
+                        if current is not None:
+                            n_ranges += 1
+                            if len(ranges) < size_lim:
+                                ranges.append(current)
+
+                        current = [r_start, r_end]
+
+        if size_1 != size_2:
+            n_bytes += abs(size_1 - size_2)
+
+            if first_offset is None:
+                first_offset = n_common
+
+            r_end = max(size_1, size_2)
+
+            if current is not None and n_common - current[1] <= max_gap:
+                current[1] = r_end
+            else:
+                if current is not None:
+                    n_ranges += 1
+                    if len(ranges) < size_lim:
+                        ranges.append(current)
+
+                current = [n_common, r_end]
+
+        if current is not None:
+            n_ranges += 1
+            if len(ranges) < size_lim:
+                ranges.append(current)
+
+        for my_map in [map_1, map_2]:
+            if my_map is not None:
+                my_map.close()
+
+    if n_bytes == 0:
+        return 0
+    else:
+        detail_file.write("\n" + "*" * 10 + "\n\n")
+        detail_file.write(f"diff_bin {path_1} {path_2}\n")
+
+        if size_1 != size_2:
+            detail_file.write(f"Sizes differ: {size_1} {size_2} bytes\n")
+
+        detail_file.write(f"First differing byte at offset {first_offset}\n")
+        detail_file.write(f"Number of differing bytes: {n_bytes}\n")
+        detail_file.write(
+            f"Ranges of differing bytes (0-based offsets, end excluded, "
+            f"gaps of at most {max_gap} identical bytes merged):\n"
+        )
+
+        for r_start, r_end in ranges:
+            detail_file.write(f"[{r_start}, {r_end})\n")
+
+        if n_ranges > len(ranges):
+            detail_file.write(
+                f"... and {n_ranges - len(ranges)} more ranges\n"
+            )
+
+        detail_file.write("\n")
+        return 1
+
+
+def main_cli():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", nargs=2)
+    parser.add_argument(
+        "-l",
+        "--limit",
+        type=int,
+        default=50,
+        help="maximum number of ranges printed (default 50)",
+    )
+    parser.add_argument(
+        "-g",
+        "--max-gap",
+        type=int,
+        default=16,
+        help="coalesce ranges separated by at most this number of identical "
+        "bytes (default 16)",
+    )
+    args = parser.parse_args()
+    return diff_bin(*args.file, size_lim=args.limit, max_gap=args.max_gap)
@@ -0,0 +1,36 @@
+class Budget:
+    """Number of differences that may still be found before the
+    comparison of directories stops. The same instance is shared by
+    selective_diff.my_report, detailed_diff.DetailedDiff and the
+    comparators called by DetailedDiff. max_diffs equal to None means
+    no limit.
+
+    """
+
+    def __init__(self, max_diffs=None):
+        self.max_diffs = max_diffs
+        self.remaining = max_diffs
+
+        # Set to True if some comparison was skipped because the
+        # budget was used up:
+        self.truncated = False
+
+    def exhausted(self):
+        return self.remaining is not None and self.remaining <= 0
+
+    def consume(self, n_diff):
+        if self.remaining is not None:
+            self.remaining -= n_diff
+
+    def cap(self, limit):
+        """Return limit reduced to the remaining budget. limit may be
+        None, meaning no limit.
+
+        """
+
+        if self.remaining is None:
+            return limit
+        elif limit is None:
+            return max(self.remaining, 0)
+        else:
+            return min(limit, max(self.remaining, 0))
@@ -1,9 +1,16 @@
+import re
 import sys
 import tempfile
 import subprocess
 
+import numpy as np
+
 from testcmp import diff_txt
 
+# Numbers, including Fortran double precision exponents:
+_NUMBER = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eEdD][+-]?\d+)?")
+_D_TO_E = str.maketrans("dD", "eE")
+
 
 def max_diff_rect(path_1, path_2, detail_file, names=None, **other_kwargs):
     """This is a Python wrapper for program max_diff_rect. other_kwargs is
@@ -125,3 +132,219 @@ def numdiff(
             sys.exit(2)
 
     return cp.returncode
+
+
+def to_float(field):
+    """Return the value of field if it is a number (possibly with a
+    Fortran double precision exponent), None otherwise.
+
+    """
+
+    if _NUMBER.fullmatch(field):
+        return float(field.translate(_D_TO_E))
+    else:
+        return None
+
+
+def _range(i1, i2):
+    """Range of 0-based line indices [i1, i2) in diff normal format."""
+
+    if i2 - i1 == 1:
+        return str(i1 + 1)
+    else:
+        return f"{i1 + 1},{i2}"
+
+
+def _hunk(old_lines, new_lines, i1, i2, j1, j2):
+    """Return the lines of a hunk in diff normal format."""
+
+    if i1 == i2:
+        hunk = [f"{i1}a{_range(j1, j2)}\n"]
+    elif j1 == j2:
+        hunk = [f"{_range(i1, i2)}d{j1}\n"]
+    else:
+        hunk = [f"{_range(i1, i2)}c{_range(j1, j2)}\n"]
+
+    hunk.extend(
+        "< " + line.rstrip("\r\n") + "\n" for line in old_lines[i1:i2]
+    )
+
+    if i1 != i2 and j1 != j2:
+        hunk.append("---\n")
+
+    hunk.extend(
+        "> " + line.rstrip("\r\n") + "\n" for line in new_lines[j1:j2]
+    )
+    return hunk
+
+
+class _PairedLines:
+    """Numerical comparison of pairs of lines, field by field. Fields
+    which are both numbers are compared with a relative and an
+    absolute tolerance, other fields are compared exactly.
+
+    """
+
+    def __init__(self, separators, tolerance, abserr):
+        self.split = re.compile("[" + re.escape(separators) + "]+").split
+        self.tolerance = tolerance
+        self.abserr = abserr
+        self.max_abs = (0.0, None, None)
+        self.max_rel = (0.0, None, None)
+
+    def differing(self, old_lines, new_lines, i1):
+        """old_lines and new_lines have the same length, with the first
+        line at index i1 in the old file. Return
+        the set of indices in old_lines of lines which differ beyond
+        tolerance.
+
+        """
+
+        differ = set()
+        x = []
+        y = []
+        i_line = []
+        i_field = []
+
+        for i, (line_1, line_2) in enumerate(zip(old_lines, new_lines)):
+            fields_1 = [f for f in self.split(line_1.rstrip("\r\n")) if f]
+            fields_2 = [f for f in self.split(line_2.rstrip("\r\n")) if f]
+
+            if len(fields_1) != len(fields_2):
+                differ.add(i)
+            else:
+                for k, (f_1, f_2) in enumerate(zip(fields_1, fields_2)):
+                    if f_1 != f_2:
+                        v_1 = to_float(f_1)
+                        v_2 = to_float(f_2)
+
+                        if v_1 is not None and v_2 is not None:
+                            x.append(v_1)
+                            y.append(v_2)
+                            i_line.append(i)
+                            i_field.append(k)
+                        else:
+                            differ.add(i)
+
+        if x:
+            x = np.array(x)
+            y = np.array(y)
+            i_line = np.array(i_line)
+            abs_err = np.abs(x - y)
+            denom = np.minimum(np.abs(x), np.abs(y))
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rel_err = np.where(abs_err == 0, 0.0, abs_err / denom)
+
+            bad = (abs_err > self.abserr) & (rel_err > self.tolerance)
+            differ.update(i_line[bad].tolist())
+            k = np.argmax(abs_err)
+
+            if abs_err[k] > self.max_abs[0]:
+                self.max_abs = (abs_err[k], i1 + i_line[k], i_field[k])
+
+            k = np.argmax(rel_err)
+
+            if rel_err[k] > self.max_rel[0]:
+                self.max_rel = (rel_err[k], i1 + i_line[k], i_field[k])
+
+        return differ
+
+
+def pyndiff(
+    path_1,
+    path_2,
+    detail_file=sys.stdout,
+    names=None,
+    tolerance=1e-7,
+    size_lim=50,
+    separators=" ",
+    abserr=0.0,
+):
+    """In-process replacement for program ndiff, with the same
+    semantics. Lines are aligned as by diff. In changed blocks with the
+    same number of old and new lines, lines are split into fields at
+    separators and compared field by field: numbers are compared with
+    relative tolerance tolerance (relative to the smaller absolute
+    value) or absolute tolerance abserr, other fields are compared
+    exactly. Lines equal within tolerance are not reported. The output
+    is in diff normal format, followed by the maximum errors, as ndiff
+    does.
+
+    """
+
+    with open(path_1) as f:
+        old_lines = f.readlines()
+
+    with open(path_2) as f:
+        new_lines = f.readlines()
+
+    paired = _PairedLines(separators, tolerance, abserr)
+    diff_lines = []
+    too_many = False
+
+    for i1, i2, j1, j2 in diff_txt.diff_regions(old_lines, new_lines):
+        if i2 - i1 == j2 - j1:
+            differ = paired.differing(old_lines[i1:i2], new_lines[j1:j2], i1)
+
+            # Group consecutive differing lines into hunks:
+            hunks = []
+
+            for i in sorted(differ):
+                if hunks and hunks[-1][1] == i:
+                    hunks[-1][1] = i + 1
+                else:
+                    hunks.append([i, i + 1])
+
+            for k1, k2 in hunks:
+                diff_lines.extend(
+                    _hunk(
+                        old_lines,
+                        new_lines,
+                        i1 + k1,
+                        i1 + k2,
+                        j1 + k1,
+                        j1 + k2,
+                    )
+                )
+        else:
+            diff_lines.extend(_hunk(old_lines, new_lines, i1, i2, j1, j2))
+
+        if len(diff_lines) > size_lim:
+            too_many = True
+            break
+
+    if diff_lines:
+        if not too_many:
+            for tag, (err, i, k) in [
+                ("absolute", paired.max_abs),
+                ("relative", paired.max_rel),
+            ]:
+                if i is not None:
+                    diff_lines.append(
+                        f"### Maximum {tag} error in matching lines = "
+                        f"{err:.2e} at line {i + 1} field {k + 1}\n"
+                    )
+
+            too_many = len(diff_lines) > size_lim
+
+        detail_file.write("\n" + "*" * 10 + "\n\n")
+
+        if names is None:
+            detail_file.write(f"pyndiff {path_1} {path_2}\n")
+        else:
+            detail_file.write(f"pyndiff {names[0]} {names[1]}\n")
+
+        detail_file.write(
+            "Comparison with pyndiff, tolerance " f"{tolerance}:\n"
+        )
+
+        if too_many:
+            detail_file.write("Too many lines in diff output\n")
+        else:
+            detail_file.writelines(diff_lines)
+
+        detail_file.write("\n")
+        return 1
+    else:
+        return 0
@@ -1,6 +1,10 @@
 import shapefile
 import numpy as np
 from os import path
+import sys
+
+from testcmp import dbf_columns
+from testcmp import diff_bin
 
 
 def diff_dbf(old, new, report_identical=False, quiet=False):
@@ -77,6 +81,231 @@ def diff_dbf(old, new, report_identical=False, quiet=False):
         return 0
 
 
+def relative_difference(v_old, v_new):
+    """Return the absolute value of the difference relative to v_old: 0
+    for equal values, infinite if only v_old is 0, NaN if a value is
+    NaN. v_old and v_new may be arrays.
+
+    """
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(
+            v_new == v_old, 0.0, np.abs(v_new - v_old) / np.abs(v_old)
+        )
+
+
+def _diff_column(col_old, col_new, f_old, f_new, tolerance):
+    """Compare a column of the old and new files. Return the array of
+    indices of differing records and the maximum absolute value of
+    relative difference, or None if the field is not numeric in both
+    files.
+
+    """
+
+    if f_old.size != f_new.size:
+        # Trailing blanks are padding:
+        col_old = np.char.rstrip(col_old)
+        col_new = np.char.rstrip(col_new)
+
+    differ = np.flatnonzero(col_old != col_new)
+
+    if (
+        f_old.field_type not in dbf_columns.NUMERIC
+        or f_new.field_type not in dbf_columns.NUMERIC
+    ):
+        return differ, None
+
+    # Values formatted differently may be equal or within tolerance:
+    v_old = dbf_columns.to_float(col_old[differ])
+    v_new = dbf_columns.to_float(col_new[differ])
+
+    rel_diff = relative_difference(v_old, v_new)
+
+    # NaN, for unreadable values, counts as a difference:
+    keep = ~(rel_diff <= tolerance)
+
+    if rel_diff.size == 0:
+        max_diff = 0.0
+    elif np.all(np.isfinite(rel_diff)):
+        max_diff = np.max(rel_diff)
+    else:
+        # A value changing from zero, or unreadable:
+        max_diff = np.inf
+
+    return differ[keep], max_diff
+
+
+def _diff_records(
+    records_1, records_2, fields_1, fields_2, tolerance, size_lim, lines
+):
+    """records_1 and records_2 are record arrays returned by
+    dbf_columns.record_array, fields_1 and fields_2 the lists of Field
+    objects. Append the description of differences to the list lines.
+    Return True if a difference is found.
+
+    """
+
+    diff_found = False
+    n_rec = min(records_1.size, records_2.size)
+
+    if records_1.size != records_2.size:
+        diff_found = True
+        lines.append(
+            "Not the same number of records: "
+            f"{records_1.size} {records_2.size}\n"
+        )
+        lines.append(f"Comparing the first {n_rec} records...\n")
+
+    fields_1 = {f.name: (f"f{i}", f) for i, f in enumerate(fields_1)}
+    fields_2 = {f.name: (f"f{i}", f) for i, f in enumerate(fields_2)}
+
+    for names, which in [
+        (fields_1.keys() - fields_2.keys(), "old"),
+        (fields_2.keys() - fields_1.keys(), "new"),
+    ]:
+        if names:
+            diff_found = True
+            lines.append(
+                f"Fields only in {which} file: "
+                + ", ".join(sorted(names))
+                + "\n"
+            )
+
+    # List of tuples (name, field type, indices of differing
+    # records, maximum difference):
+    results = []
+
+    # Differing values, as triplets (record number, field name,
+    # text), at most size_lim for each field:
+    values = []
+
+    # Total number of differing values:
+    n_values = 0
+
+    deleted = np.flatnonzero(
+        records_1["deletion"][:n_rec] != records_2["deletion"][:n_rec]
+    )
+
+    if deleted.size != 0:
+        results.append(("(deletion flag)", "", deleted, None))
+
+    for name, (key_1, f_old) in fields_1.items():
+        if name not in fields_2:
+            continue
+
+        key_2, f_new = fields_2[name]
+
+        if (f_old.field_type, f_old.size, f_old.decimal) != (
+            f_new.field_type,
+            f_new.size,
+            f_new.decimal,
+        ):
+            diff_found = True
+            lines.append(
+                f"Descriptors of field {name} differ: {f_old} {f_new}\n"
+            )
+
+        col_old = records_1[key_1][:n_rec]
+        col_new = records_2[key_2][:n_rec]
+        differ, max_diff = _diff_column(
+            col_old, col_new, f_old, f_new, tolerance
+        )
+
+        if differ.size != 0:
+            results.append((name, f_old.field_type, differ, max_diff))
+            n_values += differ.size
+
+            for i in differ[:size_lim].tolist():
+                values.append(
+                    (
+                        i,
+                        name,
+                        f"{col_old[i].decode('latin-1').strip()} "
+                        f"{col_new[i].decode('latin-1').strip()}",
+                    )
+                )
+
+    if results:
+        diff_found = True
+        lines.append("Differences by field:\n")
+        lines.append(
+            "field, type, number of differing records, maximum absolute "
+            "value of relative difference\n"
+        )
+
+        for name, field_type, differ, max_diff in results:
+            line = f"{name}, {field_type}, {differ.size}"
+
+            if max_diff is not None:
+                line += f", {max_diff:.3g}"
+
+            lines.append(line + "\n")
+
+        values.sort()
+        lines.append("\nDiffering values (record, field, old, new):\n")
+
+        for i, name, text in values[:size_lim]:
+            lines.append(f"{i} {name} {text}\n")
+
+        if n_values > size_lim:
+            lines.append("...\n")
+
+    return diff_found
+
+
+def diff_columns(
+    path_1, path_2, detail_file=sys.stdout, tolerance=0.0, size_lim=50
+):
+    """Compare dBase files path_1 and path_2, without pyshp, column by
+    column. Fields are matched by name. Numeric fields (types N and F)
+    are compared within tolerance on the absolute value of relative
+    difference, other fields exactly. Report the number of differing
+    records and the maximum difference for each field, then at most
+    size_lim differing values. Return 0 if no difference is found, 1
+    otherwise.
+
+    """
+
+    detail_subfile = [
+        "\n" + "*" * 10 + "\n\n",
+        f"diff_dbf {path_1} {path_2}\n",
+    ]
+
+    with open(path_1, "rb") as f_obj_1, open(path_2, "rb") as f_obj_2:
+        header_1 = dbf_columns.read_header(f_obj_1)
+        header_2 = dbf_columns.read_header(f_obj_2)
+        map_1 = diff_bin.map_file(f_obj_1)
+        map_2 = diff_bin.map_file(f_obj_2)
+
+        try:
+            diff_found = _diff_records(
+                dbf_columns.record_array(map_1, header_1),
+                dbf_columns.record_array(map_2, header_2),
+                header_1[3],
+                header_2[3],
+                tolerance,
+                size_lim,
+                detail_subfile,
+            )
+        finally:
+            # The record arrays, views of the maps, no longer exist, so
+            # the maps can be closed, except when the arrays are still
+            # referenced by the traceback of an exception:
+            for map_dbf in [map_1, map_2]:
+                if map_dbf is not None:
+                    try:
+                        map_dbf.close()
+                    except BufferError:
+                        pass
+
+    if diff_found:
+        detail_file.writelines(detail_subfile)
+        detail_file.write("\n")
+        return 1
+    else:
+        return 0
+
+
 def main_cli():
     import argparse
 
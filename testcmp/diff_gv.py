@@ -1,25 +1,534 @@
-from networkx import nx_agraph
+"""Comparison of files in Graphviz dot language. The files are parsed
+by a small DOT parser, without Graphviz. Nodes, edges and attributes
+are summarized by canonical hashes, which do not depend on the order
+of statements, so identical graphs are confirmed by comparing hashes.
+If the hashes differ then added and removed nodes and edges and
+changed attributes are listed.
 
-def diff_gv(path_1, path_2, detail_file):
-    """For Graphviz files."""
+"""
 
-    G1 = nx_agraph.read_dot(path_1)
-    G2 = nx_agraph.read_dot(path_2)
+import collections
+import hashlib
+import itertools
+import re
+import sys
 
-    if G1 == G2:
-        returncode = 0
+# A token, after blanks and comments. HTML strings may contain tags,
+# which do not contain angle brackets:
+_TOKEN = re.compile(
+    r"""
+    (?:\s+|//[^\n]*|/\*.*?\*/)*
+    (?:
+    (?P<edgeop>->|--)
+    |(?P<id>[^\W\d]\w*|-?(?:\.\d+|\d+(?:\.\d*)?))
+    |(?P<string>"(?:[^"\\]|\\.)*")
+    |(?P<html><(?:[^<>]|<[^<>]*>)*>)
+    |(?P<punct>[{}\[\]=;,:+])
+    |(?P<error>\S)
+    )
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# Lines beginning with "#" are output of the C preprocessor and are
+# ignored:
+_PREPROCESSOR = re.compile(r"^[ \t]*#[^\n]*", re.MULTILINE)
+
+_KEYWORDS = ["strict", "graph", "digraph", "subgraph", "node", "edge"]
+
+
+class DotSyntaxError(Exception):
+    pass
+
+
+def tokens(text):
+    """Return the list of tokens of DOT text, as pairs (kind, value).
+    kind is "id" for identifiers and numerals, "string" for quoted and
+    HTML strings, "keyword", "edgeop" or a punctuation character.
+    Quoted strings are unquoted and concatenated.
+
+    """
+
+    result = []
+
+    for match in _TOKEN.finditer(_PREPROCESSOR.sub("", text)):
+        kind = match.lastgroup
+        value = match.group(kind)
+
+        if kind == "punct":
+            kind = value
+        elif kind == "id":
+            if value.lower() in _KEYWORDS:
+                kind = "keyword"
+                value = value.lower()
+        elif kind == "html":
+            kind = "string"
+        elif kind == "string":
+            value = value[1:-1].replace('\\"', '"').replace("\\\n", "")
+
+            if (
+                len(result) >= 2
+                and result[-1][0] == "+"
+                and result[-2][0] == "string"
+            ):
+                result.pop()
+                value = result.pop()[1] + value
+        elif kind == "error":
+            raise DotSyntaxError(
+                f"Unexpected character {value!r} at {match.start(kind)}"
+            )
+
+        result.append((kind, value))
+
+    return result
+
+
+class Graph:
+    def __init__(self, directed, strict):
+        self.directed = directed
+        self.strict = strict
+        self.attributes = {}
+
+        # Attributes of subgraphs, by name:
+        self.subgraphs = {}
+
+        # Attributes of nodes, by name:
+        self.nodes = {}
+
+        # List of triplets (tail, head, attributes):
+        self.edges = []
+
+
+class _Parser:
+    def __init__(self, token_list):
+        # Lists of kinds and values of tokens, with sentinels:
+        self.kinds = [kind for kind, value in token_list] + [None, None]
+        self.values = [value for kind, value in token_list] + [None, None]
+
+        self.pos = 0
+        self.graph = None
+
+    def take(self, kind=None):
+        """Return the value of the next token, checking its kind."""
+
+        if self.kinds[self.pos] is None or (
+            kind is not None and self.kinds[self.pos] != kind
+        ):
+            raise DotSyntaxError(
+                f"Expected {kind}, found {self.values[self.pos]!r} at token "
+                f"{self.pos}"
+            )
+
+        self.pos += 1
+        return self.values[self.pos - 1]
+
+    def is_keyword(self, keyword):
+        return (
+            self.kinds[self.pos] == "keyword"
+            and self.values[self.pos] == keyword
+        )
+
+    def identifier(self):
+        if self.kinds[self.pos] not in ["id", "string"]:
+            raise DotSyntaxError(
+                f"Expected identifier, found {self.values[self.pos]!r} at "
+                f"token {self.pos}"
+            )
+
+        self.pos += 1
+        return self.values[self.pos - 1]
+
+    def parse(self):
+        strict = self.is_keyword("strict")
+
+        if strict:
+            self.take()
+
+        value = self.take("keyword")
+
+        if value not in ["graph", "digraph"]:
+            raise DotSyntaxError(f"Expected graph or digraph, found {value}")
+
+        self.graph = Graph(value == "digraph", strict)
+
+        if self.kinds[self.pos] in ["id", "string"]:
+            self.identifier()
+
+        self.take("{")
+        self.stmt_list(self.graph.attributes, {}, {})
+        self.take("}")
+        return self.graph
+
+    def attr_list(self):
+        attributes = {}
+
+        while self.kinds[self.pos] == "[":
+            self.take()
+
+            while self.kinds[self.pos] != "]":
+                key = self.identifier()
+                self.take("=")
+                attributes[key] = self.identifier()
+
+                if self.kinds[self.pos] in [";", ","]:
+                    self.take()
+
+            self.take("]")
+
+        return attributes
+
+    def stmt_list(self, graph_attributes, node_defaults, edge_defaults):
+        """Parse statements up to the closing brace. Return the list of
+        nodes appearing in the statements.
+
+        """
+
+        members = []
+
+        while self.kinds[self.pos] not in ["}", None]:
+            kind = self.kinds[self.pos]
+            value = self.values[self.pos]
+
+            if kind == "keyword" and value in ["graph", "node", "edge"]:
+                self.take()
+                attributes = self.attr_list()
+
+                if value == "graph":
+                    graph_attributes.update(attributes)
+                elif value == "node":
+                    node_defaults.update(attributes)
+                else:
+                    edge_defaults.update(attributes)
+            elif kind in ["id", "string"] and self.kinds[self.pos + 1] == "=":
+                key = self.identifier()
+                self.take("=")
+                graph_attributes[key] = self.identifier()
+            else:
+                self.node_or_edge_stmt(members, node_defaults, edge_defaults)
+
+            if self.kinds[self.pos] == ";":
+                self.take()
+
+        return members
+
+    def add_node(self, name, node_defaults, members):
+        if name not in self.graph.nodes:
+            self.graph.nodes[name] = dict(node_defaults)
+
+        members.append(name)
+
+    def endpoint(self, members, node_defaults, edge_defaults):
+        """Parse a node identifier or a subgraph. Return the list of
+        nodes and the port, or None.
+
+        """
+
+        if self.is_keyword("subgraph") or self.kinds[self.pos] == "{":
+            if self.is_keyword("subgraph"):
+                self.take()
+
+            if self.kinds[self.pos] in ["id", "string"]:
+                attributes = self.graph.subgraphs.setdefault(
+                    self.identifier(), {}
+                )
+            else:
+                # Attributes of anonymous subgraphs are not kept:
+                attributes = {}
+
+            self.take("{")
+            nodes = self.stmt_list(
+                attributes, dict(node_defaults), dict(edge_defaults)
+            )
+            self.take("}")
+            members.extend(nodes)
+            return nodes, None
+
+        name = self.identifier()
+        port = None
+
+        if self.kinds[self.pos] == ":":
+            self.take()
+            port = self.identifier()
+
+            if self.kinds[self.pos] == ":":
+                self.take()
+                port += ":" + self.identifier()
+
+        self.add_node(name, node_defaults, members)
+        return [name], port
+
+    def node_or_edge_stmt(self, members, node_defaults, edge_defaults):
+        endpoints = [self.endpoint(members, node_defaults, edge_defaults)]
+
+        while self.kinds[self.pos] == "edgeop":
+            self.take()
+            endpoints.append(
+                self.endpoint(members, node_defaults, edge_defaults)
+            )
+
+        attributes = self.attr_list()
+
+        if len(endpoints) == 1:
+            nodes, port = endpoints[0]
+
+            if len(nodes) == 1:
+                self.graph.nodes[nodes[0]].update(attributes)
+        else:
+            for (tails, tailport), (heads, headport) in zip(
+                endpoints, endpoints[1:]
+            ):
+                edge_attributes = dict(edge_defaults)
+                edge_attributes.update(attributes)
+
+                if tailport is not None:
+                    edge_attributes["tailport"] = tailport
+
+                if headport is not None:
+                    edge_attributes["headport"] = headport
+
+                for tail in tails:
+                    for head in heads:
+                        self.graph.edges.append(
+                            (tail, head, edge_attributes)
+                        )
+
+
+def read_dot(filename):
+    """Return a Graph object."""
+
+    with open(filename) as f_obj:
+        return _Parser(tokens(f_obj.read())).parse()
+
+
+def _canonical_attributes(attributes):
+    return tuple(sorted(attributes.items()))
+
+
+def _edge_key(graph, tail, head):
+    if graph.directed:
+        return tail, head
+    else:
+        return min(tail, head), max(tail, head)
+
+
+def canonical_edges(graph):
+    """Return a dictionary: for each pair of end nodes, the sorted list
+    of canonical attributes of the edges between them.
+
+    """
+
+    edges = collections.defaultdict(list)
+
+    if graph.strict:
+        # At most one edge between two nodes, with merged attributes:
+        merged = {}
+
+        for tail, head, attributes in graph.edges:
+            merged.setdefault(_edge_key(graph, tail, head), {}).update(
+                attributes
+            )
+
+        for key, attributes in merged.items():
+            edges[key].append(_canonical_attributes(attributes))
     else:
-        returncode = 1
-        detail_file.write('\n' + "*" * 10 + '\n\n')
-        detail_file.write(f"diff {path_1} {path_2}\n")
-        detail_file.write(f"Equality of nodes: {G1.nodes == G2.nodes}\n")
-        detail_file.write(f"Equality of edges: {G1.edges == G2.edges}\n")
-        detail_file.write(f"Equality of adjacencies: {G1.adj == G2.adj}\n")
-        detail_file.write(f"Equality of attributes: {G1.graph == G2.graph}\n")
+        for tail, head, attributes in graph.edges:
+            edges[_edge_key(graph, tail, head)].append(
+                _canonical_attributes(attributes)
+            )
+
+    for attr_lists in edges.values():
+        attr_lists.sort()
+
+    return edges
+
+
+def _digest(item):
+    return int.from_bytes(
+        hashlib.blake2b(repr(item).encode(), digest_size=16).digest(), "little"
+    )
+
+
+def graph_hash(graph, edges):
+    """Return a hash of the graph which does not depend on the order of
+    statements. edges is the dictionary returned by canonical_edges.
+    The hash of the graph is the sum of the hashes of its parts, so
+    they do not need to be sorted.
+
+    """
+
+    parts = itertools.chain(
+        [
+            (
+                graph.directed,
+                graph.strict,
+                _canonical_attributes(graph.attributes),
+            )
+        ],
+        (
+            ("subgraph", name, _canonical_attributes(attributes))
+            for name, attributes in graph.subgraphs.items()
+        ),
+        (
+            ("node", name, _canonical_attributes(attributes))
+            for name, attributes in graph.nodes.items()
+        ),
+        (("edge",) + item for item in edges.items()),
+    )
+    return sum(map(_digest, parts)) % (1 << 128)
+
+
+def _attribute_changes(attr_1, attr_2):
+    """Return the text describing the differences between the
+    dictionaries of attributes.
+
+    """
+
+    changes = []
+
+    for key in sorted(attr_1.keys() | attr_2.keys()):
+        value_1 = attr_1.get(key)
+        value_2 = attr_2.get(key)
+
+        if value_1 != value_2:
+            value_1 = "(absent)" if value_1 is None else repr(value_1)
+            value_2 = "(absent)" if value_2 is None else repr(value_2)
+            changes.append(f"{key}: {value_1} {value_2}")
+
+    return ", ".join(changes)
+
+
+def _write_items(detail_file, title, items, max_n_diff):
+    if items:
+        detail_file.write(f"{title}: {len(items)}\n")
+
+        for item in items[:max_n_diff]:
+            detail_file.write(f"{item}\n")
+
+        if max_n_diff is not None and len(items) > max_n_diff:
+            detail_file.write("...\n")
+
+
+def diff_gv(path_1, path_2, detail_file=sys.stdout, max_n_diff=None):
+    """For Graphviz files. Report at most max_n_diff items of each kind
+    of difference.
+
+    """
+
+    graph_1 = read_dot(path_1)
+    graph_2 = read_dot(path_2)
+    edges_1 = canonical_edges(graph_1)
+    edges_2 = canonical_edges(graph_2)
+
+    if graph_hash(graph_1, edges_1) == graph_hash(graph_2, edges_2):
+        return 0
+
+    detail_file.write("\n" + "*" * 10 + "\n\n")
+    detail_file.write(f"diff_gv {path_1} {path_2}\n")
+
+    if (graph_1.directed, graph_1.strict) != (
+        graph_2.directed,
+        graph_2.strict,
+    ):
+        detail_file.write(
+            "Kinds of graphs differ (directed, strict): "
+            f"{graph_1.directed, graph_1.strict} "
+            f"{graph_2.directed, graph_2.strict}\n"
+        )
+
+    changes = _attribute_changes(graph_1.attributes, graph_2.attributes)
+
+    if changes:
+        detail_file.write(f"Graph attributes differ: {changes}\n")
+
+    _write_items(
+        detail_file,
+        "Subgraphs with different attributes",
+        [
+            f"{name}: "
+            + _attribute_changes(
+                graph_1.subgraphs.get(name, {}),
+                graph_2.subgraphs.get(name, {}),
+            )
+            for name in sorted(graph_1.subgraphs.keys() | graph_2.subgraphs)
+            if graph_1.subgraphs.get(name, {})
+            != graph_2.subgraphs.get(name, {})
+        ],
+        max_n_diff,
+    )
+    edge_op = " -> " if graph_1.directed else " -- "
+
+    for graph_a, graph_b, which in [
+        (graph_1, graph_2, "old"),
+        (graph_2, graph_1, "new"),
+    ]:
+        _write_items(
+            detail_file,
+            f"Nodes only in {which} file",
+            sorted(graph_a.nodes.keys() - graph_b.nodes.keys()),
+            max_n_diff,
+        )
+
+    _write_items(
+        detail_file,
+        "Nodes with different attributes",
+        [
+            f"{name}: "
+            + _attribute_changes(graph_1.nodes[name], graph_2.nodes[name])
+            for name in sorted(graph_1.nodes.keys() & graph_2.nodes.keys())
+            if graph_1.nodes[name] != graph_2.nodes[name]
+        ],
+        max_n_diff,
+    )
+
+    # Edges between the same nodes with a single edge on each side
+    # are compared attribute by attribute, other edges are only
+    # matched if their attributes are identical:
+    changed = []
+    only = {"old": [], "new": []}
+
+    for key in sorted(edges_1.keys() | edges_2.keys()):
+        attr_lists_1 = edges_1.get(key, [])
+        attr_lists_2 = edges_2.get(key, [])
+
+        if attr_lists_1 == attr_lists_2:
+            continue
+
+        if len(attr_lists_1) == 1 and len(attr_lists_2) == 1:
+            changed.append(
+                key[0]
+                + edge_op
+                + key[1]
+                + ": "
+                + _attribute_changes(
+                    dict(attr_lists_1[0]), dict(attr_lists_2[0])
+                )
+            )
+        else:
+            remaining = collections.Counter(attr_lists_2)
+            remaining.subtract(attr_lists_1)
+
+            for attributes, count in sorted(remaining.items()):
+                which = "new" if count > 0 else "old"
+
+                for _ in range(abs(count)):
+                    only[which].append(
+                        key[0] + edge_op + key[1] + f" {dict(attributes)}"
+                    )
+
+    for which in ["old", "new"]:
+        _write_items(
+            detail_file,
+            f"Edges only in {which} file",
+            only[which],
+            max_n_diff,
+        )
+
+    _write_items(
+        detail_file, "Edges with different attributes", changed, max_n_diff
+    )
+    detail_file.write("\n")
+    return 1
 
-    return returncode
 
 def main_cli():
-    import sys
-    
     return diff_gv(sys.argv[1], sys.argv[2], sys.stdout)
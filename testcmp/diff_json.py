@@ -0,0 +1,483 @@
+"""Comparison of JSON files. The files are read by chunks and parsed
+into streams of events, which are walked in parallel, so that large
+documents are never loaded in full: only values nested deeper than
+WHOLE_DEPTH are decoded whole. Numbers are compared with a tolerance.
+Members of objects are compared in the order of the files: if the keys
+diverge, the remaining members of the two objects are loaded and
+matched by key.
+
+"""
+
+import json
+import re
+import sys
+
+# Number of characters read at once:
+CHUNK_SIZE = 1 << 16
+
+# Values nested in at least this number of containers are decoded
+# whole, by the json module, instead of being parsed into events:
+WHOLE_DEPTH = 2
+
+# Default maximum depth of reported differences. Deeper differences are
+# reported at this depth, for the whole subtree:
+MAX_DEPTH = 16
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
+def events(f_obj, whole_depth=WHOLE_DEPTH):
+    """Yield the parsing events of the JSON document in file object
+    f_obj, read by chunks, as pairs (event, value). event is
+    "start_map", "end_map", "start_array", "end_array", "key" or
+    "value". value is the key or the value, None for the other
+    events. Values nested in at least whole_depth containers are
+    decoded whole and yielded as a single "value" event, so value may
+    also be a dictionary or a list.
+
+    """
+
+    buffer = f_obj.read(CHUNK_SIZE)
+    eof = buffer == ""
+    pos = 0
+    containers = []
+    expect_key = False
+
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+
+        if pos == len(buffer):
+            if eof:
+                return
+
+            buffer = f_obj.read(CHUNK_SIZE)
+            eof = buffer == ""
+            pos = 0
+            continue
+
+        char = buffer[pos]
+
+        if char in "{[" and len(containers) < whole_depth:
+            containers.append(char)
+            expect_key = char == "{"
+            pos += 1
+            yield ("start_map" if char == "{" else "start_array"), None
+        elif char in "}]":
+            containers.pop()
+            expect_key = False
+            pos += 1
+            yield ("end_map" if char == "}" else "end_array"), None
+        elif char == ",":
+            expect_key = containers[-1] == "{"
+            pos += 1
+        elif char == ":":
+            pos += 1
+        else:
+            try:
+                value, end = _DECODER.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+
+                end = None
+
+            # Close to the end of the buffer, a number might be cut:
+            if end is None or len(buffer) - end < 3 and not eof:
+                # Read more, at least as much as we have, and decode
+                # again:
+                more = f_obj.read(max(CHUNK_SIZE, len(buffer) - pos))
+                eof = more == ""
+                buffer = buffer[pos:] + more
+                pos = 0
+            else:
+                pos = end
+
+                if expect_key:
+                    expect_key = False
+                    yield "key", value
+                else:
+                    yield "value", value
+
+
+def _object_events(obj):
+    """Yield the parsing events of a Python object, as events would for
+    its JSON representation.
+
+    """
+
+    if isinstance(obj, dict):
+        yield "start_map", None
+
+        for key, value in obj.items():
+            yield "key", key
+            yield from _object_events(value)
+
+        yield "end_map", None
+    elif isinstance(obj, list):
+        yield "start_array", None
+
+        for value in obj:
+            yield from _object_events(value)
+
+        yield "end_array", None
+    else:
+        yield "value", obj
+
+
+class _Stream:
+    """Iterator on events, keeping track of the nesting level."""
+
+    def __init__(self, event_iter):
+        self._event_iter = event_iter
+        self.level = 0
+
+    def next(self):
+        event, value = next(self._event_iter, ("end", None))
+
+        if event.startswith("start"):
+            self.level += 1
+        elif event.startswith("end_"):
+            self.level -= 1
+
+        return event, value
+
+    def skip(self, event):
+        """Consume the rest of the value starting with the event just
+        read.
+
+        """
+
+        if event.startswith("start"):
+            level = self.level - 1
+
+            while self.level > level:
+                self.next()
+
+    def load(self, event, value):
+        """Return the Python object starting with the event just
+        read.
+
+        """
+
+        if event == "start_map":
+            obj = {}
+
+            while True:
+                event, key = self.next()
+
+                if event != "key":
+                    return obj
+
+                obj[key] = self.load(*self.next())
+        elif event == "start_array":
+            obj = []
+
+            while True:
+                event, value = self.next()
+
+                if event == "end_array":
+                    return obj
+
+                obj.append(self.load(event, value))
+        else:
+            return value
+
+
+class _Stop(Exception):
+    pass
+
+
+def _member_path(path, key):
+    if key.isidentifier():
+        return f"{path}.{key}"
+    else:
+        return f"{path}[{json.dumps(key)}]"
+
+
+def _describe(event, value):
+    if event == "start_map":
+        return "object"
+    elif event == "start_array":
+        return "array"
+    else:
+        return json.dumps(value)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _Walk:
+    """Parallel walk of two streams of events."""
+
+    def __init__(self, tolerance, abs_tol, max_depth, max_n_diff, quiet):
+        self.tolerance = tolerance
+        self.abs_tol = abs_tol
+        self.max_depth = max_depth
+        self.max_n_diff = max_n_diff
+        self.quiet = quiet
+        self.n_diff = 0
+        self.lines = []
+
+        # Depth of the subtree compared without report, None if
+        # differences are reported:
+        self._silent_depth = None
+
+    def report(self, path, text):
+        if self.quiet:
+            raise _Stop
+
+        if self._silent_depth is not None:
+            # Only report the root of the subtree:
+            raise _Stop
+
+        self.n_diff += 1
+        self.lines.append(f"{path}: {text}\n")
+
+        if self.max_n_diff is not None and self.n_diff >= self.max_n_diff:
+            self.lines.append("Too many differences. Stopping comparison.\n")
+            raise _Stop
+
+    def scalars(self, path, value_1, value_2):
+        if _is_number(value_1) and _is_number(value_2):
+            equal = value_1 == value_2 or abs(
+                value_2 - value_1
+            ) <= self.abs_tol + self.tolerance * abs(value_1)
+        else:
+            equal = type(value_1) == type(value_2) and value_1 == value_2
+
+        if not equal:
+            self.report(path, f"{json.dumps(value_1)} {json.dumps(value_2)}")
+
+    def value(self, path, depth, stream_1, stream_2, first_1, first_2):
+        """Compare the values starting with events first_1 and first_2,
+        just read from stream_1 and stream_2, and consume them.
+
+        """
+
+        event_1 = first_1[0]
+        event_2 = first_2[0]
+
+        if event_1 == "value" and event_2 == "value":
+            value_1 = first_1[1]
+            value_2 = first_2[1]
+
+            if not isinstance(value_1, (dict, list)) and not isinstance(
+                value_2, (dict, list)
+            ):
+                self.scalars(path, value_1, value_2)
+            elif type(value_1) != type(value_2) or value_1 != value_2:
+                # Values decoded whole, walk them only if they differ:
+                sub_1 = _Stream(_object_events(value_1))
+                sub_2 = _Stream(_object_events(value_2))
+                self.value(
+                    path, depth, sub_1, sub_2, sub_1.next(), sub_2.next()
+                )
+        elif event_1 != event_2:
+            stream_1.skip(event_1)
+            stream_2.skip(event_2)
+            self.report(
+                path, f"{_describe(*first_1)}, {_describe(*first_2)}"
+            )
+        elif depth >= self.max_depth and self._silent_depth is None:
+            level_1 = stream_1.level
+            level_2 = stream_2.level
+            self._silent_depth = depth
+
+            try:
+                self.container(path, depth, stream_1, stream_2, event_1)
+                differ = False
+            except _Stop:
+                differ = True
+
+                # Consume the rest of the subtrees:
+                while stream_1.level >= level_1:
+                    stream_1.next()
+
+                while stream_2.level >= level_2:
+                    stream_2.next()
+            finally:
+                self._silent_depth = None
+
+            if differ:
+                self.report(path, "subtrees differ")
+        else:
+            self.container(path, depth, stream_1, stream_2, event_1)
+
+    def container(self, path, depth, stream_1, stream_2, event):
+        if event == "start_map":
+            self.object(path, depth, stream_1, stream_2)
+        else:
+            self.array(path, depth, stream_1, stream_2)
+
+    def object(self, path, depth, stream_1, stream_2):
+        while True:
+            event_1, key_1 = stream_1.next()
+            event_2, key_2 = stream_2.next()
+
+            if event_1 != "key" or event_2 != "key" or key_1 != key_2:
+                break
+
+            self.value(
+                _member_path(path, key_1),
+                depth + 1,
+                stream_1,
+                stream_2,
+                stream_1.next(),
+                stream_2.next(),
+            )
+
+        if event_1 == "end_map" and event_2 == "end_map":
+            return
+
+        # The keys diverge, load the remaining members:
+        rest_1 = {}
+        rest_2 = {}
+
+        for stream, event, key, rest in [
+            (stream_1, event_1, key_1, rest_1),
+            (stream_2, event_2, key_2, rest_2),
+        ]:
+            while event == "key":
+                rest[key] = stream.load(*stream.next())
+                event, key = stream.next()
+
+        for key, member in rest_1.items():
+            member_path = _member_path(path, key)
+
+            if key in rest_2:
+                sub_1 = _Stream(_object_events(member))
+                sub_2 = _Stream(_object_events(rest_2[key]))
+                self.value(
+                    member_path,
+                    depth + 1,
+                    sub_1,
+                    sub_2,
+                    sub_1.next(),
+                    sub_2.next(),
+                )
+            else:
+                self.report(member_path, "only in old file")
+
+        # In the order of the new file, so that the report does not
+        # change from run to run:
+        for key in rest_2:
+            if key not in rest_1:
+                self.report(_member_path(path, key), "only in new file")
+
+    def array(self, path, depth, stream_1, stream_2):
+        i = 0
+
+        while True:
+            first_1 = stream_1.next()
+            first_2 = stream_2.next()
+
+            if first_1[0] == "end_array" or first_2[0] == "end_array":
+                break
+
+            self.value(
+                f"{path}[{i}]", depth + 1, stream_1, stream_2, first_1, first_2
+            )
+            i += 1
+
+        for stream, first, which in [
+            (stream_1, first_1, "old"),
+            (stream_2, first_2, "new"),
+        ]:
+            n_more = 0
+            event = first[0]
+
+            while event != "end_array":
+                n_more += 1
+                stream.skip(event)
+                event = stream.next()[0]
+
+            if n_more != 0:
+                self.report(
+                    path,
+                    f"lengths differ, {n_more} more elements in {which} file",
+                )
+
+
+def diff_json(
+    path_1,
+    path_2,
+    detail_file=sys.stdout,
+    tolerance=0.0,
+    abs_tol=0.0,
+    max_depth=MAX_DEPTH,
+    max_n_diff=None,
+    quiet=False,
+    whole_depth=WHOLE_DEPTH,
+):
+    """Compare JSON files path_1 and path_2. Numbers are equal if their
+    absolute difference is at most abs_tol + tolerance * absolute value
+    of old number. Differences deeper than max_depth are reported once
+    for the subtree at depth max_depth. The comparison stops after
+    max_n_diff differences. If quiet is true then nothing is written
+    and the comparison stops at the first difference. For whole_depth,
+    see events. Return 0 if no difference is found, 1 otherwise.
+
+    """
+
+    walk = _Walk(tolerance, abs_tol, max_depth, max_n_diff, quiet)
+
+    with open(path_1) as f_obj_1, open(path_2) as f_obj_2:
+        stream_1 = _Stream(events(f_obj_1, whole_depth))
+        stream_2 = _Stream(events(f_obj_2, whole_depth))
+
+        try:
+            walk.value(
+                "$", 0, stream_1, stream_2, stream_1.next(), stream_2.next()
+            )
+        except _Stop:
+            if quiet:
+                return 1
+
+    if walk.n_diff == 0:
+        return 0
+
+    detail_file.write("\n" + "*" * 10 + "\n\n")
+    detail_file.write(f"diff_json {path_1} {path_2}\n")
+    detail_file.writelines(walk.lines)
+    detail_file.write("\n")
+    return 1
+
+
+def main_cli():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old", help="JSON file")
+    parser.add_argument("new", help="JSON file")
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        default=0.0,
+        type=float,
+        help="maximum relative difference of numbers (default 0.)",
+    )
+    parser.add_argument(
+        "-a",
+        "--abs-tol",
+        default=0.0,
+        type=float,
+        help="maximum absolute difference of numbers, added to the "
+        "relative one (default 0.)",
+    )
+    parser.add_argument(
+        "-m", "--max-n-diff", type=int, help="maximum number of differences"
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="suppress all normal output"
+    )
+    args = parser.parse_args()
+    return diff_json(
+        args.old,
+        args.new,
+        tolerance=args.tolerance,
+        abs_tol=args.abs_tol,
+        max_n_diff=args.max_n_diff,
+        quiet=args.quiet,
+    )
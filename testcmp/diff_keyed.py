@@ -0,0 +1,374 @@
+"""Comparison of CSV files whose rows may be in different orders. Rows
+of the two files are matched on the values of key columns, through a
+hash index, and matched rows are compared field by field, with a
+numeric tolerance. If the files are large, rows are first partitioned
+on disk into buckets, by hash of the key, and buckets are joined one
+at a time, so that memory stays bounded.
+
+"""
+
+import collections
+import csv
+import heapq
+from os import path
+import sys
+import tempfile
+
+import numpy as np
+
+from testcmp import diff_csv
+
+# Above this total size in bytes of the two files, rows are
+# partitioned into buckets on disk:
+SPILL_BYTES = 1 << 26
+
+# Maximum number of buckets:
+MAX_BUCKETS = 256
+
+
+class _FirstRows:
+    """Count items and keep the size_lim items with smallest row
+    numbers.
+
+    """
+
+    def __init__(self, size_lim):
+        self.size_lim = size_lim
+        self.count = 0
+        self._heap = []
+
+    def add(self, row_number, text):
+        self.count += 1
+        item = (-row_number, text)
+
+        if len(self._heap) < self.size_lim:
+            heapq.heappush(self._heap, item)
+        elif self.size_lim > 0 and item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+
+    def items(self):
+        return sorted((-minus_row, text) for minus_row, text in self._heap)
+
+
+def has_keys(filename, keys, delimiter=","):
+    """Return True if each column in the list keys is found in the CSV
+    file filename, by name in its header or as a 1-based number, as
+    diff_keyed would look for it.
+
+    """
+
+    with open(filename, newline="") as f_obj:
+        names = next(csv.reader(f_obj, delimiter=delimiter), [])
+
+    return all(k in names or k.isdigit() and int(k) >= 1 for k in keys)
+
+
+class _Layout:
+    """Indices of key and value columns in one file."""
+
+    def __init__(self, keys, names, value_names):
+        """names is the list of column names in the header of the file,
+        or None if there is no header.
+
+        """
+
+        self.key = []
+
+        for k in keys:
+            if names is not None and k in names:
+                self.key.append(names.index(k))
+            elif k.isdigit() and int(k) >= 1:
+                self.key.append(int(k) - 1)
+            else:
+                raise ValueError(f"Key column {k!r} not found")
+
+        if value_names is None:
+            self.values = None
+        else:
+            self.values = [names.index(name) for name in value_names]
+
+    def get_key(self, row):
+        return tuple(row[i] if i < len(row) else "" for i in self.key)
+
+    def get_values(self, row):
+        if self.values is None:
+            return [x for i, x in enumerate(row) if i not in self.key]
+        else:
+            return [row[i] if i < len(row) else "" for i in self.values]
+
+
+class _Join:
+    """Accumulate the results of the join of the two files."""
+
+    def __init__(
+        self, layout_old, layout_new, value_names, tolerance, n_item
+    ):
+        self.layout_old = layout_old
+        self.layout_new = layout_new
+        self.value_names = value_names
+        self.tolerance = tolerance
+        self.only_old = _FirstRows(n_item)
+        self.only_new = _FirstRows(n_item)
+        self.differ = _FirstRows(n_item)
+        self.n_matched = 0
+        self.max_rel = 0.0
+
+    def join(self, rows_old, rows_new):
+        """rows_old and rows_new are iterables of pairs (line number,
+        row). Match them on key and compare matched rows.
+
+        """
+
+        index = {}
+
+        for line_num, row in rows_old:
+            index.setdefault(
+                self.layout_old.get_key(row), collections.deque()
+            ).append((line_num, row))
+
+        pairs = []
+
+        for line_num, row in rows_new:
+            key = self.layout_new.get_key(row)
+            matches = index.get(key)
+
+            if matches:
+                pairs.append((key, matches.popleft(), (line_num, row)))
+
+                if not matches:
+                    del index[key]
+            else:
+                self.only_new.add(line_num, f"line {line_num}: key {key}")
+
+        for key, matches in index.items():
+            for line_num, row in matches:
+                self.only_old.add(line_num, f"line {line_num}: key {key}")
+
+        self.n_matched += len(pairs)
+        self._compare(pairs)
+
+    def _compare(self, pairs):
+        """Compare values of matched rows. Numbers are compared with
+        relative tolerance, relative to the smaller absolute value,
+        other values are compared exactly.
+
+        """
+
+        # Differing fields for each pair, as lists of (column, old
+        # value, new value), and numeric fields to compare:
+        differing = {}
+        x = []
+        y = []
+        numeric = []
+
+        for i_pair, (key, old, new) in enumerate(pairs):
+            values_old = self.layout_old.get_values(old[1])
+            values_new = self.layout_new.get_values(new[1])
+
+            if len(values_old) != len(values_new):
+                differing[i_pair] = [
+                    ("number of fields", len(values_old), len(values_new))
+                ]
+            else:
+                for j, v_old in enumerate(values_old):
+                    v_new = values_new[j]
+
+                    if v_old != v_new:
+                        f_old = diff_csv.to_float(v_old)
+                        f_new = diff_csv.to_float(v_new)
+
+                        if f_old is None or f_new is None:
+                            differing.setdefault(i_pair, []).append(
+                                (self._column(j), v_old, v_new)
+                            )
+                        else:
+                            x.append(f_old)
+                            y.append(f_new)
+                            numeric.append((i_pair, j, v_old, v_new))
+
+        if x:
+            x = np.array(x)
+            y = np.array(y)
+            abs_err = np.abs(x - y)
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rel_err = np.where(
+                    abs_err == 0,
+                    0.0,
+                    abs_err / np.minimum(np.abs(x), np.abs(y)),
+                )
+
+            self.max_rel = max(self.max_rel, np.max(rel_err))
+
+            for k in np.flatnonzero(rel_err > self.tolerance):
+                i_pair, j, v_old, v_new = numeric[k]
+                differing.setdefault(i_pair, []).append(
+                    (self._column(j), v_old, v_new)
+                )
+
+        for i_pair, fields in differing.items():
+            key, (line_old, row_old), (line_new, row_new) = pairs[i_pair]
+            text = "; ".join(f"{c}: {v_1} {v_2}" for c, v_1, v_2 in fields)
+            self.differ.add(
+                line_old, f"lines {line_old} {line_new}, key {key}: {text}"
+            )
+
+    def _column(self, j):
+        if self.value_names is None:
+            return f"value {j + 1}"
+        else:
+            return self.value_names[j]
+
+
+def _rows(reader):
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _partition(reader, layout, directory, tag, n_buckets):
+    """Write rows into n_buckets files in directory, by hash of key.
+    Return the list of file names.
+
+    """
+
+    filenames = [
+        path.join(directory, f"{tag}_{i}.csv") for i in range(n_buckets)
+    ]
+    files = [open(f, "w", newline="") for f in filenames]
+    writers = [csv.writer(f) for f in files]
+
+    for line_num, row in _rows(reader):
+        i = hash(layout.get_key(row)) % n_buckets
+        writers[i].writerow([line_num] + row)
+
+    for f in files:
+        f.close()
+
+    return filenames
+
+
+def _read_bucket(filename):
+    with open(filename, newline="") as f:
+        for row in csv.reader(f):
+            yield int(row[0]), row[1:]
+
+
+def diff_keyed(
+    path_1,
+    path_2,
+    detail_file=sys.stdout,
+    keys=None,
+    names=None,
+    tolerance=1e-7,
+    size_lim=50,
+    delimiter=",",
+    header=True,
+    spill_bytes=SPILL_BYTES,
+):
+    """Compare CSV files path_1 and path_2, matching rows on the values
+    of the columns in the list keys. Each key column is given by name,
+    if header is true, or by 1-based number. If header is true then
+    other columns are matched by name. Rows found in one file only and
+    matched rows with different values are reported separately. If the
+    total size of the files is larger than spill_bytes then rows are
+    partitioned on disk before being joined. If keys is None or empty
+    then all rows have the same key, so rows are matched in their order
+    in the files.
+
+    """
+
+    if keys is None:
+        keys = []
+
+    with open(path_1, newline="") as f_old, open(
+        path_2, newline=""
+    ) as f_new:
+        reader_old = csv.reader(f_old, delimiter=delimiter)
+        reader_new = csv.reader(f_new, delimiter=delimiter)
+        detail_subfile = []
+
+        if header:
+            names_old = next(reader_old, [])
+            names_new = next(reader_new, [])
+            value_names = [
+                x for x in names_old if x in names_new and x not in keys
+            ]
+
+            for tag, my_names, other in [
+                ("old", names_old, names_new),
+                ("new", names_new, names_old),
+            ]:
+                only = [x for x in my_names if x not in other]
+
+                if only:
+                    detail_subfile.append(
+                        f"Columns only in {tag} file: {only}\n"
+                    )
+        else:
+            names_old = None
+            names_new = None
+            value_names = None
+
+        layout_old = _Layout(keys, names_old, value_names)
+        layout_new = _Layout(keys, names_new, value_names)
+        my_join = _Join(
+            layout_old,
+            layout_new,
+            value_names,
+            tolerance,
+            max(size_lim // 3 - 2, 0),
+        )
+        total_size = path.getsize(path_1) + path.getsize(path_2)
+
+        if total_size <= spill_bytes:
+            my_join.join(_rows(reader_old), _rows(reader_new))
+        else:
+            n_buckets = min(2 * (total_size // spill_bytes + 1), MAX_BUCKETS)
+
+            with tempfile.TemporaryDirectory() as directory:
+                buckets_old = _partition(
+                    reader_old, layout_old, directory, "old", n_buckets
+                )
+                buckets_new = _partition(
+                    reader_new, layout_new, directory, "new", n_buckets
+                )
+
+                for bucket_old, bucket_new in zip(buckets_old, buckets_new):
+                    my_join.join(
+                        _read_bucket(bucket_old), _read_bucket(bucket_new)
+                    )
+
+    for tag, first_rows in [
+        ("Rows only in old file", my_join.only_old),
+        ("Rows only in new file", my_join.only_new),
+        ("Matched rows with different values", my_join.differ),
+    ]:
+        if first_rows.count != 0:
+            detail_subfile.append(f"{tag}: {first_rows.count}\n")
+            detail_subfile.extend(
+                text + "\n" for line_num, text in first_rows.items()
+            )
+
+            if first_rows.count > len(first_rows.items()):
+                detail_subfile.append("...\n")
+
+    if detail_subfile:
+        detail_file.write("\n" + "*" * 10 + "\n\n")
+
+        if names is None:
+            detail_file.write(f"diff_keyed {path_1} {path_2}\n")
+        else:
+            detail_file.write(f"diff_keyed {names[0]} {names[1]}\n")
+
+        detail_file.write(
+            f"Comparison of rows matched on key columns {keys}, tolerance "
+            f"{tolerance}:\n"
+        )
+        detail_file.writelines(detail_subfile)
+        detail_file.write(
+            f"Maximum relative error in {my_join.n_matched} matched rows: "
+            f"{my_join.max_rel:.2e}\n\n"
+        )
+        return 1
+    else:
+        return 0
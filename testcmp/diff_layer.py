@@ -0,0 +1,190 @@
+"""Comparison of shapefile layers, treating the main file, the index file
+and the dBase file as one unit. Shapes and attributes are read together
+in a single pass, and the differences in geometry and attributes of a
+feature are reported together.
+
+"""
+
+import io
+import itertools
+import numbers
+from os import path
+import sys
+
+import shapefile
+
+from . import dbf_columns
+from . import diff_dbf
+from . import diff_shapes
+
+# Number of features compared at once:
+BATCH_SIZE = 1024
+
+# Suffixes of the files making up a layer:
+SUFFIXES = [".shp", ".shx", ".dbf"]
+
+
+def layer_root(filename):
+    """Return the path of filename without suffix if filename is part of
+    a layer, None otherwise.
+
+    """
+
+    root, suffix = path.splitext(filename)
+    return root if suffix.lower() in SUFFIXES else None
+
+
+def is_layer(root):
+    """Check whether root + ".shp" and root + ".dbf" exist."""
+
+    return path.exists(root + ".shp") and path.exists(root + ".dbf")
+
+
+def _diff_attributes(i_shape, fields, r_old, r_new, tolerance):
+    """Return the text describing the differences between the attributes
+    of the feature, or an empty string if there is none. fields is the
+    list of field descriptions of the layers. Numeric fields are
+    compared with relative tolerance, as by diff_dbf.diff_columns.
+
+    """
+
+    lines = []
+
+    for field, v_old, v_new in zip(fields, r_old, r_new):
+        if v_old != v_new:
+            line = f"{field[0]}: {v_old} {v_new}"
+
+            if (
+                isinstance(v_old, numbers.Real)
+                and isinstance(v_new, numbers.Real)
+                and not isinstance(v_old, bool)
+            ):
+                rel_diff = float(diff_dbf.relative_difference(v_old, v_new))
+
+                if field[1] in dbf_columns.NUMERIC and rel_diff <= tolerance:
+                    continue
+
+                line += f", relative difference {rel_diff:.3g}"
+
+            lines.append(line + "\n")
+
+    if lines:
+        return f"Attributes for shape {i_shape} differ:\n" + "".join(lines)
+    else:
+        return ""
+
+
+def diff_layer(
+    old,
+    new,
+    detail_file=sys.stdout,
+    tolerance=0.0,
+    max_n_diff=None,
+    report_identical=False,
+    distance=None,
+):
+    """old and new are paths to shapefiles, with or without suffix.
+    Compare the shapes and the attributes of their features in a single
+    pass. Shapes are compared as by diff_shp, numeric attributes with
+    relative tolerance, as by diff_dbf.diff_columns, other attributes
+    exactly. The comparison stops after max_n_diff differing features,
+    at least one.
+
+    """
+
+    if max_n_diff is not None:
+        # Even with no budget left, find whether the layers differ:
+        max_n_diff = max(max_n_diff, 1)
+
+    detail_subfile = io.StringIO()
+    detail_subfile.write("\n" + "*" * 10 + "\n\n")
+    detail_subfile.write(f"diff_layer {old} {new}\n")
+    diff_found = False
+
+    with shapefile.Reader(old) as reader_old, shapefile.Reader(
+        new
+    ) as reader_new:
+        num_records_old = len(reader_old)
+        num_records_new = len(reader_new)
+
+        if num_records_old != num_records_new:
+            diff_found = True
+            detail_subfile.write(
+                "Not the same number of records: "
+                f"{num_records_old} {num_records_new}\n"
+            )
+            n_rec = min(num_records_old, num_records_new)
+            detail_subfile.write(
+                f"Comparing the first {n_rec} records...\n"
+            )
+
+        fields_old = reader_old.fields[1:]
+        fields_new = reader_new.fields[1:]
+        same_fields = fields_old == fields_new
+
+        if not same_fields:
+            diff_found = True
+            detail_subfile.write(
+                "Not the same fields, comparing shapes only:\n"
+            )
+            detail_subfile.write(f"Old fields: {fields_old}\n")
+            detail_subfile.write(f"New fields: {fields_new}\n")
+
+        feature_pairs = enumerate(
+            zip(reader_old.iterShapeRecords(), reader_new.iterShapeRecords())
+        )
+        detail_subfile.write("Differences in features:\n")
+        n_diff = 0
+
+        while max_n_diff is None or n_diff < max_n_diff:
+            batch = list(itertools.islice(feature_pairs, BATCH_SIZE))
+
+            if not batch:
+                break
+
+            shape_results = diff_shapes.diff_shapes_bulk(
+                [
+                    (i_shape, sr_old.shape, sr_new.shape)
+                    for i_shape, (sr_old, sr_new) in batch
+                ],
+                report_identical,
+                tolerance,
+                distance,
+            )
+
+            for (i_shape, (sr_old, sr_new)), (ret_code, text) in zip(
+                batch, shape_results
+            ):
+                if same_fields:
+                    attributes = _diff_attributes(
+                        i_shape,
+                        fields_old,
+                        sr_old.record,
+                        sr_new.record,
+                        tolerance,
+                    )
+                else:
+                    attributes = ""
+
+                if ret_code != 0 or attributes:
+                    n_diff += 1
+
+                if attributes and not text:
+                    text = "\n"
+
+                detail_subfile.write(text + attributes)
+
+                if max_n_diff is not None and n_diff >= max_n_diff:
+                    detail_subfile.write(
+                        "\nToo many different features. Stopping "
+                        "comparison.\n"
+                    )
+                    break
+
+    diff_found = diff_found or n_diff != 0
+    detail_subfile.write("\n")
+
+    if diff_found or report_identical:
+        detail_file.write(detail_subfile.getvalue())
+
+    return 1 if diff_found else 0
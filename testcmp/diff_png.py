@@ -0,0 +1,179 @@
+"""Comparison of PNG images. Both images are decoded once into NumPy
+arrays and compared tile by tile: only tiles with differing pixels are
+examined further. Adjacent differing tiles are grouped into regions.
+
+"""
+
+import sys
+
+import numpy as np
+from PIL import Image
+
+# Side in pixels of the square tiles:
+TILE_SIZE = 64
+
+
+def _read(filename):
+    """Return the image as an array of shape (height, width, 4), in RGBA
+    mode, so that images differing only in storage mode compare equal.
+
+    """
+
+    with Image.open(filename) as img:
+        return np.asarray(img.convert("RGBA"))
+
+
+def _tiles(differ):
+    """differ is a boolean array of shape (height, width). Return the
+    boolean array telling which tiles contain a true element.
+
+    """
+
+    height, width = differ.shape
+    n_y = -(-height // TILE_SIZE)
+    n_x = -(-width // TILE_SIZE)
+    padded = np.zeros((n_y * TILE_SIZE, n_x * TILE_SIZE), dtype=bool)
+    padded[:height, :width] = differ
+    return padded.reshape(n_y, TILE_SIZE, n_x, TILE_SIZE).any(axis=(1, 3))
+
+
+def _regions(tiles):
+    """tiles is a boolean array of tiles. Return the list of regions of
+    true tiles connected by sides, each region as a list of pairs
+    (row, column) of tiles.
+
+    """
+
+    seen = np.zeros(tiles.shape, dtype=bool)
+    regions = []
+
+    for start in zip(*np.nonzero(tiles)):
+        if seen[start]:
+            continue
+
+        seen[start] = True
+        region = []
+        stack = [start]
+
+        while stack:
+            i, j = stack.pop()
+            region.append((i, j))
+
+            for neighbour in [(i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)]:
+                if (
+                    0 <= neighbour[0] < tiles.shape[0]
+                    and 0 <= neighbour[1] < tiles.shape[1]
+                    and tiles[neighbour]
+                    and not seen[neighbour]
+                ):
+                    seen[neighbour] = True
+                    stack.append(neighbour)
+
+        regions.append(region)
+
+    return regions
+
+
+def _bounding_box(differ, region):
+    """Return the bounding box (x_min, y_min, x_max, y_max), bounds
+    included, of the differing pixels in the tiles of region.
+
+    """
+
+    x_min = y_min = np.inf
+    x_max = y_max = -1
+
+    for i, j in region:
+        tile = differ[
+            i * TILE_SIZE : (i + 1) * TILE_SIZE,
+            j * TILE_SIZE : (j + 1) * TILE_SIZE,
+        ]
+        rows = np.flatnonzero(tile.any(axis=1)) + i * TILE_SIZE
+        columns = np.flatnonzero(tile.any(axis=0)) + j * TILE_SIZE
+        y_min = min(y_min, rows[0])
+        y_max = max(y_max, rows[-1])
+        x_min = min(x_min, columns[0])
+        x_max = max(x_max, columns[-1])
+
+    return int(x_min), int(y_min), int(x_max), int(y_max)
+
+
+def render(pixels_2, differ, filename):
+    """Write to filename the new image, faded, with differing pixels in
+    red.
+
+    """
+
+    rendered = pixels_2.copy()
+    rendered[..., :3] = 255 - (255 - rendered[..., :3]) // 4
+    rendered[..., 3] = 255
+    rendered[differ] = [255, 0, 0, 255]
+    Image.fromarray(rendered, "RGBA").save(filename)
+
+
+def diff_png(
+    path_1, path_2, detail_file=sys.stdout, diff_image=None, max_boxes=20
+):
+    """Report the number of differing pixels, the largest difference of
+    a channel and the bounding boxes of differing regions, at most
+    max_boxes. If diff_image is not None then it is the name of a file
+    where a picture of the differences is written. Differences in
+    metadata only are ignored. Return 0 if no difference is found, 1
+    otherwise.
+
+    """
+
+    pixels_1 = _read(path_1)
+    pixels_2 = _read(path_2)
+
+    if pixels_1.shape == pixels_2.shape:
+        differ = np.any(pixels_1 != pixels_2, axis=2)
+        tiles = _tiles(differ)
+
+        if not tiles.any():
+            return 0
+
+    detail_file.write("\n" + "*" * 10 + "\n\n")
+    detail_file.write(f"diff_png {path_1} {path_2}\n")
+
+    if pixels_1.shape != pixels_2.shape:
+        detail_file.write(
+            "Sizes differ (width x height): "
+            f"{pixels_1.shape[1]} x {pixels_1.shape[0]}, "
+            f"{pixels_2.shape[1]} x {pixels_2.shape[0]}\n\n"
+        )
+        return 1
+
+    detail_file.write(f"Number of different pixels: {np.sum(differ)}\n")
+    max_diff = 0
+
+    # Only examine differing tiles:
+    for i, j in zip(*np.nonzero(tiles)):
+        window = np.s_[
+            i * TILE_SIZE : (i + 1) * TILE_SIZE,
+            j * TILE_SIZE : (j + 1) * TILE_SIZE,
+        ]
+        channel_diff = np.abs(
+            pixels_1[window].astype(np.int16) - pixels_2[window]
+        )
+        max_diff = max(max_diff, int(np.max(channel_diff)))
+
+    detail_file.write(f"Largest difference of a channel: {max_diff}\n")
+    regions = _regions(tiles)
+    detail_file.write(
+        f"Bounding boxes of differing regions (x_min, y_min, x_max, y_max), "
+        f"{len(regions)} regions:\n"
+    )
+
+    for region in regions[:max_boxes]:
+        detail_file.write(f"{_bounding_box(differ, region)}\n")
+
+    if len(regions) > max_boxes:
+        detail_file.write("...\n")
+
+    if diff_image is not None:
+        render(pixels_2, differ, diff_image)
+        detail_file.write(f"See {diff_image}\n")
+
+    detail_file.write("\n")
+    return 1
@@ -0,0 +1,266 @@
+"""Numerical comparison of "rectangular" regions of two CSV files. This
+is a replacement for the Fortran program max_diff_rect. In each file,
+the region to be compared must contain values separated by commas
+and/or blanks. In each line of the region, the columns compared must
+contain numeric values.
+
+"""
+
+import itertools
+import re
+import sys
+
+import numpy as np
+
+_SPLIT = re.compile(r"[,\s]+")
+
+
+def _rows(f_obj, first_r, last_r):
+    """Yield pairs (row number, line) for non-blank lines between rows
+    first_r and last_r (1-based, last_r = 0 meaning last in file).
+
+    """
+
+    for i, line in enumerate(f_obj, start=1):
+        if last_r != 0 and i > last_r:
+            break
+
+        if i >= first_r and not line.isspace():
+            yield i, line
+
+
+def _parse(chunk, first_c, last_c):
+    """chunk is a list of pairs (row number, line). Return a 2-dimensional
+    array of floats.
+
+    """
+
+    rows = []
+
+    for i, line in chunk:
+        fields = [f for f in _SPLIT.split(line.strip()) if f]
+        rows.append(fields[first_c - 1 : None if last_c == 0 else last_c])
+
+    return np.array(rows, dtype=float)
+
+
+class _ColumnMax:
+    """Running maximum of a difference for each column, with its
+    location and the values compared.
+
+    """
+
+    def __init__(self, n_col):
+        self.value = np.full(n_col, -1.0)
+        self.row = np.zeros(n_col, dtype=int)
+        self.old = np.zeros(n_col)
+        self.new = np.zeros(n_col)
+
+    def update(self, diff, row_numbers, data_old, data_new):
+        i_max = np.argmax(diff, axis=0)
+        j = np.arange(diff.shape[1])
+        larger = diff[i_max, j] > self.value
+        j = j[larger]
+        i_max = i_max[larger]
+        self.value[j] = diff[i_max, j]
+        self.row[j] = row_numbers[i_max]
+        self.old[j] = data_old[i_max, j]
+        self.new[j] = data_new[i_max, j]
+
+    def describe(self, tag, j, first_c):
+        return (
+            f"Maximum {tag} difference: {self.value[j]:.6g} at row "
+            f"{self.row[j]}, column {first_c + j}: old {self.old[j]:.15g}, "
+            f"new {self.new[j]:.15g}\n"
+        )
+
+
+def diff_rect(
+    path_1,
+    path_2,
+    detail_file=sys.stdout,
+    names=None,
+    tolerance=1e-7,
+    size_lim=50,
+    first_r=2,
+    last_r=0,
+    first_c=1,
+    last_c=0,
+    chunk_rows=65536,
+):
+    """Compare the rectangles between rows first_r and last_r, columns
+    first_c and last_c (1-based, 0 for last_r or last_c meaning last in
+    file) of CSV files path_1 and path_2. The files are read by chunks
+    of chunk_rows rows. Report the maximum absolute and relative
+    differences, with their locations, for the whole matrix and for
+    each differing column (at most about size_lim lines). The relative
+    difference is relative to the old value. Return 0 if the maximum
+    relative difference is lower than or equal to tolerance, 1
+    otherwise.
+
+    """
+
+    problems = []
+    n_col = None
+    n_rows = 0
+
+    with open(path_1) as f_obj_1, open(path_2) as f_obj_2:
+        rows_1 = _rows(f_obj_1, first_r, last_r)
+        rows_2 = _rows(f_obj_2, first_r, last_r)
+
+        while not problems:
+            chunk_1 = list(itertools.islice(rows_1, chunk_rows))
+            chunk_2 = list(itertools.islice(rows_2, chunk_rows))
+
+            if len(chunk_1) != len(chunk_2):
+                n_1 = n_rows + len(chunk_1) + sum(1 for x in rows_1)
+                n_2 = n_rows + len(chunk_2) + sum(1 for x in rows_2)
+                problems.append(f"Numbers of rows differ: {n_1} {n_2}\n")
+                n_common = min(len(chunk_1), len(chunk_2))
+                chunk_1 = chunk_1[:n_common]
+                chunk_2 = chunk_2[:n_common]
+
+            if len(chunk_1) == 0:
+                break
+
+            try:
+                data_old = _parse(chunk_1, first_c, last_c)
+                data_new = _parse(chunk_2, first_c, last_c)
+            except ValueError:
+                problems.append(
+                    "Cannot read a rectangle of numeric values in rows "
+                    f"{chunk_1[0][0]} to {chunk_1[-1][0]}\n"
+                )
+                break
+
+            if data_old.shape[1] != data_new.shape[1] or (
+                n_col is not None and data_old.shape[1] != n_col
+            ):
+                problems.append("Numbers of columns differ\n")
+                break
+
+            if n_col is None:
+                n_col = data_old.shape[1]
+                max_abs = _ColumnMax(n_col)
+                max_rel = _ColumnMax(n_col)
+
+            n_rows += len(chunk_1)
+            row_numbers = np.array([i for i, line in chunk_1])
+            abs_diff = np.abs(data_new - data_old)
+            same = (data_old == data_new) | (
+                np.isnan(data_old) & np.isnan(data_new)
+            )
+            abs_diff[same] = 0.0
+            abs_diff[np.isnan(abs_diff)] = np.inf
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rel_diff = np.where(
+                    abs_diff == 0, 0.0, abs_diff / np.abs(data_old)
+                )
+
+            # A NaN or infinite old value against another value:
+            rel_diff[np.isinf(abs_diff)] = np.inf
+
+            max_abs.update(abs_diff, row_numbers, data_old, data_new)
+            max_rel.update(rel_diff, row_numbers, data_old, data_new)
+
+    if n_col is None:
+        diff_found = len(problems) != 0
+    else:
+        diff_found = len(problems) != 0 or np.max(max_rel.value) > tolerance
+
+    if diff_found:
+        detail_file.write("\n" + "*" * 10 + "\n\n")
+
+        if names is None:
+            detail_file.write(f"diff_rect {path_1} {path_2}\n")
+        else:
+            detail_file.write(f"diff_rect {names[0]} {names[1]}\n")
+
+        detail_file.write(
+            f"Comparison of rectangles, rows from {first_r}, columns from "
+            f"{first_c}, relative tolerance {tolerance}:\n"
+        )
+
+        detail_file.writelines(problems)
+
+        if n_col is not None:
+            detail_file.write(f"Whole matrix, {n_rows} rows compared:\n")
+            detail_file.write(
+                max_abs.describe("absolute", np.argmax(max_abs.value), first_c)
+            )
+            detail_file.write(
+                max_rel.describe("relative", np.argmax(max_rel.value), first_c)
+            )
+            differing = np.flatnonzero(max_abs.value > 0)
+            n_printed = max(size_lim // 3 - 1, 0)
+
+            for j in differing[:n_printed]:
+                detail_file.write(f"Column {first_c + j}:\n")
+                detail_file.write(max_abs.describe("absolute", j, first_c))
+                detail_file.write(max_rel.describe("relative", j, first_c))
+
+            if differing.size > n_printed:
+                detail_file.write(
+                    f"... and {differing.size - n_printed} more differing "
+                    "columns\n"
+                )
+
+        detail_file.write("\n")
+
+    return 1 if diff_found else 0
+
+
+def main_cli():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("csv_file", nargs=2)
+    parser.add_argument(
+        "--first_r",
+        type=int,
+        default=1,
+        help="first row to compare (1-based, default 1)",
+    )
+    parser.add_argument(
+        "--last_r",
+        type=int,
+        default=0,
+        help="last row to compare (default 0, meaning last in file)",
+    )
+    parser.add_argument(
+        "--first_c",
+        type=int,
+        default=1,
+        help="first column to compare (1-based, default 1)",
+    )
+    parser.add_argument(
+        "--last_c",
+        type=int,
+        default=0,
+        help="last column to compare (default 0, meaning last in file)",
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        default=1e-7,
+        type=float,
+        help="maximum relative difference (default 1e-7)",
+    )
+    parser.add_argument(
+        "-l",
+        "--limit",
+        help="maximum number of lines for printing differences (default 50)",
+        type=int,
+        default=50,
+    )
+    args = parser.parse_args()
+    return diff_rect(
+        *args.csv_file,
+        tolerance=args.tolerance,
+        size_lim=args.limit,
+        first_r=args.first_r,
+        last_r=args.last_r,
+        first_c=args.first_c,
+        last_c=args.last_c,
+    )
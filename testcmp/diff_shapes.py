@@ -1,11 +1,144 @@
 import io
+import itertools
 
 import shapefile
+import shapely
 from shapely import geometry
 import numpy as np
 
 from . import compare_poly
 
+# Minimum number of points of a ring. Shapely closes a ring of 3 points
+# but cannot create a ring from fewer points:
+MIN_RING_POINTS = 3
+
+_POLYGON_TYPES = {shapefile.POLYGON, shapefile.POLYGONZ, shapefile.POLYGONM}
+
+
+def _short_ring(s):
+    """Return the number of the first ring of the pyshp shape s with
+    fewer than MIN_RING_POINTS points, or None if s is not a polygon or
+    has no such ring.
+
+    """
+
+    if s.shapeType in _POLYGON_TYPES:
+        bounds = list(s.parts) + [len(s.points)]
+
+        for k, (first, last) in enumerate(zip(bounds, bounds[1:])):
+            if last - first < MIN_RING_POINTS:
+                return k
+
+    return None
+
+
+def _geometries(s_old, s_new, i_shape, detail_file):
+    """Return the pair of Shapely geometries of s_old and s_new, or None
+    if the shapes are found different without comparing the
+    geometries. In this case, the difference is written to
+    detail_file.
+
+    """
+
+    if s_old.shapeType == shapefile.NULL:
+        detail_file.write("Old shape is NULL.\n")
+        return None
+
+    if s_new.shapeType == shapefile.NULL:
+        detail_file.write("New shape is NULL.\n")
+        return None
+
+    nparts_old = len(s_old.parts)
+    nparts_new = len(s_new.parts)
+
+    if nparts_old != nparts_new:
+        detail_file.write(
+            f"Numbers of parts in shape {i_shape} differ:"
+            f"{nparts_old} {nparts_new}\n"
+        )
+        return None
+
+    if len(s_old.points) == 0:
+        detail_file.write(f"No point in old shape {i_shape}\n")
+        return None
+
+    if len(s_new.points) == 0:
+        detail_file.write(f"No point in new shape {i_shape}\n")
+        return None
+
+    for tag, s in [("old", s_old), ("new", s_new)]:
+        k = _short_ring(s)
+
+        if k is not None:
+            detail_file.write(
+                f"Ring {k} of {tag} shape {i_shape} has fewer than "
+                f"{MIN_RING_POINTS} points\n"
+            )
+            return None
+
+    # Suppress possible warning about orientation of polygon (only is
+    # effective with version >= 2.2.0 of pyshp):
+    shapefile.VERBOSE = False
+
+    g_old = geometry.shape(s_old.__geo_interface__)
+    g_new = geometry.shape(s_new.__geo_interface__)
+    shapefile.VERBOSE = True
+
+    if g_old.geom_type != g_new.geom_type:
+        detail_file.write(
+            "Geometry types differ:" f"{g_old.geom_type} {g_new.geom_type}\n"
+        )
+        return None
+
+    return g_old, g_new
+
+
+def _polygon_pairs(g_old, g_new):
+    """Return the list of triplets (j, p_old, p_new) of polygons to
+    compare, with j None if the geometries are polygons, the polygon
+    number if they are multi-polygons. Return None if the geometries are
+    not polygons or multi-polygons.
+
+    """
+
+    if g_old.geom_type == "MultiPolygon":
+        return [
+            (j, p_old, p_new)
+            for j, (p_old, p_new) in enumerate(zip(g_old.geoms, g_new.geoms))
+        ]
+    elif g_old.geom_type == "Polygon":
+        return [(None, g_old, g_new)]
+    else:
+        return None
+
+
+def _diff_other(g_old, g_new, detail_file, tolerance):
+    """Compare geometries which are not polygons. Return True if a
+    difference is found.
+
+    """
+
+    if g_old.geom_type == "Point":
+        c_old = np.array(g_old.coords)
+        c_new = np.array(g_new.coords)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            abs_rel_diff = np.where(
+                c_new == c_old, 0.0, np.abs(c_new / c_old - 1)
+            )
+
+        diff_found = np.max(abs_rel_diff) > tolerance
+        detail_file.write(
+            "Absolute value of relative difference: " f"{abs_rel_diff}\n"
+        )
+    else:
+        diff_found = True
+        detail_file.write(
+            "Geometry type not supported:" f"{g_old.geom_type}\n"
+        )
+
+    return diff_found
+
 
 def diff_shapes(
     s_old,
@@ -16,7 +149,10 @@ def diff_shapes(
     ax,
     marker_iter,
     tolerance,
+    distance=None,
 ):
+    """For distance, see compare_poly.compare_rings."""
+
     if s_old.points == s_new.points:
         diff_found = False
 
@@ -27,97 +163,221 @@ def diff_shapes(
     else:
         detail_subfile = io.StringIO()
         detail_subfile.write(f"\nVertices for shape {i_shape} differ.\n")
+        geometries = _geometries(s_old, s_new, i_shape, detail_subfile)
 
-        if s_old.shapeType == shapefile.NULL:
-            diff_found = True
-            detail_subfile.write("Old shape is NULL.\n")
-        elif s_new.shapeType == shapefile.NULL:
+        if geometries is None:
             diff_found = True
-            detail_subfile.write("New shape is NULL.\n")
         else:
-            nparts_old = len(s_old.parts)
-            nparts_new = len(s_new.parts)
+            g_old, g_new = geometries
+            pairs = _polygon_pairs(g_old, g_new)
 
-            if nparts_old != nparts_new:
-                diff_found = True
-                detail_subfile.write(
-                    f"Numbers of parts in shape {i_shape} differ:"
-                    f"{nparts_old} {nparts_new}\n"
+            if pairs is None:
+                diff_found = _diff_other(
+                    g_old, g_new, detail_subfile, tolerance
                 )
             else:
-                if len(s_old.points) == 0:
-                    diff_found = True
-                    detail_subfile.write(f"No point in old shape {i_shape}\n")
-                elif len(s_new.points) == 0:
-                    diff_found = True
-                    detail_subfile.write(f"No point in new shape {i_shape}\n")
-                else:
-                    # Suppress possible warning about orientation
-                    # of polygon (only is effective with version
-                    # >= 2.2.0 of pyshp):
-                    shapefile.VERBOSE = False
-
-                    g_old = geometry.shape(s_old.__geo_interface__)
-                    g_new = geometry.shape(s_new.__geo_interface__)
-                    shapefile.VERBOSE = True
-
-                    if g_old.geom_type == g_new.geom_type:
-                        if g_old.geom_type == "MultiPolygon":
-                            ret_code = 0
-
-                            for j, (p_old, p_new) in enumerate(
-                                zip(g_old, g_new)
-                            ):
-                                ret_code += compare_poly.compare_poly(
-                                    ax,
-                                    p_old,
-                                    p_new,
-                                    i_shape,
-                                    j,
-                                    detail_subfile,
-                                    marker_iter,
-                                    tolerance,
-                                    report_identical,
-                                )
-
-                            diff_found = ret_code != 0
-                        elif g_old.geom_type == "Polygon":
-                            ret_code = compare_poly.compare_poly(
-                                ax,
-                                g_old,
-                                g_new,
-                                i_shape,
-                                detail_file=detail_subfile,
-                                marker_iter=marker_iter,
-                                tolerance=tolerance,
-                                report_identical=report_identical,
-                            )
-                            diff_found = ret_code != 0
-                        elif g_old.geom_type == "Point":
-                            abs_rel_diff = np.abs(
-                                np.array(g_new.coords) / np.array(g_old.coords)
-                                - 1
-                            )
-                            diff_found = np.max(abs_rel_diff) > tolerance
-                            detail_subfile.write(
-                                "Absolute value of relative difference: "
-                                f"{abs_rel_diff}\n"
-                            )
-                        else:
-                            diff_found = True
-                            detail_subfile.write(
-                                "Geometry type not supported:"
-                                f"{g_old.geom_type}\n"
-                            )
-                    else:
-                        diff_found = True
-                        detail_subfile.write(
-                            "Geometry types differ:"
-                            f"{g_old.geom_type} {g_new.geom_type}\n"
-                        )
+                ret_code = 0
+
+                for j, p_old, p_new in pairs:
+                    ret_code += compare_poly.compare_poly(
+                        ax,
+                        p_old,
+                        p_new,
+                        i_shape,
+                        j,
+                        detail_subfile,
+                        marker_iter,
+                        tolerance,
+                        report_identical,
+                        distance,
+                    )
+
+                diff_found = ret_code != 0
 
         if diff_found or report_identical:
             detail_diag = detail_subfile.getvalue()
             detail_file.write(detail_diag)
 
     return 1 if diff_found else 0
+
+
+def _linearrings(point_lists):
+    """Create LinearRing objects at once from a list of lists of
+    points. Each list must have at least MIN_RING_POINTS points.
+
+    """
+
+    coords = np.array(list(itertools.chain.from_iterable(point_lists)))
+    indices = np.repeat(
+        np.arange(len(point_lists)), [len(p) for p in point_lists]
+    )
+    return shapely.linearrings(coords, indices=indices)
+
+
+def _single_ring(s_old, s_new):
+    """Check whether the shapes are both polygons made of a single ring.
+    The geometry of each shape is then a Polygon whose exterior is made
+    of the points of the shape, in the same order, so we do not need
+    to go through __geo_interface__.
+
+    """
+
+    return (
+        s_old.shapeType == shapefile.POLYGON
+        and s_new.shapeType == shapefile.POLYGON
+        and len(s_old.parts) == 1
+        and len(s_new.parts) == 1
+        and len(s_old.points) >= MIN_RING_POINTS
+        and len(s_new.points) >= MIN_RING_POINTS
+    )
+
+
+def geometry_array(shapes):
+    """Return a NumPy array of Shapely geometries for the list of pyshp
+    shapes, with None for null shapes and shapes without points.
+    Polygons with a ring of fewer than MIN_RING_POINTS points, which
+    Shapely cannot create, are replaced by the MultiPoint of their
+    vertices. Polygons made of a single ring and points are created at
+    once.
+
+    """
+
+    geoms = np.full(len(shapes), None, dtype=object)
+    single_ring = []
+    points = []
+
+    # Suppress possible warning about orientation of polygon:
+    shapefile.VERBOSE = False
+
+    for i, s in enumerate(shapes):
+        if s.shapeType == shapefile.NULL or len(s.points) == 0:
+            continue
+
+        if _short_ring(s) is not None:
+            geoms[i] = shapely.multipoints(s.points)
+        elif s.shapeType == shapefile.POLYGON and len(s.parts) == 1:
+            single_ring.append(i)
+        elif s.shapeType == shapefile.POINT:
+            points.append(i)
+        else:
+            geoms[i] = geometry.shape(s.__geo_interface__)
+
+    shapefile.VERBOSE = True
+
+    if single_ring:
+        geoms[single_ring] = shapely.polygons(
+            _linearrings([shapes[i].points for i in single_ring])
+        )
+
+    if points:
+        geoms[points] = shapely.points([shapes[i].points[0] for i in points])
+
+    return geoms
+
+
+def diff_shapes_bulk(shape_pairs, report_identical, tolerance, distance=None):
+    """shape_pairs is a list of triplets (shape number, old pyshp shape,
+    new pyshp shape). Compare each pair of shapes as diff_shapes
+    would, without plot, but compare all the rings of polygons at once,
+    with vectorized Shapely functions. Return the list of pairs (return
+    code, text to write), one item per pair of shapes.
+
+    """
+
+    # List of pairs [diff_found, detail_subfile] for each pair of
+    # shapes:
+    results = []
+
+    # Rings to compare, with the index in results and the header of
+    # the diagnostic:
+    rings_old = []
+    rings_new = []
+    ring_results = []
+    headers = []
+
+    # Indices in rings_old and rings_new of rings still given as lists
+    # of points:
+    from_points = []
+
+    for i_shape, s_old, s_new in shape_pairs:
+        detail_subfile = io.StringIO()
+
+        if s_old.points == s_new.points:
+            if report_identical:
+                detail_subfile.write(
+                    f"\nVertices for shape {i_shape} are identical.\n"
+                )
+
+            results.append([False, detail_subfile])
+            continue
+
+        detail_subfile.write(f"\nVertices for shape {i_shape} differ.\n")
+
+        if _single_ring(s_old, s_new):
+            from_points.append(len(rings_old))
+            rings_old.append(s_old.points)
+            rings_new.append(s_new.points)
+            ring_results.append(len(results))
+            headers.append(compare_poly.ring_header(i_shape, None, None))
+            results.append([False, detail_subfile])
+            continue
+
+        geometries = _geometries(s_old, s_new, i_shape, detail_subfile)
+
+        if geometries is None:
+            diff_found = True
+        else:
+            g_old, g_new = geometries
+            pairs = _polygon_pairs(g_old, g_new)
+
+            if pairs is None:
+                diff_found = _diff_other(
+                    g_old, g_new, detail_subfile, tolerance
+                )
+            else:
+                diff_found = False
+
+                for j, p_old, p_new in pairs:
+                    for k, r_old, r_new in compare_poly.ring_pairs(
+                        p_old, p_new
+                    ):
+                        rings_old.append(r_old)
+                        rings_new.append(r_new)
+                        ring_results.append(len(results))
+                        headers.append(compare_poly.ring_header(i_shape, j, k))
+
+        results.append([diff_found, detail_subfile])
+
+    if from_points:
+        for rings in [rings_old, rings_new]:
+            for i, ring in zip(
+                from_points, _linearrings([rings[i] for i in from_points])
+            ):
+                rings[i] = ring
+
+    if rings_old:
+        for i_result, (ret_code, text) in zip(
+            ring_results,
+            compare_poly.compare_ring_arrays(
+                rings_old,
+                rings_new,
+                headers,
+                tolerance,
+                report_identical,
+                distance,
+            ),
+        ):
+            results[i_result][0] = results[i_result][0] or ret_code != 0
+            results[i_result][1].write(text)
+
+    return [
+        (
+            1 if diff_found else 0,
+            (
+                detail_subfile.getvalue()
+                if diff_found or report_identical
+                else ""
+            ),
+        )
+        for diff_found, detail_subfile in results
+    ]
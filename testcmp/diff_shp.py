@@ -1,11 +1,437 @@
+import collections
+from concurrent import futures
 import itertools
 import sys
 import io
 
+import numpy as np
 import shapefile
 from matplotlib import pyplot as plt
 
+from . import diff_bin
 from . import diff_shapes
+from . import match_shapes
+from . import shp_records
+
+# Number of shapes compared at once without plot:
+BATCH_SIZE = 1024
+
+# Number of shapes compared by a worker process:
+SHARD_SIZE = 4 * BATCH_SIZE
+
+# Types of layers whose coordinates are compared at once, see
+# _diff_vertices:
+VERTEX_LAYERS = [shapefile.POINT, shapefile.MULTIPOINT, shapefile.POLYLINE]
+
+
+def _plot_results(
+    shape_pairs, report_identical, ax, marker_iter, tolerance, distance
+):
+    """shape_pairs is an iterator on pairs of shapes. Compare them one by
+    one with diff_shapes, with plot, and yield for each pair the
+    return code and the text to write.
+
+    """
+
+    for i_shape, (s_old, s_new) in enumerate(shape_pairs):
+        detail_file = io.StringIO()
+        ret_code = diff_shapes.diff_shapes(
+            s_old,
+            s_new,
+            report_identical,
+            detail_file,
+            i_shape,
+            ax,
+            marker_iter,
+            tolerance,
+            distance,
+        )
+        yield ret_code, detail_file.getvalue()
+
+
+def _bulk_results(shape_pairs, report_identical, tolerance, distance):
+    """shape_pairs is an iterator on pairs of shapes. Compare them by
+    batches of BATCH_SIZE pairs with diff_shapes_bulk and yield for
+    each pair the return code and the text to write.
+
+    """
+
+    numbered_pairs = enumerate(shape_pairs)
+
+    while True:
+        batch = [
+            (i_shape, s_old, s_new)
+            for i_shape, (s_old, s_new) in itertools.islice(
+                numbered_pairs, BATCH_SIZE
+            )
+        ]
+
+        if not batch:
+            break
+
+        yield from diff_shapes.diff_shapes_bulk(
+            batch, report_identical, tolerance, distance
+        )
+
+
+def _raw_results(
+    reader_old, reader_new, start, stop, report_identical, tolerance, distance
+):
+    """Same as _bulk_results for records in range(start, stop), but
+    first compare the raw bytes of records, and only decode and
+    compare the shapes of records which differ. The readers must have
+    index files.
+
+    """
+
+    index_old = shp_records.read_index(reader_old.shx, start, stop)
+    index_new = shp_records.read_index(reader_new.shx, start, stop)
+    map_old = diff_bin.map_file(reader_old.shp)
+    map_new = diff_bin.map_file(reader_new.shp)
+
+    try:
+        for first in range(start, stop, BATCH_SIZE):
+            last = min(first + BATCH_SIZE, stop)
+            differ = shp_records.differing_records(
+                map_old,
+                map_new,
+                index_old,
+                index_new,
+                first - start,
+                last - start,
+            )
+            batch = [
+                (i_shape, reader_old.shape(i_shape), reader_new.shape(i_shape))
+                for i_shape in (np.flatnonzero(differ) + first).tolist()
+            ]
+            results = iter(
+                diff_shapes.diff_shapes_bulk(
+                    batch, report_identical, tolerance, distance
+                )
+            )
+
+            for i_shape in range(first, last):
+                if differ[i_shape - first]:
+                    yield next(results)
+                elif report_identical:
+                    yield 0, f"\nVertices for shape {i_shape} are identical.\n"
+                else:
+                    yield 0, ""
+    finally:
+        map_old.close()
+        map_new.close()
+
+
+def _compare_shard(
+    old, new, start, stop, report_identical, tolerance, distance
+):
+    """Run in a worker process. Return the list of pairs (return code,
+    text to write) for records in range(start, stop).
+
+    """
+
+    with shapefile.Reader(old) as reader_old, shapefile.Reader(
+        new
+    ) as reader_new:
+        return list(
+            _raw_results(
+                reader_old,
+                reader_new,
+                start,
+                stop,
+                report_identical,
+                tolerance,
+                distance,
+            )
+        )
+
+
+def _parallel_results(
+    old, new, n_rec, report_identical, tolerance, distance, jobs
+):
+    """Compare shards of SHARD_SIZE records in jobs worker processes and
+    yield, in the order of records, the return code and the text to
+    write for each record. At most 2 * jobs shards are submitted in
+    advance, and the shards not started are cancelled if the caller
+    stops early.
+
+    """
+
+    shard_starts = iter(range(0, n_rec, SHARD_SIZE))
+    pending = collections.deque()
+
+    with futures.ProcessPoolExecutor(jobs) as executor:
+
+        def submit(start):
+            pending.append(
+                executor.submit(
+                    _compare_shard,
+                    old,
+                    new,
+                    start,
+                    min(start + SHARD_SIZE, n_rec),
+                    report_identical,
+                    tolerance,
+                    distance,
+                )
+            )
+
+        try:
+            for start in itertools.islice(shard_starts, 2 * jobs):
+                submit(start)
+
+            while pending:
+                results = pending.popleft().result()
+                start = next(shard_starts, None)
+
+                if start is not None:
+                    submit(start)
+
+                yield from results
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _vertex_differences(
+    map_old, map_new, index_old, index_new, records, tolerance, abs_tol
+):
+    """Decode and compare the records of the arrays of record numbers
+    records. Return the boolean array telling which records have
+    different numbers of points or parts, or different parts, the
+    arrays of numbers of points and parts in the old and new files,
+    and the boolean array telling which records have coordinates
+    differing by more than abs_tol + tolerance * absolute value of old
+    coordinate, with the maximum absolute and relative differences of
+    coordinates for each record.
+
+    """
+
+    n_old, n_parts_old, parts_old, coords_old = shp_records.vertices(
+        map_old, index_old, records
+    )
+    n_new, n_parts_new, parts_new, coords_new = shp_records.vertices(
+        map_new, index_new, records
+    )
+    i_rec = np.arange(records.size)
+    structure = (n_old != n_new) | (n_parts_old != n_parts_new)
+
+    # Elements in records with the same numbers are aligned:
+    part_rec = np.repeat(i_rec, n_parts_old)
+    aligned = ~structure[part_rec]
+    aligned_new = ~structure[np.repeat(i_rec, n_parts_new)]
+    part_differ = parts_old[aligned] != parts_new[aligned_new]
+    structure[part_rec[aligned][part_differ]] = True
+
+    point_rec = np.repeat(i_rec, n_old)
+    aligned = ~structure[point_rec]
+    c_old = coords_old[aligned]
+    c_new = coords_new[~structure[np.repeat(i_rec, n_new)]]
+    point_rec = point_rec[aligned]
+    abs_diff = np.abs(c_new - c_old)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel_diff = np.where(abs_diff == 0, 0.0, abs_diff / np.abs(c_old))
+
+    # NaN counts as a difference:
+    outside = ~np.all(abs_diff <= abs_tol + tolerance * np.abs(c_old), axis=1)
+    coord_differ = np.zeros(records.size, dtype=bool)
+    coord_differ[point_rec[outside]] = True
+    max_abs = np.zeros(records.size)
+    max_rel = np.zeros(records.size)
+    np.maximum.at(max_abs, point_rec, np.max(abs_diff, axis=1, initial=0))
+    np.maximum.at(max_rel, point_rec, np.max(rel_diff, axis=1, initial=0))
+    numbers = (n_old, n_new, n_parts_old, n_parts_new)
+    return structure, numbers, coord_differ, max_abs, max_rel
+
+
+def _diff_vertices(
+    reader_old, reader_new, n_rec, detail_file, tolerance, distance, max_n_diff
+):
+    """The layers are made of points, multipoints or polylines. Compare
+    the coordinates of all their shapes at once, with NumPy, without
+    pyshp nor Shapely. A coordinate differs if the absolute difference
+    exceeds distance (or 0 if distance is None) + tolerance * absolute
+    value of old coordinate. Report at most max_n_diff shapes with
+    different numbers of points or parts and at most max_n_diff shapes
+    with different coordinates, those differing most first. Return the
+    number of differing shapes.
+
+    """
+
+    abs_tol = 0.0 if distance is None else distance
+    index_old = shp_records.read_index(reader_old.shx)
+    index_new = shp_records.read_index(reader_new.shx)
+    map_old = diff_bin.map_file(reader_old.shp)
+    map_new = diff_bin.map_file(reader_new.shp)
+
+    # Lists of arrays over batches, for shapes with different
+    # structure, and for shapes with different coordinates:
+    structure_diffs = []
+    coord_diffs = []
+
+    try:
+        for start in range(0, n_rec, SHARD_SIZE):
+            stop = min(start + SHARD_SIZE, n_rec)
+            records = start + np.flatnonzero(
+                shp_records.differing_records(
+                    map_old, map_new, index_old, index_new, start, stop
+                )
+            )
+            structure, numbers, coord_differ, max_abs, max_rel = (
+                _vertex_differences(
+                    map_old,
+                    map_new,
+                    index_old,
+                    index_new,
+                    records,
+                    tolerance,
+                    abs_tol,
+                )
+            )
+            structure_diffs.append(
+                np.column_stack([records] + list(numbers))[structure]
+            )
+            coord_diffs.append(
+                np.column_stack([records, max_abs, max_rel])[coord_differ]
+            )
+    finally:
+        map_old.close()
+        map_new.close()
+
+    structure_diffs = np.concatenate([np.empty((0, 5), int)] + structure_diffs)
+    coord_diffs = np.concatenate([np.empty((0, 3))] + coord_diffs)
+    detail_file.write(
+        "Comparing coordinates of all shapes at once, absolute tolerance "
+        f"{abs_tol}, relative tolerance {tolerance}\n"
+    )
+
+    if structure_diffs.size != 0:
+        detail_file.write(
+            "Shapes with different numbers of points or parts: "
+            f"{len(structure_diffs)}\n"
+        )
+        detail_file.write(
+            "(shape, numbers of points old and new, numbers of parts old "
+            "and new)\n"
+        )
+
+        for row in structure_diffs[:max_n_diff].tolist():
+            detail_file.write(" ".join(str(n) for n in row) + "\n")
+
+        if max_n_diff is not None and len(structure_diffs) > max_n_diff:
+            detail_file.write("...\n")
+
+    if coord_diffs.size != 0:
+        detail_file.write(
+            f"Shapes with different coordinates: {len(coord_diffs)}\n"
+        )
+        i_abs = np.argmax(coord_diffs[:, 1])
+        i_rel = np.argmax(coord_diffs[:, 2])
+        detail_file.write(
+            f"Maximum absolute difference: {coord_diffs[i_abs, 1]} (shape "
+            f"{coord_diffs[i_abs, 0]:.0f})\n"
+        )
+        detail_file.write(
+            f"Maximum relative difference: {coord_diffs[i_rel, 2]} (shape "
+            f"{coord_diffs[i_rel, 0]:.0f})\n"
+        )
+        detail_file.write(
+            "Shapes differing most (shape, maximum absolute difference, "
+            "maximum relative difference):\n"
+        )
+        order = np.argsort(-coord_diffs[:, 1], kind="stable")
+
+        for i_shape, max_abs, max_rel in coord_diffs[
+            order[:max_n_diff]
+        ].tolist():
+            detail_file.write(f"{i_shape:.0f} {max_abs} {max_rel}\n")
+
+        if max_n_diff is not None and len(coord_diffs) > max_n_diff:
+            detail_file.write("...\n")
+
+    return len(structure_diffs) + len(coord_diffs)
+
+
+def _read_geometries(reader):
+    """Return the array of Shapely geometries of the shapes of reader.
+    If there is an index file, simple records are decoded directly
+    from the main file, and pyshp only decodes the other ones.
+
+    """
+
+    batches = [np.empty(0, dtype=object)]
+
+    if reader.shx is None:
+        shapes = reader.iterShapes()
+
+        while True:
+            batch = list(itertools.islice(shapes, BATCH_SIZE))
+
+            if not batch:
+                break
+
+            batches.append(diff_shapes.geometry_array(batch))
+    else:
+        index = shp_records.read_index(reader.shx)
+        map_shp = diff_bin.map_file(reader.shp)
+
+        try:
+            for start in range(0, len(index[0]), BATCH_SIZE):
+                stop = min(start + BATCH_SIZE, len(index[0]))
+                geoms, decoded = shp_records.simple_geometries(
+                    map_shp, index, start, stop
+                )
+                others = np.flatnonzero(~decoded)
+
+                if others.size != 0:
+                    geoms[others] = diff_shapes.geometry_array(
+                        [reader.shape(start + i) for i in others.tolist()]
+                    )
+
+                batches.append(geoms)
+        finally:
+            map_shp.close()
+
+    return np.concatenate(batches)
+
+
+def _diff_unordered(
+    reader_old, reader_new, detail_file, tolerance, max_n_diff
+):
+    """Match the shapes of the two layers whatever their order, report
+    unmatched shapes to detail_file and return their number.
+
+    """
+
+    geoms_old = _read_geometries(reader_old)
+    geoms_new = _read_geometries(reader_new)
+    matches, n_exact = match_shapes.match_shapes(
+        geoms_old, geoms_new, tolerance
+    )
+    matched_new = np.zeros(len(geoms_new), dtype=bool)
+    matched_new[matches[matches >= 0]] = True
+    only_old = np.flatnonzero(matches < 0)
+    only_new = np.flatnonzero(~matched_new)
+    detail_file.write(
+        f"Matching shapes whatever their order, tolerance {tolerance}:\n"
+    )
+    detail_file.write(
+        f"Matched shapes: {len(geoms_old) - only_old.size}, identical: "
+        f"{n_exact}\n"
+    )
+
+    for tag, only in [("old", only_old), ("new", only_new)]:
+        if only.size != 0:
+            detail_file.write(f"Shapes only in {tag} file: {only.size}\n")
+
+            for i_shape in only[:max_n_diff].tolist():
+                detail_file.write(f"shape {i_shape}\n")
+
+            if max_n_diff is not None and only.size > max_n_diff:
+                detail_file.write("...\n")
+
+    return only_old.size + only_new.size
 
 
 def diff_shp(
@@ -16,7 +442,25 @@ def diff_shp(
     detail_file=sys.stdout,
     tolerance=0.0,
     max_n_diff=None,
+    jobs=1,
+    unordered=False,
+    distance=None,
 ):
+    """If jobs > 1, plot is false and the shapefiles have index files
+    then records are compared in jobs worker processes. If unordered is
+    true then shapes are matched whatever their order, see module
+    match_shapes, and only unmatched shapes are reported, at most
+    max_n_diff on each side. plot is then ignored. If distance is not
+    None then rings of polygons are compared on the largest
+    displacement of their vertices, which must not exceed distance,
+    instead of the area of their symmetric difference. Invalid rings
+    can then be compared. distance is ignored if unordered is true.
+    Layers of points, multipoints or polylines are compared at once if
+    they have index files and plot is false, see _diff_vertices.
+    distance is then the absolute tolerance on coordinates.
+
+    """
+
     detail_subfile = io.StringIO()
     detail_subfile.write("\n" + "*" * 10 + "\n\n")
     detail_subfile.write(f"diff {old} {new}\n")
@@ -32,37 +476,89 @@ def diff_shp(
             "Not the same number of records: "
             f"{num_records_old} {num_records_new}\n"
         )
-        n_rec = min(num_records_old, num_records_new)
-        detail_subfile.write(f"Comparing the first {n_rec} records...\n")
 
-    if plot:
+        if not unordered:
+            n_rec = min(num_records_old, num_records_new)
+            detail_subfile.write(
+                f"Comparing the first {n_rec} records...\n"
+            )
+
+    if plot and not unordered:
         fig, ax = plt.subplots()
         marker_iter = itertools.cycle(["+", "v", "^", "x"])
     else:
         ax = None
         marker_iter = itertools.repeat(None)
 
-    detail_subfile.write("Difference in vertices:\n")
-    ret_code = 0
-
-    for i_shape, (s_old, s_new) in enumerate(
-        zip(reader_old.iterShapes(), reader_new.iterShapes())
+    if unordered:
+        ret_code = _diff_unordered(
+            reader_old, reader_new, detail_subfile, tolerance, max_n_diff
+        )
+    elif (
+        not plot
+        and reader_old.shapeType == reader_new.shapeType
+        and reader_old.shapeType in VERTEX_LAYERS
+        and reader_old.shx is not None
+        and reader_new.shx is not None
     ):
-        ret_code += diff_shapes.diff_shapes(
-            s_old,
-            s_new,
-            report_identical,
+        detail_subfile.write("Difference in vertices:\n")
+        ret_code = _diff_vertices(
+            reader_old,
+            reader_new,
+            min(num_records_old, num_records_new),
             detail_subfile,
-            i_shape,
-            ax,
-            marker_iter,
             tolerance,
+            distance,
+            max_n_diff,
         )
-        if max_n_diff is not None and ret_code >= max_n_diff:
-            detail_subfile.write(
-                "\nToo many different shapes. Stopping comparison.\n"
+    else:
+        detail_subfile.write("Difference in vertices:\n")
+        shape_pairs = zip(reader_old.iterShapes(), reader_new.iterShapes())
+        n_rec = min(num_records_old, num_records_new)
+
+        if plot:
+            results = _plot_results(
+                shape_pairs,
+                report_identical,
+                ax,
+                marker_iter,
+                tolerance,
+                distance,
             )
-            break
+        elif reader_old.shx is None or reader_new.shx is None:
+            # We cannot access records directly so we cannot compare
+            # them in parallel.
+            results = _bulk_results(
+                shape_pairs, report_identical, tolerance, distance
+            )
+        elif jobs > 1 and n_rec > SHARD_SIZE:
+            results = _parallel_results(
+                old, new, n_rec, report_identical, tolerance, distance, jobs
+            )
+        else:
+            results = _raw_results(
+                reader_old,
+                reader_new,
+                0,
+                n_rec,
+                report_identical,
+                tolerance,
+                distance,
+            )
+
+        ret_code = 0
+
+        for shape_ret_code, text in results:
+            detail_subfile.write(text)
+            ret_code += shape_ret_code
+
+            if max_n_diff is not None and ret_code >= max_n_diff:
+                detail_subfile.write(
+                    "\nToo many different shapes. Stopping comparison.\n"
+                )
+                break
+
+        results.close()
 
     diff_found = diff_found or ret_code != 0
     detail_subfile.write("\n")
@@ -71,7 +567,7 @@ def diff_shp(
         detail_diag = detail_subfile.getvalue()
         detail_file.write(detail_diag)
 
-        if plot:
+        if ax is not None:
             ax.legend()
             plt.show()
 
@@ -100,6 +596,28 @@ def main_cli():
         help="maximum relative error for comparison of area of symmetric "
         "difference (default 0.)",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        help="number of worker processes comparing records (default 1)",
+    )
+    parser.add_argument(
+        "-u",
+        "--unordered",
+        action="store_true",
+        help="match shapes whatever their order, with a spatial index, and "
+        "report unmatched shapes",
+    )
+    parser.add_argument(
+        "-d",
+        "--distance",
+        type=float,
+        help="compare rings of polygons on the largest displacement of "
+        "their vertices, with this maximum distance, instead of the area of "
+        "symmetric difference",
+    )
     args = parser.parse_args()
 
     if path.isdir(args.new):
@@ -115,4 +633,7 @@ def main_cli():
         args.report_identical,
         args.plot,
         tolerance=args.tolerance,
+        jobs=args.jobs,
+        unordered=args.unordered,
+        distance=args.distance,
     )
@@ -1,5 +1,8 @@
-import difflib
-import tempfile
+import itertools
+
+# Size in bytes of blocks read backwards when looking for the common
+# suffix of two files:
+_BLOCK_SIZE = 1 << 16
 
 
 def cat_not_too_many(file_in, size_lim, file_out):
@@ -21,25 +24,381 @@ def cat_not_too_many(file_in, size_lim, file_out):
         file_out.write("Too many lines in diff output\n")
 
 
+def _common_prefix(f_1, f_2):
+    """f_1 and f_2 are binary files at their beginning. Read them in
+    parallel, line by line, until they differ. Return the number of
+    identical lines and the offsets of the first differing lines.
+
+    """
+
+    n_lines = 0
+
+    while True:
+        start_1 = f_1.tell()
+        start_2 = f_2.tell()
+        line_1 = f_1.readline()
+        line_2 = f_2.readline()
+
+        if line_1 != line_2 or not line_1:
+            return n_lines, start_1, start_2
+
+        n_lines += 1
+
+
+def _reverse_lines(f_obj, start, end):
+    """Yield pairs (offset, line) for the lines of binary file f_obj
+    between byte offsets start and end, last line first. start must
+    be the offset of the beginning of a line.
+
+    """
+
+    pos = end
+    tail = b""
+
+    while pos > start:
+        size = min(_BLOCK_SIZE, pos - start)
+        pos -= size
+        f_obj.seek(pos)
+        block = f_obj.read(size) + tail
+        j = len(block)
+
+        while True:
+            # Look for the end of the previous line:
+            i = block.rfind(b"\n", 0, j - 1)
+
+            if i == -1:
+                break
+
+            yield pos + i + 1, block[i + 1 : j]
+            j = i + 1
+
+        tail = block[:j]
+
+    if tail:
+        yield start, tail
+
+
+def _common_suffix(f_1, f_2, start_1, start_2):
+    """Read binary files f_1 and f_2 backwards, line by line, without
+    going before start_1 and start_2, until they differ. Return the
+    offsets of the beginning of the common suffix.
+
+    """
+
+    end_1 = f_1.seek(0, 2)
+    end_2 = f_2.seek(0, 2)
+
+    for (offset_1, line_1), (offset_2, line_2) in zip(
+        _reverse_lines(f_1, start_1, end_1),
+        _reverse_lines(f_2, start_2, end_2),
+    ):
+        if line_1 != line_2:
+            break
+
+        end_1 = offset_1
+        end_2 = offset_2
+
+    return end_1, end_2
+
+
+def _read_lines(f_obj, start, end):
+    """Return the list of lines, as bytes, between offsets start and
+    end of binary file f_obj.
+
+    """
+
+    f_obj.seek(start)
+    lines = [line + b"\n" for line in f_obj.read(end - start).split(b"\n")]
+    lines[-1] = lines[-1][:-1]
+
+    if not lines[-1]:
+        lines.pop()
+
+    return lines
+
+
+def _middle_snake(a, a_lo, a_hi, b, b_lo, b_hi, max_cost=None):
+    """Find the middle snake of the shortest edit script between a[a_lo:
+    a_hi] and b[b_lo:b_hi], in linear space (Myers 1986). Return the
+    split point (x, y), relative to (a_lo, b_lo), or None if there is
+    no common element.
+
+    If max_cost is not None and the search goes beyond max_cost steps
+    then give up, and split at the furthest point reached by the
+    forward path, as GNU diff does when the computation is too
+    expensive. The edit script is then still valid but possibly not
+    the shortest. Since the number of edits is then larger than
+    max_cost, this does not matter if the caller only needs the edit
+    script when it is shorter than max_cost.
+
+    """
+
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    max_d = (n + m + 1) // 2
+
+    if max_cost is not None:
+        # The search stops at d = max_cost + 1, so diagonals beyond
+        # are never used:
+        max_d = min(max_d, max_cost + 2)
+
+    v_offset = max_d
+    v_length = 2 * max_d + 2
+    v_1 = [-1] * v_length
+    v_2 = [-1] * v_length
+    v_1[v_offset + 1] = 0
+    v_2[v_offset + 1] = 0
+    delta = n - m
+
+    # If the total number of elements is odd, then the front path
+    # will collide with the reverse path:
+    front = delta % 2 != 0
+
+    # Offsets for start and end of k loops, preventing mapping of
+    # space beyond the grid:
+    k_1_start = k_1_end = k_2_start = k_2_end = 0
+
+    for d in range(max_d):
+        if max_cost is not None and d > max_cost:
+            x_best = y_best = 0
+
+            for k_1 in range(-d + 1 + k_1_start, d - k_1_end, 2):
+                x_1 = v_1[v_offset + k_1]
+                y_1 = x_1 - k_1
+
+                if x_1 <= n and y_1 <= m and x_1 + y_1 > x_best + y_best:
+                    x_best = x_1
+                    y_best = y_1
+
+            if (x_best, y_best) in [(0, 0), (n, m)]:
+                return None
+            else:
+                return x_best, y_best
+
+        # Walk the front path one step:
+        for k_1 in range(-d + k_1_start, d + 1 - k_1_end, 2):
+            k_1_offset = v_offset + k_1
+
+            if k_1 == -d or (
+                k_1 != d and v_1[k_1_offset - 1] < v_1[k_1_offset + 1]
+            ):
+                x_1 = v_1[k_1_offset + 1]
+            else:
+                x_1 = v_1[k_1_offset - 1] + 1
+
+            y_1 = x_1 - k_1
+
+            while x_1 < n and y_1 < m and a[a_lo + x_1] == b[b_lo + y_1]:
+                x_1 += 1
+                y_1 += 1
+
+            v_1[k_1_offset] = x_1
+
+            if x_1 > n:
+                k_1_end += 2
+            elif y_1 > m:
+                k_1_start += 2
+            elif front:
+                k_2_offset = v_offset + delta - k_1
+
+                if 0 <= k_2_offset < v_length and v_2[k_2_offset] != -1:
+                    # Mirror x_2 onto top-left coordinate system:
+                    if x_1 >= n - v_2[k_2_offset]:
+                        return x_1, y_1
+
+        # Walk the reverse path one step:
+        for k_2 in range(-d + k_2_start, d + 1 - k_2_end, 2):
+            k_2_offset = v_offset + k_2
+
+            if k_2 == -d or (
+                k_2 != d and v_2[k_2_offset - 1] < v_2[k_2_offset + 1]
+            ):
+                x_2 = v_2[k_2_offset + 1]
+            else:
+                x_2 = v_2[k_2_offset - 1] + 1
+
+            y_2 = x_2 - k_2
+
+            while (
+                x_2 < n
+                and y_2 < m
+                and a[a_hi - x_2 - 1] == b[b_hi - y_2 - 1]
+            ):
+                x_2 += 1
+                y_2 += 1
+
+            v_2[k_2_offset] = x_2
+
+            if x_2 > n:
+                k_2_end += 2
+            elif y_2 > m:
+                k_2_start += 2
+            elif not front:
+                k_1_offset = v_offset + delta - k_2
+
+                if 0 <= k_1_offset < v_length and v_1[k_1_offset] != -1:
+                    x_1 = v_1[k_1_offset]
+                    y_1 = v_offset + x_1 - k_1_offset
+
+                    if x_1 >= n - x_2:
+                        return x_1, y_1
+
+    return None
+
+
+def _raw_regions(a, b, max_cost):
+    """Yield the differing regions (i1, i2, j1, j2) of a and b, in
+    order, possibly adjacent.
+
+    """
+
+    # Stack of sub-problems, the next one to process on top:
+    stack = [(0, len(a), 0, len(b))]
+
+    while stack:
+        a_lo, a_hi, b_lo, b_hi = stack.pop()
+
+        # Trim common prefix and suffix:
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            a_lo += 1
+            b_lo += 1
+
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+
+        if a_lo == a_hi and b_lo == b_hi:
+            continue
+
+        if a_lo == a_hi or b_lo == b_hi:
+            split = None
+        else:
+            split = _middle_snake(a, a_lo, a_hi, b, b_lo, b_hi, max_cost)
+
+        if split is None:
+            yield a_lo, a_hi, b_lo, b_hi
+        else:
+            x, y = split
+            stack.append((a_lo + x, a_hi, b_lo + y, b_hi))
+            stack.append((a_lo, a_lo + x, b_lo, b_lo + y))
+
+
+def diff_regions(a, b, max_cost=None):
+    """Yield the differing regions (i1, i2, j1, j2) of sequences a and
+    b, in order: a[i1:i2] should be replaced by b[j1:j2]. Between two
+    regions, elements of a and b are equal. The regions come from a
+    shortest edit script, found by the linear space variant of the
+    algorithm of Myers (1986). Regions are produced lazily, so the
+    caller can stop early at little cost. If max_cost is not None then
+    the edit script is only guaranteed to be the shortest if it has at
+    most max_cost edits, see _middle_snake. Adjacent regions are then
+    also not merged beyond max_cost edits, so that the first region
+    comes quickly even if the files differ entirely.
+
+    """
+
+    pending = None
+
+    for region in _raw_regions(a, b, max_cost):
+        if (
+            pending is not None
+            and region[0] == pending[1]
+            and region[2] == pending[3]
+        ):
+            pending = (pending[0], region[1], pending[2], region[3])
+
+            if (
+                max_cost is not None
+                and pending[1] - pending[0] + pending[3] - pending[2]
+                > max_cost
+            ):
+                yield pending
+                pending = None
+        else:
+            if pending is not None:
+                yield pending
+
+            pending = region
+
+    if pending is not None:
+        yield pending
+
+
+def _format_range(start, stop):
+    """Range of 0-based line indices [start, stop) in unified format."""
+
+    beginning = start + 1
+    length = stop - start
+
+    if length == 1:
+        return str(beginning)
+    elif length == 0:
+        beginning -= 1
+
+    return f"{beginning},{length}"
+
+
+def _decode(line):
+    text = line.decode("utf-8", errors="replace")
+    return text if text.endswith("\n") else text + "\n"
+
+
+def unified_diff(f_1, f_2, fromfile, tofile, max_cost=None):
+    """f_1 and f_2 are binary files at their beginning. Yield the lines
+    of their unified diff, without context, as difflib.unified_diff
+    with n=0 would. The identical head and tail of the files are
+    skipped by streaming, and only the middle part is held in
+    memory. For max_cost, see diff_regions.
+
+    """
+
+    n_prefix, start_1, start_2 = _common_prefix(f_1, f_2)
+    end_1, end_2 = _common_suffix(f_1, f_2, start_1, start_2)
+
+    if start_1 == end_1 and start_2 == end_2:
+        return
+
+    a = _read_lines(f_1, start_1, end_1)
+    b = _read_lines(f_2, start_2, end_2)
+    yield f"--- {fromfile}\n"
+    yield f"+++ {tofile}\n"
+
+    for i1, i2, j1, j2 in diff_regions(a, b, max_cost):
+        yield (
+            f"@@ -{_format_range(n_prefix + i1, n_prefix + i2)} "
+            f"+{_format_range(n_prefix + j1, n_prefix + j2)} @@\n"
+        )
+
+        for line in a[i1:i2]:
+            yield "-" + _decode(line)
+
+        for line in b[j1:j2]:
+            yield "+" + _decode(line)
+
+
 def diff_txt(path_1, path_2, size_lim, detail_file):
-    """Process path_1 and path_2 as text files."""
+    """Process path_1 and path_2 as text files. Return 0 if they are
+    identical, 1 otherwise. Computation of the diff stops as soon as
+    there are more than size_lim lines of output.
 
-    detail_file.write("\n" + "*" * 10 + "\n\n")
-    detail_file.write(f"diff_txt {path_1} {path_2}\n")
+    """
 
-    with open(path_1, encoding="utf-8") as f:
-        fromlines = f.readlines()
+    with open(path_1, "rb") as f_1, open(path_2, "rb") as f_2:
+        my_diff = unified_diff(f_1, f_2, path_1, path_2, max_cost=size_lim)
+        # (Each edit produces a line of output, so an edit script longer
+        # than size_lim would not be printed anyway.)
+        diff_lines = list(itertools.islice(my_diff, size_lim + 1))
 
-    with open(path_2, encoding="utf-8") as f:
-        tolines = f.readlines()
+    if not diff_lines:
+        return 0
 
-    my_diff = difflib.unified_diff(
-        fromlines, tolines, fromfile=path_1, tofile=path_2, n=0
-    )
+    detail_file.write("\n" + "*" * 10 + "\n\n")
+    detail_file.write(f"diff_txt {path_1} {path_2}\n")
 
-    with tempfile.TemporaryFile("w+") as diff_out:
-        diff_out.writelines(my_diff)
-        cat_not_too_many(diff_out, size_lim, detail_file)
+    if len(diff_lines) <= size_lim:
+        detail_file.writelines(diff_lines)
+    else:
+        detail_file.write("Too many lines in diff output\n")
 
     detail_file.write("\n")
     return 1
@@ -0,0 +1,131 @@
+"""Matching of the shapes of two layers whatever their order. Shapes
+with identical coordinates are matched first, through a hash of their
+binary representation. The remaining shapes of the old layer are
+matched to candidates of the new layer found by querying a spatial
+index (STRtree) of the new layer, and a candidate is accepted if the
+difference is within tolerance.
+
+"""
+
+import numpy as np
+import shapely
+
+# Type identifiers of Shapely geometries:
+_POLYGONAL = [
+    shapely.GeometryType.POLYGON,
+    shapely.GeometryType.MULTIPOLYGON,
+]
+
+
+def _exact_matches(geoms_old, geoms_new):
+    """Return the array of indices in geoms_new of the shapes of
+    geoms_old with identical coordinates, -1 if there is none.
+
+    """
+
+    index = {}
+
+    for i, key in enumerate(shapely.to_wkb(geoms_new)):
+        index.setdefault(key, []).append(i)
+
+    matches = np.full(len(geoms_old), -1)
+
+    for i, key in enumerate(shapely.to_wkb(geoms_old)):
+        candidates = index.get(key)
+
+        if candidates:
+            matches[i] = candidates.pop()
+
+    return matches
+
+
+def _scale(geoms):
+    return np.max(np.abs(shapely.bounds(geoms)), axis=1)
+
+
+def _errors(g_old, g_new):
+    """g_old and g_new are arrays of geometries of the same types,
+    pairwise. Return the array of differences: for polygons, area of
+    symmetric difference / area of old polygon, for other geometries,
+    Hausdorff distance / largest absolute coordinate of old geometry.
+    The symmetric difference cannot be computed for invalid polygons,
+    so the difference is then infinite.
+
+    """
+
+    errors = np.full(len(g_old), np.inf)
+    polygonal = np.isin(shapely.get_type_id(g_old), _POLYGONAL)
+    valid = polygonal & shapely.is_valid(g_old) & shapely.is_valid(g_new)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sym_diff = shapely.area(
+            shapely.symmetric_difference(g_new[valid], g_old[valid])
+        )
+        errors[valid] = np.where(
+            sym_diff == 0, 0.0, sym_diff / shapely.area(g_old[valid])
+        )
+        other = ~polygonal
+        distance = shapely.hausdorff_distance(g_old[other], g_new[other])
+        errors[other] = np.where(
+            distance == 0, 0.0, distance / _scale(g_old[other])
+        )
+
+    return errors
+
+
+def match_shapes(geoms_old, geoms_new, tolerance=0.0):
+    """geoms_old and geoms_new are arrays of Shapely geometries, with
+    None for null shapes. Match each old shape to at most one new
+    shape, whatever their order. Return the array of indices in
+    geoms_new of the shapes matched to geoms_old, -1 for unmatched
+    shapes, and the number of shapes matched exactly. The difference
+    between matched shapes is within tolerance, see _errors. When
+    several candidates are within tolerance, pairs with smallest
+    difference are matched first.
+
+    """
+
+    matches = _exact_matches(geoms_old, geoms_new)
+    n_exact = np.count_nonzero(matches >= 0)
+    free_new = np.ones(len(geoms_new), dtype=bool)
+    free_new[matches[matches >= 0]] = False
+    free_new &= ~shapely.is_missing(geoms_new)
+    rem_old = np.flatnonzero((matches < 0) & ~shapely.is_missing(geoms_old))
+    rem_new = np.flatnonzero(free_new)
+
+    if rem_old.size == 0 or rem_new.size == 0:
+        return matches, n_exact
+
+    g_old = geoms_old[rem_old]
+    g_new = geoms_new[rem_new]
+    tree = shapely.STRtree(g_new)
+
+    # For polygons, candidates must intersect. For other geometries,
+    # candidates must be within the distance allowed by tolerance:
+    distance = np.where(
+        np.isin(shapely.get_type_id(g_old), _POLYGONAL),
+        0.0,
+        tolerance * _scale(g_old),
+    )
+    i_old, i_new = tree.query(g_old, predicate="dwithin", distance=distance)
+    same_type = shapely.get_type_id(g_old[i_old]) == shapely.get_type_id(
+        g_new[i_new]
+    )
+    i_old = i_old[same_type]
+    i_new = i_new[same_type]
+    errors = _errors(g_old[i_old], g_new[i_new])
+    accepted = np.flatnonzero(errors <= tolerance)
+    accepted = accepted[np.argsort(errors[accepted], kind="stable")]
+    free_old = np.ones(len(g_old), dtype=bool)
+    free_new = np.ones(len(g_new), dtype=bool)
+
+    for k in accepted.tolist():
+        j_old = i_old[k]
+        j_new = i_new[k]
+
+        if free_old[j_old] and free_new[j_new]:
+            free_old[j_old] = False
+            free_new[j_new] = False
+            matches[rem_old[j_old]] = rem_new[j_new]
+
+    return matches, n_exact
@@ -0,0 +1,234 @@
+"""Optional instrumentation of comparisons. When profiling is enabled,
+each span records its wall time, CPU time (including finished child
+processes, such as ndiff or dbfdump), bytes read by the process, peak
+traced memory and number of calls. Spans are aggregated by category
+and name. When tracing is enabled, each span is written as an event of
+a timeline, in Chrome trace format. Tracing only reads the clock, so it
+can be left on. When neither is enabled, span costs almost nothing.
+
+"""
+
+import contextlib
+import json
+import os
+from os import path
+import sys
+import threading
+import time
+import tracemalloc
+
+# Statistics of spans, indexed by (category, name), None if profiling
+# is not enabled:
+_stats = None
+
+# Peak traced memory of the spans being run, innermost last:
+_peaks = []
+
+# File where trace events are written, None if tracing is not enabled:
+_trace_file = None
+
+
+class Stat:
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes_read = 0
+        self.peak_memory = 0
+
+    def add(self, other):
+        self.calls += other.calls
+        self.wall += other.wall
+        self.cpu += other.cpu
+        self.bytes_read += other.bytes_read
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+
+
+def enable():
+    """Start recording spans. Tracing memory allocations slows down the
+    Python code noticeably.
+
+    """
+
+    global _stats
+
+    _stats = {}
+    tracemalloc.start()
+
+
+def start_trace(filename):
+    """Append trace events to filename, in the JSON array format of
+    Chrome trace. The closing bracket is never written, which the
+    format allows, so that several processes, or several sessions, can
+    append to the same file, and the file stays readable if the process
+    is killed.
+
+    """
+
+    global _trace_file
+
+    new = not path.exists(filename) or path.getsize(filename) == 0
+
+    # Line buffering, so that each event is written at once:
+    _trace_file = open(filename, "a", buffering=1)
+
+    if new:
+        _trace_file.write("[\n")
+
+
+def _write_event(category, name, t0):
+    """Write a complete event for a span which started at t0, in ns, and
+    ends now.
+
+    """
+
+    t1 = time.perf_counter_ns()
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": t0 / 1000,
+        "dur": (t1 - t0) / 1000,
+        "pid": os.getpid(),
+        "tid": threading.get_native_id(),
+    }
+    _trace_file.write(json.dumps(event) + ",\n")
+
+
+def _bytes_read():
+    """Return the number of bytes read by the process so far, 0 if not
+    available.
+
+    """
+
+    try:
+        with open("/proc/self/io") as f_obj:
+            for line in f_obj:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return 0
+
+
+def _cpu_time():
+    """Return the CPU time of the process and of its finished child
+    processes.
+
+    """
+
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+
+@contextlib.contextmanager
+def span(category, name):
+    """Record the cost of the block under (category, name). Spans may be
+    nested, then the cost of the inner span is also counted in the outer
+    span.
+
+    """
+
+    if _stats is None:
+        if _trace_file is None:
+            yield
+        else:
+            t0_ns = time.perf_counter_ns()
+
+            try:
+                yield
+            finally:
+                _write_event(category, name, t0_ns)
+
+        return
+
+    # Peak memory of the enclosing span so far, before the peak is reset
+    # for this span:
+    current, peak = tracemalloc.get_traced_memory()
+
+    if _peaks:
+        _peaks[-1] = max(_peaks[-1], peak)
+
+    tracemalloc.reset_peak()
+    _peaks.append(current)
+    bytes_0 = _bytes_read()
+    cpu_0 = _cpu_time()
+    t0_ns = time.perf_counter_ns()
+
+    try:
+        yield
+    finally:
+        wall = (time.perf_counter_ns() - t0_ns) / 1e9
+        cpu = _cpu_time() - cpu_0
+        bytes_read = _bytes_read() - bytes_0
+        peak = max(_peaks.pop(), tracemalloc.get_traced_memory()[1])
+
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], peak)
+
+        stat = _stats.setdefault((category, name), Stat())
+        stat.calls += 1
+        stat.wall += wall
+        stat.cpu += cpu
+        stat.bytes_read += bytes_read
+        stat.peak_memory = max(stat.peak_memory, peak - current)
+
+        if _trace_file is not None:
+            _write_event(category, name, t0_ns)
+
+
+def collect(function, *args):
+    """Call function with args, with profiling enabled, and return the
+    result with the statistics recorded during the call. For use in
+    worker processes.
+
+    """
+
+    if _stats is None:
+        enable()
+    else:
+        _stats.clear()
+
+    return function(*args), _stats
+
+
+def merge(stats):
+    """Add statistics returned by collect in another process."""
+
+    for key, other in stats.items():
+        _stats.setdefault(key, Stat()).add(other)
+
+
+def report(filename, n_top=20, file=sys.stdout):
+    """Write the statistics to the JSON file filename and the n_top
+    most costly spans, by wall time, as a table to file.
+
+    """
+
+    items = sorted(_stats.items(), key=lambda item: item[1].wall, reverse=True)
+
+    with open(filename, "w") as f_obj:
+        json.dump(
+            [
+                {"category": category, "name": name} | vars(stat)
+                for (category, name), stat in items
+            ],
+            f_obj,
+            indent=1,
+        )
+        f_obj.write("\n")
+
+    file.write(
+        f"\nMost costly spans (see {filename}):\n"
+        f"{'wall (s)':>9} {'CPU (s)':>9} {'read (MiB)':>10} "
+        f"{'peak (MiB)':>10} {'calls':>7}  category: name\n"
+    )
+
+    for (category, name), stat in items[:n_top]:
+        file.write(
+            f"{stat.wall:9.3f} {stat.cpu:9.3f} "
+            f"{stat.bytes_read / 2**20:10.1f} "
+            f"{stat.peak_memory / 2**20:10.1f} {stat.calls:7}  "
+            f"{category}: {name}\n"
+        )
@@ -1,13 +1,76 @@
+from concurrent import futures
 import datetime
 import time
 from os import path
 import pathlib
 import argparse
+import sys
 
 from . import selective_diff
 from . import read_runs
 from . import compare_single_test
 from . import cat_compar
+from . import profiling
+
+
+def merge_args(sel_diff_args_cli, run):
+    """Merge options for selective_diff from the command line with
+    options from the test description of a run, giving priority to the
+    test description, except that lists are concatenated. Return a new
+    dictionary, without modifying sel_diff_args_cli.
+
+    """
+
+    sel_diff_args_merge = sel_diff_args_cli.copy()
+
+    for k, v in run.get("sel_diff_args", {}).items():
+        if k in sel_diff_args_merge:
+            if isinstance(v, list) and sel_diff_args_merge[k] is not None:
+                # Create a new list so that the list from the command
+                # line is not modified:
+                sel_diff_args_merge[k] = sel_diff_args_merge[k] + v
+            else:
+                sel_diff_args_merge[k] = v
+        else:
+            sys.exit(
+                f"Found {k} in sel_diff_args in test description, not known "
+                "in selective_diff"
+            )
+
+    return sel_diff_args_merge
+
+
+def _to_compare(my_runs, compare_dir, sel_diff_args_cli):
+    """Yield, for each title in my_runs, in order, the triplet (index,
+    title, merged options for selective_diff), or (index, title,
+    message) if the title cannot be compared.
+
+    """
+
+    for i, title in enumerate(my_runs):
+        if path.exists(title) and not pathlib.Path(title, "failed").exists():
+            old_dir = path.join(compare_dir, title)
+
+            if path.exists(old_dir):
+                yield i, title, merge_args(sel_diff_args_cli, my_runs[title])
+            else:
+                yield i, title, f"{old_dir} does not exist"
+        else:
+            yield i, title, "Does not exist or failed"
+
+
+def _previous_result(title, args, sel_diff_args, my_runs):
+    """Return the return code of the last comparison of title if it can
+    be reused, None otherwise.
+
+    """
+
+    if args.force:
+        return None
+
+    return compare_single_test.previous_result(
+        title, args.compare_dir, sel_diff_args, my_runs[title].get("outputs")
+    )
 
 
 def main_cli():
@@ -26,6 +89,30 @@ def main_cli():
     parser.add_argument(
         "--cat", help="cat files comparison.txt", metavar="FILE"
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        help="number of worker processes comparing titles (default 1)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="compare again titles unchanged since their last comparison",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="record the cost of titles, comparators and files, write it to "
+        "JSON file FILE and print the most costly",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="append a timeline of the comparison of each title and file to "
+        "FILE, in Chrome trace format, for chrome://tracing or Perfetto",
+    )
     args = parser.parse_args()
     my_runs = read_runs.read_runs(args.test_descr)
     print("Number of runs:", len(my_runs))
@@ -34,49 +121,117 @@ def main_cli():
     cumul_return = 0
     sel_diff_args_merge = vars(args).copy()
 
-    for x in ["compare_dir", "test_descr", "cat"]:
+    for x in [
+        "compare_dir",
+        "test_descr",
+        "cat",
+        "jobs",
+        "force",
+        "profile",
+        "trace",
+    ]:
         del sel_diff_args_merge[x]
 
-    for i, title in enumerate(my_runs):
-        print(f"{i}: {title}")
+    if args.profile:
+        profiling.enable()
 
-        if path.exists(title) and not pathlib.Path(title, "failed").exists():
-            old_dir = path.join(args.compare_dir, title)
+    if args.trace:
+        profiling.start_trace(args.trace)
+        # Worker processes append to the same file:
+        initializer = profiling.start_trace
+        initargs = (args.trace,)
+    else:
+        initializer = None
+        initargs = ()
 
-            if path.exists(old_dir):
-                # Merge options for selective_diff from the command
-                # line with options from the test description, giving
-                # priority to the command line:
-                if "sel_diff_args" in my_runs[title]:
-                    for k, v in my_runs[title]["sel_diff_args"].items():
-                        if k in sel_diff_args_merge:
-                            if (
-                                isinstance(v, list)
-                                and sel_diff_args_merge[k] is not None
-                            ):
-                                sel_diff_args_merge[k] += v
-                            else:
-                                sel_diff_args_merge[k] = v
-                        else:
-                            sys.exit(
-                                f"Found {k} in sel_diff_args in test "
-                                "description, not known in selective_diff"
-                            )
-
-                return_code = compare_single_test.compare_single_test(
-                    title, args.compare_dir, sel_diff_args_merge
+    if args.jobs == 1:
+        for i, title, sel_diff_args in _to_compare(
+            my_runs, args.compare_dir, sel_diff_args_merge
+        ):
+            print(f"{i}: {title}")
+
+            if isinstance(sel_diff_args, str):
+                print(sel_diff_args)
+            else:
+                return_code = _previous_result(
+                    title, args, sel_diff_args, my_runs
                 )
 
+                if return_code is None:
+                    return_code = compare_single_test.compare_single_test(
+                        title,
+                        args.compare_dir,
+                        sel_diff_args,
+                        my_runs[title].get("outputs"),
+                    )
+                else:
+                    print("unchanged since last comparison")
+
+                if return_code != 0:
+                    print("difference found")
+                    cumul_return += 1
+    else:
+        with futures.ProcessPoolExecutor(
+            args.jobs, initializer=initializer, initargs=initargs
+        ) as executor:
+            pending = {}
+
+            for i, title, sel_diff_args in _to_compare(
+                my_runs, args.compare_dir, sel_diff_args_merge
+            ):
+                if isinstance(sel_diff_args, str):
+                    print(f"{i}: {title}")
+                    print(sel_diff_args)
+                    continue
+
+                return_code = _previous_result(
+                    title, args, sel_diff_args, my_runs
+                )
+
+                if return_code is not None:
+                    print(f"{i}: {title}")
+                    print("unchanged since last comparison")
+
+                    if return_code != 0:
+                        print("difference found")
+                        cumul_return += 1
+                else:
+                    call = (
+                        compare_single_test.compare_single_test,
+                        title,
+                        args.compare_dir,
+                        sel_diff_args,
+                        my_runs[title].get("outputs"),
+                    )
+
+                    if args.profile:
+                        # Bring back the statistics of the worker:
+                        future = executor.submit(profiling.collect, *call)
+                    else:
+                        future = executor.submit(*call)
+
+                    pending[future] = i, title
+
+            for n_done, future in enumerate(
+                futures.as_completed(pending), start=1
+            ):
+                i, title = pending[future]
+                print(f"[{n_done}/{len(pending)}] {i}: {title}")
+                return_code = future.result()
+
+                if args.profile:
+                    return_code, stats = return_code
+                    profiling.merge(stats)
+
                 if return_code != 0:
                     print("difference found")
                     cumul_return += 1
-            else:
-                print(old_dir, "does not exist")
-        else:
-            print("Does not exist or failed")
 
     if args.cat:
         cat_compar.cat_compar(args.cat, list(my_runs))
 
     print("Elapsed time:", time.perf_counter() - t0, "s")
     print("Number of successful runs with different results:", cumul_return)
+
+    if args.profile:
+        profiling.report(args.profile)
@@ -0,0 +1,190 @@
+"""Registry of comparators by file suffix, and cached probing of file
+types with libmagic.
+
+A comparator is a function taking arguments path_1, path_2,
+detail_file and returning 0 if no difference is found, 1
+otherwise. Comparators for new suffixes can be registered without
+editing detailed_diff.py:
+
+- with an entry point in the group "testcmp.comparators" of an
+  installed package, with the suffix as name and the function as
+  object reference;
+
+- with a string "SUFFIX=MODULE:FUNCTION" in the argument comparator
+  of selective_diff (option --comparator on the command line, key
+  "comparator" of sel_diff_args in a test description).
+
+Comparators given to selective_diff have priority over entry points,
+which have priority over the comparators built into DetailedDiff.
+
+"""
+
+import functools
+import glob
+import importlib
+from importlib import metadata
+import os
+from os import path
+import shutil
+import site
+import sysconfig
+
+import magic
+
+from testcmp import profiling
+
+ENTRY_POINT_GROUP = "testcmp.comparators"
+
+# External programs called by comparators:
+EXTERNAL_TOOLS = [
+    "ndiff",
+    "numdiff",
+    "max_diff_rect",
+    "dbfdump",
+    "ncdump",
+    "nccmp",
+    "max_diff_nc.sh",
+]
+
+# File types found by libmagic, indexed by (device, inode,
+# modification time):
+_file_types = {}
+
+
+def normalize_suffix(suffix):
+    return suffix if suffix.startswith(".") else "." + suffix
+
+
+def load_comparator(reference):
+    """reference is a string "MODULE:FUNCTION"."""
+
+    module_name, sep, function_name = reference.partition(":")
+
+    if not sep or not module_name or not function_name:
+        raise ValueError(
+            f"Bad comparator reference {reference!r}, should be "
+            "MODULE:FUNCTION"
+        )
+
+    module = importlib.import_module(module_name)
+    return getattr(module, function_name)
+
+
+def parse_comparators(comparator_list):
+    """comparator_list is a list of strings "SUFFIX=MODULE:FUNCTION".
+    Return a dictionary of comparators indexed by suffix.
+
+    """
+
+    comparators = {}
+
+    for item in comparator_list:
+        suffix, sep, reference = item.partition("=")
+
+        if not sep or not suffix:
+            raise ValueError(
+                f"Bad comparator {item!r}, should be SUFFIX=MODULE:FUNCTION"
+            )
+
+        comparators[normalize_suffix(suffix)] = load_comparator(reference)
+
+    return comparators
+
+
+def entry_point_comparators():
+    """Return a dictionary of comparators registered as entry points,
+    indexed by suffix.
+
+    """
+
+    try:
+        entry_points = metadata.entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:
+        # Python < 3.10
+        entry_points = metadata.entry_points().get(ENTRY_POINT_GROUP, [])
+
+    return {normalize_suffix(ep.name): ep.load() for ep in entry_points}
+
+
+def _development_mode():
+    """Return True if testcmp is not imported from a site-packages
+    directory, that is, if it is run from a source tree or installed in
+    development mode, so that its modules may be edited.
+
+    """
+
+    package_dir = path.join(path.dirname(path.abspath(__file__)), "")
+    paths = sysconfig.get_paths()
+    site_dirs = [
+        paths["purelib"],
+        paths["platlib"],
+        site.getusersitepackages(),
+    ]
+
+    try:
+        site_dirs.extend(site.getsitepackages())
+    except AttributeError:
+        # Old virtualenv
+        pass
+
+    return not any(
+        package_dir.startswith(path.join(path.abspath(x), ""))
+        for x in site_dirs
+    )
+
+
+@functools.cache
+def comparator_version():
+    """Return a list of strings identifying the code of comparators: the
+    version of testcmp, the modification times of its modules, only if
+    they may be edited (see _development_mode), and the path, size and
+    modification time of each external program. Results of comparisons
+    recorded with another list may be outdated. Computed once per
+    process.
+
+    """
+
+    try:
+        version = [metadata.version("testcmp")]
+    except metadata.PackageNotFoundError:
+        version = []
+
+    if _development_mode():
+        modules = glob.glob(path.join(path.dirname(__file__), "*.py"))
+
+        for module in sorted(modules):
+            mtime = os.stat(module).st_mtime_ns
+            version.append(f"{path.basename(module)} {mtime}")
+
+    for tool in EXTERNAL_TOOLS:
+        tool_path = shutil.which(tool)
+
+        if tool_path is not None:
+            stat_result = os.stat(tool_path)
+            version.append(
+                f"{tool_path} {stat_result.st_size} {stat_result.st_mtime_ns}"
+            )
+
+    return version
+
+
+def file_type(filename):
+    """Return the description of the type of file given by libmagic,
+    following symbolic links. The result is cached by inode and
+    modification time so libmagic reads each file at most once.
+
+    """
+
+    real_path = path.realpath(filename)
+    stat_result = os.stat(real_path)
+    key = (stat_result.st_dev, stat_result.st_ino, stat_result.st_mtime_ns)
+
+    try:
+        description = _file_types[key]
+    except KeyError:
+        with profiling.span("libmagic", "from_file"):
+            description = magic.from_file(real_path)
+
+        _file_types[key] = description
+
+    return description
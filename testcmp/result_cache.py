@@ -0,0 +1,173 @@
+"""On-disk cache of the results of comparators, addressed by the
+contents of the compared files. An entry is a JSON file in the cache
+directory, named after its key and holding the return code and the
+report of the comparator. The least recently used entries are removed
+when the total size of the cache exceeds its limit.
+
+"""
+
+import hashlib
+import json
+import os
+from os import path
+import tempfile
+
+from testcmp import registry
+
+# Size in bytes of the blocks read at once for hashing:
+BLOCK_SIZE = 1 << 20
+
+# Placeholders for the paths of the compared files in stored reports,
+# so that an entry can be reused for other paths with the same
+# contents:
+PLACEHOLDERS = ["\0path_1\0", "\0path_2\0"]
+
+# Digests of file contents, indexed by (device, inode, size,
+# modification time):
+_digests = {}
+
+
+def file_digest(filename):
+    """Return the hexadecimal digest of the content of filename. The
+    result is cached by inode and modification time so each file is read
+    at most once.
+
+    """
+
+    stat_result = os.stat(filename)
+    key = (
+        stat_result.st_dev,
+        stat_result.st_ino,
+        stat_result.st_size,
+        stat_result.st_mtime_ns,
+    )
+
+    try:
+        digest = _digests[key]
+    except KeyError:
+        h = hashlib.blake2b(digest_size=16)
+
+        with open(filename, "rb") as f_obj:
+            while block := f_obj.read(BLOCK_SIZE):
+                h.update(block)
+
+        digest = h.hexdigest()
+        _digests[key] = digest
+
+    return digest
+
+
+class ResultCache:
+    def __init__(self, directory, max_size=64 << 20):
+        """max_size is the maximum total size in bytes of the entries."""
+
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(
+            entry.stat().st_size
+            for entry in os.scandir(directory)
+            if entry.name.endswith(".json")
+        )
+
+    def key(self, files_1, files_2, comparator_name, options):
+        """files_1 and files_2 are the lists of files read by the
+        comparator for the old and the new side. options is a
+        JSON-serializable description of the options of the comparator.
+
+        """
+
+        description = [
+            [file_digest(f) for f in files_1],
+            [file_digest(f) for f in files_2],
+            comparator_name,
+            options,
+            # Results of older comparators are not reused:
+            registry.comparator_version(),
+        ]
+        return hashlib.blake2b(
+            json.dumps(description, default=str).encode(), digest_size=16
+        ).hexdigest()
+
+    def get(self, key, path_1, path_2):
+        """Return the pair (return code, report) stored for key, with
+        the paths of the compared files substituted in the report, or
+        None if there is no entry for key.
+
+        """
+
+        entry = path.join(self.directory, key + ".json")
+
+        try:
+            with open(entry) as f_obj:
+                return_code, report = json.load(f_obj)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        try:
+            # Mark as recently used:
+            os.utime(entry)
+        except FileNotFoundError:
+            # Removed by another process.
+            pass
+
+        for placeholder, filename in zip(PLACEHOLDERS, [path_1, path_2]):
+            report = report.replace(placeholder, filename)
+
+        return return_code, report
+
+    def put(self, key, path_1, path_2, return_code, report):
+        # Replace the longer path first, in case the other path is a
+        # substring of it:
+        for placeholder, filename in sorted(
+            zip(PLACEHOLDERS, [path_1, path_2]),
+            key=lambda item: len(item[1]),
+            reverse=True,
+        ):
+            report = report.replace(filename, placeholder)
+
+        # Write to a temporary file then rename, so that processes
+        # sharing the cache never read an incomplete entry:
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.directory, suffix=".tmp", delete=False
+        ) as f_obj:
+            json.dump([return_code, report], f_obj)
+
+        self._size += os.path.getsize(f_obj.name)
+        os.replace(f_obj.name, path.join(self.directory, key + ".json"))
+
+        if self._size > self.max_size:
+            self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries until the total size
+        is at most 3 / 4 of max_size.
+
+        """
+
+        entries = []
+
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                try:
+                    stat_result = entry.stat()
+                except FileNotFoundError:
+                    continue
+
+                entries.append(
+                    (stat_result.st_mtime_ns, stat_result.st_size, entry.path)
+                )
+
+        entries.sort()
+        self._size = sum(size for mtime, size, entry_path in entries)
+
+        for mtime, size, entry_path in entries:
+            if self._size <= self.max_size * 3 // 4:
+                break
+
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+
+            self._size -= size
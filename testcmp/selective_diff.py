@@ -4,26 +4,242 @@ from os import path
 import os
 import fnmatch
 import io
+import pathlib
 import traceback
 
 from testcmp import detailed_diff
+from testcmp import diff_budget
+from testcmp import profiling
+from testcmp import result_cache
 
 
-def my_report(dcmp: filecmp.dircmp, d_diff, file_out, level, ign_funny=False):
+def included(rel_path, include):
+    """Return True if rel_path, or one of its parent directories,
+    matches one of the shell patterns in the list include.
+
+    """
+
+    parts = pathlib.PurePath(rel_path).parts
+
+    for i in range(len(parts)):
+        prefix = path.join(*parts[: i + 1])
+
+        for pattern in include:
+            if fnmatch.fnmatch(prefix, pattern):
+                return True
+
+    return False
+
+
+def kept_paths(root, include):
+    """Return the set of paths, relative to directory root, of files and
+    directories matching one of the shell patterns in the list include,
+    and of all their parent directories. The content of matching
+    directories is not listed, since it matches too.
+
+    """
+
+    kept = set()
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = path.relpath(dirpath, root)
+
+        for name in filenames + dirnames:
+            rel_path = path.normpath(path.join(rel_dir, name))
+
+            if included(rel_path, include):
+                while rel_path not in kept and rel_path != ".":
+                    kept.add(rel_path)
+                    rel_path = path.dirname(rel_path) or "."
+
+        # Do not walk matching directories:
+        dirnames[:] = [
+            x
+            for x in dirnames
+            if not included(path.normpath(path.join(rel_dir, x)), include)
+        ]
+
+    return kept
+
+
+class Dircmp(filecmp.dircmp):
+    """Like filecmp.dircmp, with options of selective_diff.
+
+    If include is not None then it must be a list of shell patterns,
+    and root must be the pair of top directories compared. A file is
+    then only considered if its path relative to the top directory
+    matches one of the patterns, and a directory is only considered
+    if it matches or contains such a file.
+
+    If link_targets is true then, when a common name is a symbolic
+    link in both directories, the two links are compared by their
+    targets, without reading what they point to. Links with identical
+    targets, or with targets resolving to the same path, go into
+    same_files. Other links go into diff_links.
+
+    """
+
+    def __init__(
+        self,
+        a,
+        b,
+        ignore=None,
+        hide=None,
+        link_targets=False,
+        include=None,
+        root=None,
+        kept=None,
+    ):
+        """kept is the pair of results of kept_paths for the top
+        directories, computed if None.
+
+        """
+
+        super().__init__(a, b, ignore, hide)
+        self.link_targets = link_targets
+        self.include = include
+        self.root = (a, b) if root is None else root
+
+        if include is not None and kept is None:
+            # Walk the trees once, for all subdirectories:
+            kept = [kept_paths(top, include) for top in self.root]
+
+        self.kept = kept
+
+    def phase0(self):
+        with profiling.span("dircmp", "list directories"):
+            filecmp.dircmp.phase0(self)
+
+        if self.include is not None:
+            self.left_list = [
+                x for x in self.left_list if self._is_included(0, self.left, x)
+            ]
+            self.right_list = [
+                x
+                for x in self.right_list
+                if self._is_included(1, self.right, x)
+            ]
+
+    def _is_included(self, side, directory, name):
+        """side is 0 for the left tree, 1 for the right tree."""
+
+        rel_path = path.relpath(path.join(directory, name), self.root[side])
+        return rel_path in self.kept[side] or included(rel_path, self.include)
+
+    def phase2(self):
+        filecmp.dircmp.phase2(self)
+        self.common_links = []
+
+        if self.link_targets:
+            for x in self.common:
+                a_path = path.join(self.left, x)
+                b_path = path.join(self.right, x)
+
+                if path.islink(a_path) and path.islink(b_path):
+                    self.common_links.append(x)
+
+            if self.common_links:
+                links = set(self.common_links)
+                self.common_dirs = [
+                    x for x in self.common_dirs if x not in links
+                ]
+                self.common_files = [
+                    x for x in self.common_files if x not in links
+                ]
+                self.common_funny = [
+                    x for x in self.common_funny if x not in links
+                ]
+
+    def phase3(self):
+        with profiling.span("dircmp", "compare files"):
+            filecmp.dircmp.phase3(self)
+
+        self.diff_links = []
+
+        for x in self.common_links:
+            a_path = path.join(self.left, x)
+            b_path = path.join(self.right, x)
+
+            if os.readlink(a_path) == os.readlink(b_path):
+                self.same_files.append(x)
+            elif path.realpath(a_path) == path.realpath(b_path):
+                self.same_files.append(x)
+            else:
+                self.diff_links.append(x)
+
+    def phase4(self):
+        self.subdirs = {}
+
+        for x in self.common_dirs:
+            a_x = path.join(self.left, x)
+            b_x = path.join(self.right, x)
+            self.subdirs[x] = self.__class__(
+                a_x,
+                b_x,
+                self.ignore,
+                self.hide,
+                self.link_targets,
+                self.include,
+                self.root,
+                self.kept,
+            )
+
+    methodmap = dict(
+        filecmp.dircmp.methodmap,
+        left_list=phase0,
+        right_list=phase0,
+        subdirs=phase4,
+        same_files=phase3,
+        diff_files=phase3,
+        funny_files=phase3,
+        diff_links=phase3,
+        common_dirs=phase2,
+        common_files=phase2,
+        common_funny=phase2,
+        common_links=phase2,
+    )
+
+
+def my_report(
+    dcmp: filecmp.dircmp,
+    d_diff,
+    file_out,
+    level,
+    ign_funny=False,
+    budget=None,
+):
+    """budget is a diff_budget.Budget instance. If the budget is used up
+    then remaining files and subdirectories are not analysed.
+
+    """
+
+    if budget is None:
+        budget = diff_budget.Budget()
 
     detail_file = io.StringIO()
     n_diff = len(dcmp.left_only) + len(dcmp.right_only)
+    diff_links = getattr(dcmp, "diff_links", [])
+    n_diff += len(diff_links)
 
     if not ign_funny:
         n_diff += +len(dcmp.common_funny) + len(dcmp.funny_files)
 
+    budget.consume(n_diff)
+
     if d_diff is None:
         n_diff += len(dcmp.diff_files)
+        budget.consume(len(dcmp.diff_files))
     else:
         for name in dcmp.diff_files:
+            if budget.exhausted():
+                budget.truncated = True
+                break
+
             path_1 = path.join(dcmp.left, name)
             path_2 = path.join(dcmp.right, name)
-            n_diff += d_diff.diff(path_1, path_2, detail_file)
+            n_diff_file = d_diff.diff(path_1, path_2, detail_file)
+            budget.consume(n_diff_file)
+            n_diff += n_diff_file
 
     if n_diff != 0:
         print(
@@ -71,6 +287,21 @@ def my_report(dcmp: filecmp.dircmp, d_diff, file_out, level, ign_funny=False):
 
             file_out.write("\n")
 
+        if diff_links:
+            diff_links.sort()
+            print("Symbolic links with different targets :", file=file_out)
+
+            for x in diff_links:
+                print(
+                    x,
+                    ":",
+                    os.readlink(path.join(dcmp.left, x)),
+                    os.readlink(path.join(dcmp.right, x)),
+                    file=file_out,
+                )
+
+            file_out.write("\n")
+
         if dcmp.funny_files:
             dcmp.funny_files.sort()
             print("Trouble with common files :", file=file_out)
@@ -104,7 +335,13 @@ def my_report(dcmp: filecmp.dircmp, d_diff, file_out, level, ign_funny=False):
     detail_file.close()
 
     for sub_dcmp in dcmp.subdirs.values():
-        n_diff += my_report(sub_dcmp, d_diff, file_out, level + 1, ign_funny)
+        if budget.exhausted():
+            budget.truncated = True
+            break
+
+        n_diff += my_report(
+            sub_dcmp, d_diff, file_out, level + 1, ign_funny, budget
+        )
 
     return n_diff
 
@@ -115,6 +352,7 @@ def selective_diff(
     brief=False,
     numdiff=False,
     max_diff_rect=False,
+    pyndiff=False,
     ncdump=False,
     max_diff_nc=False,
     Ziemlinski=False,
@@ -123,8 +361,44 @@ def selective_diff(
     tolerance=1e-7,
     ign_att=None,
     ign_funny=False,
+    max_diffs=None,
+    first_diff=False,
+    comparator=None,
+    link_targets=False,
+    include=None,
+    csv_keys=None,
+    shp_jobs=1,
+    shp_unordered=False,
+    shp_layer=False,
+    shp_distance=None,
+    png_diff_image=False,
+    cache=None,
+    cache_size=64,
     file_out=sys.stdout,
 ):
+    """max_diffs is the maximum number of differences after which the
+    comparison stops, None means no limit. first_diff is equivalent
+    to max_diffs = 1. comparator is a list of strings
+    "SUFFIX=MODULE:FUNCTION" registering additional comparators for
+    detailed comparison. If link_targets is true then two symbolic
+    links are compared by their targets only, see class Dircmp. If
+    include is not None then only files matching one of the shell
+    patterns in the list include are compared, see class Dircmp. If
+    csv_keys is not None then rows of CSV files are matched on the
+    values of the columns in the list csv_keys, whatever their order.
+    shp_jobs is the number of worker processes comparing records of
+    shapefiles. If shp_unordered is true then shapes of shapefiles are
+    matched whatever their order. If shp_layer is true then the files
+    making up a shapefile are compared together, see diff_layer. If
+    shp_distance is not None then rings of polygons are compared on the
+    displacement of their vertices, see diff_shp. If png_diff_image is
+    true then pictures of the differences between PNG files are
+    written. If cache is not None then it is the directory of a cache
+    of results of comparators, shared between calls, with a maximum
+    size of cache_size MiB, see result_cache.
+
+    """
+
     if not path.isdir(directory[0]) or not path.isdir(directory[1]):
         print("\nBad directories: ", *directory, file=sys.stderr)
         sys.exit(2)
@@ -142,7 +416,14 @@ def selective_diff(
 
     # done
 
-    dcmp = filecmp.dircmp(*directory, list(ignore))
+    dcmp = Dircmp(
+        *directory, list(ignore), link_targets=link_targets, include=include
+    )
+
+    if first_diff:
+        max_diffs = 1
+
+    budget = diff_budget.Budget(max_diffs)
 
     # Define a detailed_diff instance:
     if brief:
@@ -152,6 +433,8 @@ def selective_diff(
             diff_csv_option = "numdiff"
         elif max_diff_rect:
             diff_csv_option = "max_diff_rect"
+        elif pyndiff:
+            diff_csv_option = "pyndiff"
         else:
             diff_csv_option = None
 
@@ -164,12 +447,31 @@ def selective_diff(
         else:
             diff_nc = None
 
+        if cache is not None:
+            cache = result_cache.ResultCache(cache, cache_size << 20)
+
         d_diff = detailed_diff.DetailedDiff(
-            limit, pyshp, diff_csv_option, diff_nc, tolerance, ign_att
+            limit,
+            pyshp,
+            diff_csv_option,
+            diff_nc,
+            tolerance,
+            ign_att,
+            budget,
+            comparator,
+            csv_keys,
+            shp_jobs,
+            shp_unordered,
+            shp_layer,
+            shp_distance,
+            png_diff_image,
+            cache,
         )
 
     try:
-        n_diff = my_report(dcmp, d_diff, file_out, level=1, ign_funny=ign_funny)
+        n_diff = my_report(
+            dcmp, d_diff, file_out, level=1, ign_funny=ign_funny, budget=budget
+        )
     except Exception:
         traceback.print_exc()
         sys.exit(2)
@@ -178,6 +480,15 @@ def selective_diff(
         return 0
     else:
         print("\nNumber of differences:", n_diff, file=file_out)
+
+        if budget.truncated:
+            print(
+                f"Stopped after {n_diff} difference(s), limit {max_diffs}, "
+                "the result is truncated: some files and directories were "
+                "not compared.",
+                file=file_out,
+            )
+
         return 1
 
 
@@ -185,7 +496,10 @@ def add_options(parser):
     parser.add_argument(
         "--pyshp",
         action="store_true",
-        help="use pyshp to " "compare DBF files (default dbfdump)",
+        help="compare DBF files with the built-in reader, column by "
+        "column, with a tolerance on numeric fields (default dbfdump, if "
+        "available; the name of the option is historical, pyshp is not "
+        "used)",
     )
 
     # CSV files:
@@ -198,15 +512,81 @@ def add_options(parser):
     group.add_argument(
         "--max_diff_rect",
         action="store_true",
-        help="use max_diff_rect to compare CSV files (default ndiff)",
+        help="use diff_rect, the Python version of max_diff_rect, to compare "
+        "CSV files, skipping the first row (default ndiff)",
+    )
+    group.add_argument(
+        "--pyndiff",
+        action="store_true",
+        help="use the Python engine with ndiff semantics to compare CSV "
+        "files, without running a subprocess (default ndiff, or pyndiff if "
+        "ndiff is not installed)",
+    )
+    parser.add_argument(
+        "--csv_keys",
+        metavar="COL",
+        action="append",
+        help="match rows of CSV files on the values of column COL (name in "
+        "header or 1-based number), whatever the order of rows, instead of "
+        "comparing line by line (files without column COL are still "
+        "compared line by line)",
     )
     parser.add_argument(
         "-t",
         "--tolerance",
         default=1e-7,
         type=float,
-        help="maximum relative error for comparison of CSV files with ndiff "
-        "or numdiff and comparison of SHP files (default 1e-7)",
+        help="maximum relative error for comparison of CSV files with ndiff, "
+        "pyndiff or numdiff and comparison of SHP files (default 1e-7)",
+    )
+    parser.add_argument(
+        "--shp_jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help="number of worker processes comparing records of SHP files "
+        "(default 1)",
+    )
+    parser.add_argument(
+        "--shp_unordered",
+        action="store_true",
+        help="match shapes of SHP files whatever their order, and report "
+        "unmatched shapes (default compare shapes with the same record "
+        "number)",
+    )
+    parser.add_argument(
+        "--shp_layer",
+        action="store_true",
+        help="compare SHP, SHX and DBF files of a shapefile together, in a "
+        "single pass, with one report per feature (default separately)",
+    )
+    parser.add_argument(
+        "--shp_distance",
+        type=float,
+        help="compare rings of polygons in shapefiles on the largest "
+        "displacement of their vertices, with this maximum distance "
+        "(default area of symmetric difference)",
+    )
+    parser.add_argument(
+        "--png_diff_image",
+        action="store_true",
+        help="write a picture of the differences between PNG files to "
+        "diff_image.png, in the directory of the new file",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="look up the results of detailed comparisons in a cache in "
+        "directory DIR, by contents of compared files and options, and "
+        "store new results there (default no cache)",
+    )
+    parser.add_argument(
+        "--cache_size",
+        metavar="MIB",
+        type=int,
+        default=64,
+        help="maximum size of the cache, in MiB, least recently used "
+        "results are removed beyond (default 64)",
     )
 
     # NetCDF files:
@@ -234,6 +614,13 @@ def add_options(parser):
         help="global attribute of NetCDF file to ignore",
     )
 
+    parser.add_argument(
+        "--comparator",
+        metavar="SUFFIX=MODULE:FUNCTION",
+        action="append",
+        help="compare files with suffix SUFFIX using FUNCTION(path_1, "
+        "path_2, detail_file) from MODULE",
+    )
     parser.add_argument(
         "-l",
         "--limit",
@@ -257,6 +644,34 @@ def add_options(parser):
         default=[],
         help="exclude files that match shell pattern PAT",
     )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--max-diffs",
+        metavar="N",
+        type=int,
+        help="stop comparing after N differences have been found "
+        "(default no limit)",
+    )
+    group.add_argument(
+        "--first-diff",
+        action="store_true",
+        help="stop comparing at the first difference (same as --max-diffs 1)",
+    )
+    parser.add_argument(
+        "-i",
+        "--include",
+        metavar="PAT",
+        action="append",
+        help="only compare files whose path relative to the compared "
+        "directories matches shell pattern PAT, or is in a directory "
+        "matching PAT (default compare all files)",
+    )
+    parser.add_argument(
+        "--link_targets",
+        action="store_true",
+        help="compare two symbolic links by their targets, without reading "
+        "the files they point to",
+    )
     parser.add_argument(
         "--ign_funny",
         action="store_true",
@@ -274,5 +689,22 @@ def main_cli():
     # (This is not in add_options because, for re_compare, the
     # directories to compare should not be in the command line.)
 
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="record the cost of comparators and files, write it to JSON "
+        "file FILE and print the most costly",
+    )
     args = parser.parse_args()
-    return selective_diff(**vars(args))
+    sel_diff_args = vars(args).copy()
+    del sel_diff_args["profile"]
+
+    if args.profile:
+        profiling.enable()
+
+    return_code = selective_diff(**sel_diff_args)
+
+    if args.profile:
+        profiling.report(args.profile)
+
+    return return_code
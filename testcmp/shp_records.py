@@ -0,0 +1,229 @@
+"""Direct access to the raw bytes of the records of shapefiles. The
+records are located with the index files (.shx), and the main files
+(.shp) are memory-mapped, so that records can be compared without
+decoding them, and simple records can be decoded at once.
+
+"""
+
+import numpy as np
+import shapefile
+import shapely
+
+
+def read_index(shx, start=0, stop=None):
+    """shx is an index file opened in binary mode. Return the arrays of
+    offsets and lengths, in bytes, of the contents of records in
+    range(start, stop) (after the record headers) in the main file. stop
+    = None means up to the last record.
+
+    """
+
+    # Skip the header of 100 bytes, then each record is described by
+    # offset and length in 16-bit words, as big-endian integers:
+    shx.seek(100 + 8 * start)
+
+    if stop is None:
+        data = shx.read()
+    else:
+        data = shx.read(8 * (stop - start))
+
+    index = np.frombuffer(data, dtype=">i4").reshape(-1, 2)
+    index = index.astype(np.int64) * 2
+    return index[:, 0] + 8, index[:, 1]
+
+
+def differing_records(map_1, map_2, index_1, index_2, start, stop):
+    """map_1 and map_2 are memory maps of the main files, index_1 and
+    index_2 the corresponding pairs of arrays (offsets, lengths)
+    returned by read_index. Return a boolean array telling which
+    records, in range(start, stop), have different contents. The range
+    should not be empty.
+
+    """
+
+    offset_1 = index_1[0][start:stop]
+    offset_2 = index_2[0][start:stop]
+    length_1 = index_1[1][start:stop]
+    length_2 = index_2[1][start:stop]
+    differ = length_1 != length_2
+    shift = offset_2 - offset_1
+
+    if not np.any(differ) and np.all(shift == shift[0]):
+        # The records have the same layout in the two files, compare
+        # the whole span at once. This includes record headers between
+        # the contents, which are identical if the lengths are
+        # identical.
+        lo = offset_1[0]
+        hi = offset_1[-1] + length_1[-1]
+        bytes_1 = np.frombuffer(map_1, np.uint8, hi - lo, lo)
+        bytes_2 = np.frombuffer(map_2, np.uint8, hi - lo, lo + shift[0])
+        differ = np.logical_or.reduceat(bytes_1 != bytes_2, offset_1 - lo)
+        del bytes_1, bytes_2
+        # (Release the exported buffers so that the maps can be
+        # closed.)
+    else:
+        # Gather the bytes of the records with the same length:
+        same = np.flatnonzero(~differ)
+        lengths = length_1[same]
+        total = np.sum(lengths)
+
+        if total != 0:
+            seg_starts = np.cumsum(lengths) - lengths
+            pos = np.arange(total) - np.repeat(seg_starts, lengths)
+            bytes_1 = np.frombuffer(map_1, np.uint8)
+            bytes_2 = np.frombuffer(map_2, np.uint8)
+            not_equal = (
+                bytes_1[np.repeat(offset_1[same], lengths) + pos]
+                != bytes_2[np.repeat(offset_2[same], lengths) + pos]
+            )
+            differ[same] = np.logical_or.reduceat(not_equal, seg_starts)
+            del bytes_1, bytes_2
+
+    return differ
+
+
+def _gather(data, positions, dtype):
+    """Read values of type dtype at byte positions in array data of
+    bytes.
+
+    """
+
+    dtype = np.dtype(dtype)
+    indices = positions[:, np.newaxis] + np.arange(dtype.itemsize)
+    return data[indices].view(dtype).ravel()
+
+
+def simple_geometries(map_shp, index, start, stop):
+    """map_shp is a memory map of a main file, index the pair of arrays
+    (offsets, lengths) returned by read_index. Decode at once the null
+    shapes, points and polygons made of a single ring among records in
+    range(start, stop), without pyshp. Return the array of Shapely
+    geometries, with None for null shapes and records not decoded, and
+    the boolean array telling which records were decoded.
+
+    """
+
+    offsets = index[0][start:stop]
+    lengths = index[1][start:stop]
+    geoms = np.full(stop - start, None, dtype=object)
+    data = np.frombuffer(map_shp, np.uint8)
+    shape_type = _gather(data, offsets, "<i4")
+    decoded = shape_type == shapefile.NULL
+
+    # Points:
+    points = np.flatnonzero((shape_type == shapefile.POINT) & (lengths >= 20))
+
+    if points.size != 0:
+        x = _gather(data, offsets[points] + 4, "<f8")
+        y = _gather(data, offsets[points] + 12, "<f8")
+        geoms[points] = shapely.points(x, y)
+        decoded[points] = True
+
+    # Polygons made of a single ring: after shape type, bounding box,
+    # number of parts, number of points and index of the first point
+    # of the only part, the coordinates start at byte 48:
+    polygons = np.flatnonzero(
+        (shape_type == shapefile.POLYGON) & (lengths >= 48)
+    )
+
+    if polygons.size != 0:
+        n_parts = _gather(data, offsets[polygons] + 36, "<i4")
+        n_points = _gather(data, offsets[polygons] + 40, "<i4")
+        # Rings of fewer than 3 points, which Shapely cannot create, are
+        # left to diff_shapes.geometry_array:
+        simple = (
+            (n_parts == 1)
+            & (n_points >= 3)
+            & (lengths[polygons] >= 48 + 16 * n_points.astype(np.int64))
+        )
+        polygons = polygons[simple]
+        n_points = n_points[simple].astype(np.int64)
+        n_coords = 2 * n_points
+        first = np.cumsum(n_coords) - n_coords
+        positions = np.repeat(offsets[polygons] + 48, n_coords) + 8 * (
+            np.arange(np.sum(n_coords)) - np.repeat(first, n_coords)
+        )
+        coords = _gather(data, positions, "<f8").reshape(-1, 2)
+        rings = shapely.linearrings(
+            coords, indices=np.repeat(np.arange(polygons.size), n_points)
+        )
+        geoms[polygons] = shapely.polygons(rings)
+        decoded[polygons] = True
+
+    del data
+    # (Release the exported buffer so that the map can be closed.)
+
+    return geoms, decoded
+
+
+# Shape types whose records vertices decodes:
+VERTEX_TYPES = [
+    shapefile.NULL,
+    shapefile.POINT,
+    shapefile.MULTIPOINT,
+    shapefile.POLYLINE,
+]
+
+
+def _positions(starts, counts, itemsize):
+    """Return the byte positions of counts[i] consecutive items of size
+    itemsize from starts[i], for all i, concatenated.
+
+    """
+
+    first = np.cumsum(counts) - counts
+    return np.repeat(starts, counts) + itemsize * (
+        np.arange(np.sum(counts)) - np.repeat(first, counts)
+    )
+
+
+def vertices(map_shp, index, records):
+    """map_shp is a memory map of a main file, index the pair of arrays
+    (offsets, lengths) returned by read_index, records an array of
+    record numbers, with shape types in VERTEX_TYPES. Decode at once
+    the coordinates of the records, without pyshp. Return the arrays
+    of numbers of points, numbers of parts (0 except for polylines),
+    indices of first points of parts, concatenated, and coordinates,
+    concatenated, with shape (total number of points, 2). Records
+    which are too short for their numbers of points are considered
+    empty.
+
+    """
+
+    offsets = index[0][records]
+    lengths = index[1][records]
+    data = np.frombuffer(map_shp, np.uint8)
+    n_points = np.zeros(records.size, dtype=np.int64)
+    n_parts = np.zeros(records.size, dtype=np.int64)
+
+    # Offsets of the first coordinate of each record:
+    first = offsets + 4
+
+    if records.size != 0:
+        shape_type = _gather(data, offsets, "<i4")
+        points = (shape_type == shapefile.POINT) & (lengths >= 20)
+        n_points[points] = 1
+        multi = np.flatnonzero(
+            np.isin(shape_type, [shapefile.MULTIPOINT, shapefile.POLYLINE])
+            & (lengths >= 40)
+        )
+        n_points[multi] = _gather(data, offsets[multi] + 36, "<i4")
+        first[multi] = offsets[multi] + 40
+        lines = np.flatnonzero(
+            (shape_type == shapefile.POLYLINE) & (lengths >= 44)
+        )
+        n_parts[lines] = _gather(data, offsets[lines] + 36, "<i4")
+        n_points[lines] = _gather(data, offsets[lines] + 40, "<i4")
+        first[lines] = offsets[lines] + 44 + 4 * n_parts[lines]
+        too_short = (n_points < 0) | (n_parts < 0)
+        too_short |= first + 16 * n_points > offsets + lengths
+        n_points[too_short] = 0
+        n_parts[too_short] = 0
+
+    parts = _gather(data, _positions(offsets + 44, n_parts, 4), "<i4")
+    coords = _gather(data, _positions(first, 2 * n_points, 8), "<f8")
+    coords = coords.reshape(-1, 2)
+    del data
+    # (Release the exported buffer so that the map can be closed.)
+
+    return n_points, n_parts, parts, coords
@@ -16,6 +16,8 @@ import yachalk
 from testcmp import read_runs
 from testcmp import compare_single_test
 from testcmp import cat_compar
+from testcmp import selective_diff
+from testcmp import profiling
 
 
 def get_all_required(title, my_run):
@@ -87,6 +89,57 @@ def get_single_required(src, title, my_run, base_dest, required_type):
     return found
 
 
+def remove_scratch(patterns):
+    """Remove files and directories matching the shell patterns, relative
+    to the current directory.
+
+    """
+
+    for pattern in patterns:
+        for my_path in glob.glob(pattern, recursive=True):
+            if path.isdir(my_path) and not path.islink(my_path):
+                shutil.rmtree(my_path)
+            elif path.lexists(my_path):
+                # (my_path may have been removed with a directory
+                # matching a previous pattern.)
+                os.remove(my_path)
+
+
+def ignore_undeclared(title, outputs):
+    """Return a function usable as argument ignore of shutil.copytree
+    when archiving directory title. The function ignores files whose
+    path relative to title does not match any shell pattern in the
+    list outputs, and directories containing no such file. "test.json"
+    is always archived.
+
+    """
+
+    # Computed at the first call, when title has been created:
+    kept = None
+
+    def ignore(directory, names):
+        nonlocal kept
+
+        if kept is None:
+            kept = selective_diff.kept_paths(title, outputs)
+
+        ignored = []
+
+        for name in names:
+            rel_path = path.relpath(path.join(directory, name), title)
+
+            if (
+                rel_path != "test.json"
+                and rel_path not in kept
+                and not selective_diff.included(rel_path, outputs)
+            ):
+                ignored.append(name)
+
+        return ignored
+
+    return ignore
+
+
 def run_single_test(title, my_run, path_failed, compare_dir):
     """return_code: 0 means means successful with same result, 1 means
     failed, 2 means successful with different result, 3 means missing
@@ -95,7 +148,9 @@ def run_single_test(title, my_run, path_failed, compare_dir):
     """
 
     os.mkdir(title)
-    found = get_all_required(title, my_run)
+
+    with profiling.span("get_all_required", title):
+        found = get_all_required(title, my_run)
 
     if found:
         if "main_command" in my_run:
@@ -153,33 +208,41 @@ def run_single_test(title, my_run, path_failed, compare_dir):
                 stderr_filename, "a"
             ) as stderr:
                 for command in my_run["commands"][:main_command]:
+                    with profiling.span("command", " ".join(command)):
+                        subprocess.run(
+                            command,
+                            check=True,
+                            stdout=stdout,
+                            stderr=stderr,
+                            universal_newlines=True,
+                        )
+
+                    stdout.flush()
+
+                command = my_run["commands"][main_command]
+
+                with profiling.span("command", " ".join(command)):
                     subprocess.run(
                         command,
                         check=True,
                         stdout=stdout,
                         stderr=stderr,
                         universal_newlines=True,
+                        **other_kwargs,
                     )
-                    stdout.flush()
 
-                subprocess.run(
-                    my_run["commands"][main_command],
-                    check=True,
-                    stdout=stdout,
-                    stderr=stderr,
-                    universal_newlines=True,
-                    **other_kwargs,
-                )
                 stdout.flush()
 
                 for command in my_run["commands"][main_command + 1 :]:
-                    subprocess.run(
-                        command,
-                        check=True,
-                        stdout=stdout,
-                        stderr=stderr,
-                        universal_newlines=True,
-                    )
+                    with profiling.span("command", " ".join(command)):
+                        subprocess.run(
+                            command,
+                            check=True,
+                            stdout=stdout,
+                            stderr=stderr,
+                            universal_newlines=True,
+                        )
+
                     stdout.flush()
         except subprocess.CalledProcessError:
             os.chdir("..")
@@ -193,11 +256,22 @@ def run_single_test(title, my_run, path_failed, compare_dir):
             with open("timing_test_compare.txt", "w") as f_obj:
                 f_obj.write(line)
 
+            if "scratch" in my_run:
+                remove_scratch(my_run["scratch"])
+
             os.chdir("..")
             old_dir = path.join(compare_dir, title)
 
+            if "outputs" in my_run:
+                ignore = ignore_undeclared(title, my_run["outputs"])
+            else:
+                ignore = None
+
             try:
-                shutil.copytree(title, old_dir, symlinks=True)
+                with profiling.span("copytree", title):
+                    shutil.copytree(
+                        title, old_dir, symlinks=True, ignore=ignore
+                    )
             except FileExistsError:
                 if "sel_diff_args" in my_run:
                     sel_diff_args = my_run["sel_diff_args"]
@@ -205,7 +279,7 @@ def run_single_test(title, my_run, path_failed, compare_dir):
                     sel_diff_args = None
 
                 return_code = compare_single_test.compare_single_test(
-                    title, compare_dir, sel_diff_args
+                    title, compare_dir, sel_diff_args, my_run.get("outputs")
                 )
 
                 if return_code != 0:
@@ -234,6 +308,37 @@ def dependencies_exist(dependencies, compare_dir):
     return return_value
 
 
+def replace_old_run(title, my_run, compare_dir):
+    """Replace the archived run of title in compare_dir by the new run,
+    without the files written by the comparison. If my_run declares
+    outputs then undeclared files are not archived.
+
+    """
+
+    print("Replacing", title)
+    old_dir = path.join(compare_dir, title)
+
+    if path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+    os.remove(path.join(title, "comparison.txt"))
+
+    for dirpath, dirnames, filenames in os.walk(title):
+        if "diff_image.png" in filenames:
+            os.remove(path.join(dirpath, "diff_image.png"))
+
+    if "outputs" in my_run:
+        shutil.copytree(
+            title,
+            old_dir,
+            symlinks=True,
+            ignore=ignore_undeclared(title, my_run["outputs"]),
+        )
+        shutil.rmtree(title)
+    else:
+        shutil.move(title, old_dir)
+
+
 def run_tests(my_runs, compare_dir, verbose):
     """my_runs should be a dictionary of dictionaries."""
 
@@ -284,9 +389,10 @@ def run_tests(my_runs, compare_dir, verbose):
                     if need_update:
                         print(f"{i}: Replacing", title, "because outdated...")
                         shutil.rmtree(title)
-                        return_code = run_single_test(
-                            title, my_run, path_failed, compare_dir
-                        )
+                        with profiling.span("run_single_test", title):
+                            return_code = run_single_test(
+                                title, my_run, path_failed, compare_dir
+                            )
 
                         if return_code == 1:
                             n_failed += 1
@@ -313,9 +419,10 @@ def run_tests(my_runs, compare_dir, verbose):
                 else:
                     print(f"{i}: Creating", title + "...", flush=True)
 
-                return_code = run_single_test(
-                    title, my_run, path_failed, compare_dir
-                )
+                with profiling.span("run_single_test", title):
+                    return_code = run_single_test(
+                        title, my_run, path_failed, compare_dir
+                    )
 
                 if return_code == 1:
                     n_failed += 1
@@ -395,6 +502,19 @@ def main_cli():
         "--cat", help="cat files comparison.txt", metavar="FILE"
     )
     parser.add_argument("--verbose", action="store_true")
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="record the cost of tests, comparators and files, write it to "
+        "JSON file FILE and print the most costly",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="append a timeline of the phases of each test, and of the "
+        "comparison of each file, to FILE, in Chrome trace format, for "
+        "chrome://tracing or Perfetto",
+    )
     parser.add_argument(
         "--version", action="version", version=metadata.version("testcmp")
     )
@@ -438,6 +558,8 @@ def main_cli():
                 "test_series_file",
                 "create_file",
                 "sel_diff_args",
+                "outputs",
+                "scratch",
             }
 
             for title, my_run in my_runs.items():
@@ -486,6 +608,12 @@ def main_cli():
                 my_runs, args.compare_dir, args.substitutions
             )
 
+            if args.profile:
+                profiling.enable()
+
+            if args.trace:
+                profiling.start_trace(args.trace)
+
             run_again = True
 
             while run_again:
@@ -511,25 +639,12 @@ def main_cli():
                                 fname = path.join(title, "comparison.txt")
 
                                 if path.exists(fname):
-                                    print("Replacing", title)
-                                    old_dir = path.join(args.compare_dir, title)
-
-                                    if path.exists(old_dir):
-                                        shutil.rmtree(old_dir)
-
-                                    os.remove(fname)
-
-                                    for dirpath, dirnames, filenames in os.walk(
-                                        title
-                                    ):
-                                        if "diff_image.png" in filenames:
-                                            os.remove(
-                                                path.join(
-                                                    dirpath, "diff_image.png"
-                                                )
-                                            )
+                                    replace_old_run(
+                                        title, my_runs[title], args.compare_dir
+                                    )
 
-                                    shutil.move(title, old_dir)
+            if args.profile:
+                profiling.report(args.profile)
 
             reply = input("Remove new runs? ")
             reply = reply.casefold()
@@ -1,7 +1,51 @@
 #!/usr/bin/env python3
 
+import io
+import json
+import os
+from os import path
+import shutil
+import tempfile
+
+import numpy as np
+from PIL import Image
+import shapefile
+import shapely
+
+from testcmp import compare_single_test
 from testcmp import detailed_diff
+from testcmp import diff_bin
 from testcmp import diff_csv
+from testcmp import diff_dbf
+from testcmp import diff_gv
+from testcmp import diff_json
+from testcmp import diff_keyed
+from testcmp import diff_layer
+from testcmp import diff_png
+from testcmp import diff_rect
+from testcmp import diff_shp
+from testcmp import diff_txt
+from testcmp import match_shapes
+from testcmp import profiling
+from testcmp import registry
+from testcmp import result_cache
+from testcmp import selective_diff
+from testcmp import shp_records
+from testcmp import test_compare
+
+tmp_dir = tempfile.mkdtemp()
+
+
+def write_file(name, text):
+    """Write text to a new file name in tmp_dir and return its path."""
+
+    filename = path.join(tmp_dir, name)
+
+    with open(filename, "w") as f_obj:
+        f_obj.write(text)
+
+    return filename
+
 
 diff_csv.ndiff(
     "Test_dir1/parallel_compilation.csv", "Test_dir2/parallel_compilation.csv"
@@ -29,3 +73,734 @@ dd = detailed_diff.DetailedDiff(diff_csv_option="max_diff_rect")
 dd.diff(
     "Test_dir1/parallel_compilation.csv", "Test_dir2/parallel_compilation.csv"
 )
+dd.diff("Test_dir1/Subdir/extremum.shx", "Test_dir2/Subdir/extremum.shx")
+diff_csv.pyndiff(
+    "Test_dir1/parallel_compilation.csv",
+    "Test_dir2/parallel_compilation.csv",
+    separators=",",
+)
+
+# diff_rect:
+csv_1 = write_file("rect_1.csv", "a,b,c\n1,nan,1\n2,3,1\n")
+csv_2 = write_file("rect_2.csv", "a,b,c\n1,5,2\n2,4,2\n")
+report = io.StringIO()
+assert diff_rect.diff_rect(csv_1, csv_1, report) == 0
+assert report.getvalue() == ""
+assert diff_rect.diff_rect(csv_1, csv_2, report) == 1
+assert "relative difference: inf at row 2, column 2: old nan, new 5" in (
+    report.getvalue()
+)
+report = io.StringIO()
+assert diff_rect.diff_rect(csv_1, csv_2, report, size_lim=6) == 1
+assert "Column 2:" in report.getvalue()
+assert "Column 3:" not in report.getvalue()
+assert "... and 1 more differing columns" in report.getvalue()
+
+# A NaN old value does not hide a difference in the same column:
+csv_3 = write_file("rect_3.csv", "a,b\n1,nan\n2,3\n")
+csv_4 = write_file("rect_4.csv", "a,b\n1,nan\n2,4\n")
+report = io.StringIO()
+assert diff_rect.diff_rect(csv_3, csv_4, report) == 1
+assert "at row 3, column 2: old 3, new 4" in report.getvalue()
+
+# diff_layer:
+layer_1 = "Test_dir1/Subdir/outermost_contour"
+layer_2 = "Test_dir2/Subdir/outermost_contour"
+report = io.StringIO()
+assert diff_layer.diff_layer(layer_1, layer_1, report) == 0
+assert report.getvalue() == ""
+assert diff_layer.diff_layer(layer_1, layer_2, report) == 1
+assert "Attributes for shape 0 differ:\nr_eq_area: 82.5294 82.5297" in (
+    report.getvalue()
+)
+
+# Numeric attributes within tolerance, as with diff_dbf.diff_columns:
+report = io.StringIO()
+assert diff_layer.diff_layer(layer_1, layer_2, report, tolerance=1e-5) == 1
+assert "Vertices for shape 0 differ." in report.getvalue()
+assert "Attributes" not in report.getvalue()
+
+# A numeric attribute changing from zero:
+assert (
+    diff_layer._diff_attributes(
+        0, [("x", "N", 5, 2), ("s", "C", 5, 0)], [0, "a"], [1.5, "b"], 1e-7
+    )
+    == "Attributes for shape 0 differ:\nx: 0 1.5, relative difference inf\n"
+    "s: a b\n"
+)
+
+# No budget left, the first differing feature is still compared:
+report = io.StringIO()
+assert diff_layer.diff_layer(layer_1, layer_2, report, max_n_diff=0) == 1
+assert "Too many different features. Stopping comparison." in (
+    report.getvalue()
+)
+
+# diff_txt:
+txt_1 = write_file("txt_1.txt", "a\nb\nc\nd\n")
+txt_2 = write_file("txt_2.txt", "a\nB\nc\nd\ne\n")
+report = io.StringIO()
+assert diff_txt.diff_txt(txt_1, txt_1, 50, report) == 0
+assert report.getvalue() == ""
+assert diff_txt.diff_txt(txt_1, txt_2, 50, report) == 1
+assert report.getvalue().endswith(
+    f"--- {txt_1}\n+++ {txt_2}\n@@ -2 +2 @@\n-b\n+B\n@@ -4,0 +5 @@\n+e\n\n"
+)
+report = io.StringIO()
+assert diff_txt.diff_txt(txt_1, txt_2, 5, report) == 1
+assert "Too many lines in diff output" in report.getvalue()
+
+# Entirely different files, the limit stops the computation early:
+txt_3 = write_file("txt_3.txt", "".join(f"a{i}\n" for i in range(10**5)))
+txt_4 = write_file("txt_4.txt", "".join(f"b{i}\n" for i in range(10**5)))
+report = io.StringIO()
+assert diff_txt.diff_txt(txt_3, txt_4, 50, report) == 1
+assert "Too many lines in diff output" in report.getvalue()
+
+# compare_single_test, stamps of comparisons:
+os.makedirs(path.join(tmp_dir, "old_runs", "title"))
+os.mkdir(path.join(tmp_dir, "title"))
+write_file("old_runs/title/out.txt", "a\n")
+write_file("title/out.txt", "b\n")
+target_old = write_file("target_old.txt", "c\n")
+target_new = write_file("target_new.txt", "c\n")
+os.symlink(target_old, path.join(tmp_dir, "old_runs", "title", "link.txt"))
+os.symlink(target_new, path.join(tmp_dir, "title", "link.txt"))
+cwd = os.getcwd()
+os.chdir(tmp_dir)
+assert compare_single_test.previous_result("title", "old_runs") is None
+assert compare_single_test.compare_single_test("title", "old_runs") == 1
+assert compare_single_test.previous_result("title", "old_runs") == 1
+
+# Other options:
+assert (
+    compare_single_test.previous_result("title", "old_runs", {"limit": 10})
+    is None
+)
+
+# Modified output:
+write_file("title/out.txt", "a\n")
+os.utime("title/out.txt", ns=(0, 0))
+assert compare_single_test.previous_result("title", "old_runs") is None
+assert compare_single_test.compare_single_test("title", "old_runs") == 0
+assert compare_single_test.previous_result("title", "old_runs") == 0
+
+# Modified target of a symbolic link:
+write_file("target_new.txt", "d\n")
+os.utime(target_new, ns=(1, 1))
+assert compare_single_test.previous_result("title", "old_runs") is None
+assert compare_single_test.compare_single_test("title", "old_runs") == 1
+os.chdir(cwd)
+
+# diff_json:
+json_1 = write_file(
+    "json_1.json",
+    '{"a": 1.0, "b": [1, 2, 3], "c": {"d": "x", "e": 1234.5, "f": 1}}',
+)
+json_2 = write_file(
+    "json_2.json",
+    '{"a": 1.0000001, "b": [1, 2, 4], "c": {"d": "x", "e": 1234.6, '
+    '"g": 2, "h": 3}}',
+)
+report = io.StringIO()
+assert diff_json.diff_json(json_1, json_1, report) == 0
+assert report.getvalue() == ""
+assert diff_json.diff_json(json_1, json_2, report, tolerance=1e-6) == 1
+assert report.getvalue() == (
+    f"\n**********\n\ndiff_json {json_1} {json_2}\n$.b[2]: 3 4\n"
+    "$.c.e: 1234.5 1234.6\n$.c.f: only in old file\n"
+    "$.c.g: only in new file\n$.c.h: only in new file\n\n"
+)
+report = io.StringIO()
+assert diff_json.diff_json(json_1, json_2, report, max_n_diff=2) == 1
+assert report.getvalue().endswith(
+    "$.a: 1.0 1.0000001\n$.b[2]: 3 4\n"
+    "Too many differences. Stopping comparison.\n\n"
+)
+report = io.StringIO()
+assert diff_json.diff_json(json_1, json_2, report, quiet=True) == 1
+assert report.getvalue() == ""
+
+# Numbers cut by the end of a chunk:
+chunk_size = diff_json.CHUNK_SIZE
+diff_json.CHUNK_SIZE = 7
+assert diff_json.diff_json(json_1, json_1, report) == 0
+json_3 = write_file("json_3.json", '[12345678, {"a": [1234567, 1e-10]}]')
+json_4 = write_file("json_4.json", '[12345679, {"a": [1234567, 1e-10]}]')
+report = io.StringIO()
+assert diff_json.diff_json(json_3, json_4, report, whole_depth=1) == 1
+assert "$[0]: 12345678 12345679\n\n" in report.getvalue()
+diff_json.CHUNK_SIZE = chunk_size
+
+# diff_dbf.diff_columns:
+dbf_1 = "Test_dir1/Subdir/outermost_contour.dbf"
+dbf_2 = "Test_dir2/Subdir/outermost_contour.dbf"
+report = io.StringIO()
+assert diff_dbf.diff_columns(dbf_1, dbf_1, report) == 0
+assert report.getvalue() == ""
+assert diff_dbf.diff_columns(dbf_1, dbf_2, report, tolerance=1e-7) == 1
+assert report.getvalue().endswith(
+    "r_eq_area, N, 1, 3.64e-06\n\n"
+    "Differing values (record, field, old, new):\n"
+    "0 r_eq_area 82.5294 82.5297\n\n"
+)
+assert diff_dbf.diff_columns(dbf_1, dbf_2, report, tolerance=1e-5) == 0
+report = io.StringIO()
+assert diff_dbf.diff_columns(dbf_1, dbf_2, report, size_lim=0) == 1
+assert report.getvalue().endswith(
+    "Differing values (record, field, old, new):\n...\n\n"
+)
+
+# A value changing from zero has an infinite relative difference:
+for name, values in [("zero_1", [0, 2]), ("zero_2", [1.5, 2])]:
+    with shapefile.Writer(path.join(tmp_dir, name), shapefile.NULL) as w:
+        w.field("x", "N", decimal=2)
+
+        for x in values:
+            w.null()
+            w.record(x)
+
+report = io.StringIO()
+assert (
+    diff_dbf.diff_columns(
+        path.join(tmp_dir, "zero_1.dbf"),
+        path.join(tmp_dir, "zero_2.dbf"),
+        report,
+    )
+    == 1
+)
+assert "x, N, 1, inf\n" in report.getvalue()
+
+# Cache of results of comparators, reused for copies at other paths:
+cache_dir = path.join(tmp_dir, "cache")
+reports = []
+
+for copy_name in ["copy_a", "copy_b"]:
+    for test_dir in ["Test_dir1", "Test_dir2"]:
+        shutil.copytree(test_dir, path.join(tmp_dir, copy_name, test_dir))
+
+    # Different modification times, so that files are compared by
+    # content:
+    for dirpath, dirnames, filenames in os.walk(
+        path.join(tmp_dir, copy_name, "Test_dir2")
+    ):
+        for filename in filenames:
+            os.utime(path.join(dirpath, filename), ns=(0, 0))
+
+    report = io.StringIO()
+    assert (
+        selective_diff.selective_diff(
+            [
+                path.join(tmp_dir, copy_name, "Test_dir1"),
+                path.join(tmp_dir, copy_name, "Test_dir2"),
+            ],
+            pyndiff=True,
+            pyshp=True,
+            cache=cache_dir,
+            file_out=report,
+        )
+        == 1
+    )
+    reports.append(report.getvalue().replace(copy_name, "copy"))
+    entries = sorted(os.listdir(cache_dir))
+
+    if copy_name == "copy_a":
+        entries_a = entries
+
+assert reports[0] == reports[1]
+assert entries == entries_a
+
+# Least recently used entries are removed first:
+cache = result_cache.ResultCache(path.join(tmp_dir, "lru"), max_size=500)
+keys = []
+
+for i in range(3):
+    key = cache.key([txt_1], [txt_2], "comparator", [i])
+    cache.put(key, txt_1, txt_2, 1, f"diff {txt_1} {txt_2}\n" + "x" * 50)
+    os.utime(path.join(cache.directory, key + ".json"), ns=(i, i))
+    keys.append(key)
+
+assert cache.get(keys[0], "a", "b") == (1, "diff a b\n" + "x" * 50)
+key = cache.key([txt_1], [txt_2], "comparator", [3])
+cache.put(key, txt_1, txt_2, 1, "x" * 200)
+assert cache.get(keys[0], "a", "b") is not None
+assert cache.get(keys[1], "a", "b") is None
+assert cache.get(keys[2], "a", "b") is None
+assert cache.get(key, "a", "b") is not None
+
+# Included files, directories without included files are not compared:
+for side in ["inc_1", "inc_2"]:
+    for sub_dir in ["out/a", "out/b", "other/c"]:
+        os.makedirs(path.join(tmp_dir, side, sub_dir))
+
+    write_file(f"{side}/out/a/x.txt", side)
+    write_file(f"{side}/other/c/y.txt", side)
+
+dircmp = selective_diff.Dircmp(
+    path.join(tmp_dir, "inc_1"), path.join(tmp_dir, "inc_2"), include=["*.txt"]
+)
+assert dircmp.common == ["other", "out"]
+assert dircmp.subdirs["out"].common == ["a"]
+assert dircmp.subdirs["out"].subdirs["a"].diff_files == ["x.txt"]
+dircmp = selective_diff.Dircmp(
+    path.join(tmp_dir, "inc_1"), path.join(tmp_dir, "inc_2"), include=["out/a"]
+)
+assert dircmp.common == ["out"]
+assert dircmp.subdirs["out"].common == ["a"]
+assert dircmp.subdirs["out"].subdirs["a"].diff_files == ["x.txt"]
+
+# Archived outputs, without empty directories:
+shutil.copytree(
+    path.join(tmp_dir, "inc_1"),
+    path.join(tmp_dir, "archive"),
+    ignore=test_compare.ignore_undeclared(
+        path.join(tmp_dir, "inc_1"), ["out/*/*.txt"]
+    ),
+)
+assert [
+    (path.relpath(dirpath, path.join(tmp_dir, "archive")), filenames)
+    for dirpath, dirnames, filenames in os.walk(path.join(tmp_dir, "archive"))
+] == [(".", []), ("out", []), ("out/a", ["x.txt"])]
+
+# Replacement of an archived run, without undeclared files:
+os.makedirs(path.join(tmp_dir, "runs", "title", "out"))
+os.makedirs(path.join(tmp_dir, "runs", "title", "junk"))
+os.makedirs(path.join(tmp_dir, "runs", "compare_dir", "title", "old"))
+
+for name in ["test.json", "comparison.txt", "out/x.txt", "junk/y.txt"]:
+    write_file(path.join("runs", "title", name), name)
+
+os.chdir(path.join(tmp_dir, "runs"))
+test_compare.replace_old_run("title", {"outputs": ["out/*"]}, "compare_dir")
+os.chdir(cwd)
+assert not path.exists(path.join(tmp_dir, "runs", "title"))
+archive = path.join(tmp_dir, "runs", "compare_dir")
+assert [
+    (path.relpath(dirpath, archive), filenames)
+    for dirpath, dirnames, filenames in os.walk(archive)
+] == [(".", []), ("title", ["test.json"]), ("title/out", ["x.txt"])]
+
+# Rings of fewer than 3 points, which Shapely cannot create:
+for name, rings in [
+    ("short_old", [[(0, 0), (1, 0), (1, 1)], [(5, 5)], [(2, 0), (2, 2)]]),
+    ("short_new", [[(0, 0), (1, 0), (1, 1)], [(3, 0), (3, 3)], [(6, 6)]]),
+]:
+    with shapefile.Writer(path.join(tmp_dir, name), shapefile.POLYGON) as w:
+        w.field("n", "N")
+
+        for i, ring in enumerate(rings):
+            w.poly([ring])
+            w.record(i)
+
+report = io.StringIO()
+assert (
+    diff_shp.diff_shp(
+        path.join(tmp_dir, "short_old"),
+        path.join(tmp_dir, "short_new"),
+        detail_file=report,
+    )
+    == 1
+)
+assert "Ring 0 of old shape 1 has fewer than 3 points" in report.getvalue()
+assert "Ring 0 of new shape 2 has fewer than 3 points" in report.getvalue()
+report = io.StringIO()
+assert (
+    diff_shp.diff_shp(
+        path.join(tmp_dir, "short_old"),
+        path.join(tmp_dir, "short_new"),
+        detail_file=report,
+        unordered=True,
+    )
+    == 1
+)
+assert "Matched shapes: 1, identical: 1\n" in report.getvalue()
+assert "Shapes only in old file: 2\n" in report.getvalue()
+
+# diff_keyed:
+keyed_1 = write_file("keyed_1.csv", "id,x,s\n1,1.5,a\n2,2.5,b\n3,3.5,c\n")
+keyed_2 = write_file("keyed_2.csv", "id,x,s\n3,3.5,c\n1,1.5,a\n2,2.5,b\n")
+keyed_3 = write_file(
+    "keyed_3.csv", "id,x,s\n3,3.6,c\n1,1.5,z\n4,2.5,b\n5,0,d\n6,0,e\n"
+)
+
+for spill_bytes in [diff_keyed.SPILL_BYTES, 1]:
+    report = io.StringIO()
+    assert (
+        diff_keyed.diff_keyed(
+            keyed_1,
+            keyed_2,
+            report,
+            keys=["id"],
+            spill_bytes=spill_bytes,
+        )
+        == 0
+    )
+    assert report.getvalue() == ""
+    report = io.StringIO()
+    assert (
+        diff_keyed.diff_keyed(
+            keyed_1,
+            keyed_3,
+            report,
+            keys=["id"],
+            spill_bytes=spill_bytes,
+        )
+        == 1
+    )
+    assert "Rows only in old file: 1\nline 3: key ('2',)\n" in (
+        report.getvalue()
+    )
+    assert "Rows only in new file: 3\n" in report.getvalue()
+    assert (
+        "Matched rows with different values: 2\n"
+        "lines 2 3, key ('1',): s: a z\n"
+        "lines 4 2, key ('3',): x: 3.5 3.6\n"
+    ) in report.getvalue()
+
+# Limit on the number of reported rows:
+report = io.StringIO()
+assert (
+    diff_keyed.diff_keyed(keyed_1, keyed_3, report, keys=["id"], size_lim=9)
+    == 1
+)
+assert "Rows only in new file: 3\nline 4: key ('4',)\n...\n" in (
+    report.getvalue()
+)
+
+# Without key, rows are matched in order:
+report = io.StringIO()
+assert diff_keyed.diff_keyed(keyed_1, keyed_1, report) == 0
+assert diff_keyed.diff_keyed(keyed_1, keyed_2, report) == 1
+assert "Matched rows with different values: 3\n" in report.getvalue()
+
+# Key columns with a tree also containing CSV files without them:
+for side, keyed, other in [
+    ("keyed_dir_1", "id,x\n1,a\n2,b\n", "u,v\n1,2\n"),
+    ("keyed_dir_2", "id,x\n2,b\n1,c\n", "u,v\n1,3\n"),
+]:
+    os.mkdir(path.join(tmp_dir, side))
+    write_file(path.join(side, "keyed.csv"), keyed)
+    write_file(path.join(side, "other.csv"), other)
+
+report = io.StringIO()
+assert (
+    selective_diff.selective_diff(
+        [path.join(tmp_dir, "keyed_dir_1"), path.join(tmp_dir, "keyed_dir_2")],
+        pyndiff=True,
+        csv_keys=["id"],
+        file_out=report,
+    )
+    == 1
+)
+assert "lines 2 3, key ('1',): x: a c\n" in report.getvalue()
+assert "< 1,2\n---\n> 1,3\n" in report.getvalue()
+assert "Number of differences: 2\n" in report.getvalue()
+
+# Maximum number of differences:
+for side, lines in [("limit_1", ["a", "b"]), ("limit_2", ["a", "bb"])]:
+    os.mkdir(path.join(tmp_dir, side))
+
+    for name in ["x.txt", "y.txt"]:
+        write_file(path.join(side, name), "\n".join(lines) + "\n")
+
+report = io.StringIO()
+assert (
+    selective_diff.selective_diff(
+        [path.join(tmp_dir, "limit_1"), path.join(tmp_dir, "limit_2")],
+        file_out=report,
+    )
+    == 1
+)
+assert "-b\n+bb\n" in report.getvalue()
+assert "Number of differences: 2\n" in report.getvalue()
+assert "Stopped after" not in report.getvalue()
+
+for max_diffs in [1, 2]:
+    report = io.StringIO()
+    assert (
+        selective_diff.selective_diff(
+            [path.join(tmp_dir, "limit_1"), path.join(tmp_dir, "limit_2")],
+            max_diffs=max_diffs,
+            file_out=report,
+        )
+        == 1
+    )
+
+    # The differing lines of the files compared are printed in full:
+    assert report.getvalue().count("-b\n+bb\n") == max_diffs
+    assert "Too many lines in diff output\n" not in report.getvalue()
+    assert f"Number of differences: {max_diffs}\n" in report.getvalue()
+
+# Files only in one directory are counted at once, so the number of
+# differences may exceed the limit:
+for name in ["u.txt", "v.txt"]:
+    write_file(path.join("limit_2", name), "u\n")
+
+report = io.StringIO()
+assert (
+    selective_diff.selective_diff(
+        [path.join(tmp_dir, "limit_1"), path.join(tmp_dir, "limit_2")],
+        first_diff=True,
+        file_out=report,
+    )
+    == 1
+)
+assert "diff_txt" not in report.getvalue()
+assert "Number of differences: 2\n" in report.getvalue()
+assert "Stopped after 2 difference(s), limit 1," in report.getvalue()
+
+# diff_gv:
+gv_1 = write_file(
+    "graph_1.gv",
+    "digraph G {\n  rankdir=LR\n  a -> b [color=red]\n  b -> c\n  d\n}\n",
+)
+gv_2 = write_file(
+    "graph_2.gv",
+    'digraph G { rankdir = "LR"; b -> c; a -> b [color = "red"]; d; }\n',
+)
+gv_3 = write_file(
+    "graph_3.gv",
+    "digraph G {\n  rankdir=TB\n  a -> b [color=blue]\n  b -> e\n  x; y\n}\n",
+)
+report = io.StringIO()
+assert diff_gv.diff_gv(gv_1, gv_2, report) == 0
+assert report.getvalue() == ""
+assert diff_gv.diff_gv(gv_1, gv_3, report) == 1
+assert (
+    "Graph attributes differ: rankdir: 'LR' 'TB'\n"
+    "Nodes only in old file: 2\nc\nd\n"
+    "Nodes only in new file: 3\ne\nx\ny\n"
+    "Edges only in old file: 1\nb -> c {}\n"
+    "Edges only in new file: 1\nb -> e {}\n"
+    "Edges with different attributes: 1\na -> b: color: 'red' 'blue'\n"
+) in report.getvalue()
+report = io.StringIO()
+assert diff_gv.diff_gv(gv_1, gv_3, report, max_n_diff=1) == 1
+assert "Nodes only in new file: 3\ne\n...\n" in report.getvalue()
+
+# diff_bin:
+text = "0123456789" * 10
+bin_1 = write_file("bin_1", text)
+bin_2 = write_file("bin_2", "x" + text[1:51] + "yy" + text[53:])
+report = io.StringIO()
+assert diff_bin.diff_bin(bin_1, bin_1, report) == 0
+assert report.getvalue() == ""
+assert diff_bin.diff_bin(bin_1, bin_2, report, max_gap=4) == 1
+assert "First differing byte at offset 0\n" in report.getvalue()
+assert "[0, 1)\n[51, 53)\n" in report.getvalue()
+report = io.StringIO()
+assert diff_bin.diff_bin(bin_1, bin_2, report, size_lim=1, max_gap=4) == 1
+assert "[0, 1)\n... and 1 more ranges\n" in report.getvalue()
+
+# pyndiff:
+numbers_1 = write_file("numbers_1.txt", "a 1.0 2.0\nb 3.0 4.0\nc 5 6\n")
+numbers_2 = write_file(
+    "numbers_2.txt", "a 1.0 2.0000000001\nb 3.0 4.5\nc 5 6\n"
+)
+report = io.StringIO()
+assert diff_csv.pyndiff(numbers_1, numbers_2, report, tolerance=0.2) == 0
+assert report.getvalue() == ""
+assert diff_csv.pyndiff(numbers_1, numbers_2, report) == 1
+assert (
+    "2c2\n< b 3.0 4.0\n---\n> b 3.0 4.5\n"
+    "### Maximum absolute error in matching lines = 5.00e-01 at line 2 "
+    "field 3\n"
+) in report.getvalue()
+report = io.StringIO()
+assert diff_csv.pyndiff(numbers_1, numbers_2, report, size_lim=1) == 1
+assert "Too many lines in diff output\n" in report.getvalue()
+
+# diff_png:
+pixels = np.zeros((192, 192, 3), np.uint8)
+Image.fromarray(pixels).save(path.join(tmp_dir, "image_1.png"))
+
+# Same pixels, in another storage mode:
+Image.fromarray(pixels).convert("RGBA").save(
+    path.join(tmp_dir, "image_2.png")
+)
+pixels[2:4, 3:6] = 10
+pixels[150, 160] = [0, 0, 200]
+Image.fromarray(pixels).save(path.join(tmp_dir, "image_3.png"))
+Image.fromarray(pixels[:32]).save(path.join(tmp_dir, "image_4.png"))
+report = io.StringIO()
+assert (
+    diff_png.diff_png(
+        path.join(tmp_dir, "image_1.png"),
+        path.join(tmp_dir, "image_2.png"),
+        report,
+    )
+    == 0
+)
+assert report.getvalue() == ""
+assert (
+    diff_png.diff_png(
+        path.join(tmp_dir, "image_1.png"),
+        path.join(tmp_dir, "image_3.png"),
+        report,
+    )
+    == 1
+)
+assert (
+    "Number of different pixels: 7\n"
+    "Largest difference of a channel: 200\n"
+    "Bounding boxes of differing regions (x_min, y_min, x_max, y_max), "
+    "2 regions:\n(3, 2, 5, 3)\n(160, 150, 160, 150)\n"
+) in report.getvalue()
+report = io.StringIO()
+assert (
+    diff_png.diff_png(
+        path.join(tmp_dir, "image_1.png"),
+        path.join(tmp_dir, "image_3.png"),
+        report,
+        diff_image=path.join(tmp_dir, "diff_image.png"),
+        max_boxes=1,
+    )
+    == 1
+)
+assert "(3, 2, 5, 3)\n...\n" in report.getvalue()
+assert path.exists(path.join(tmp_dir, "diff_image.png"))
+report = io.StringIO()
+assert (
+    diff_png.diff_png(
+        path.join(tmp_dir, "image_1.png"),
+        path.join(tmp_dir, "image_4.png"),
+        report,
+    )
+    == 1
+)
+assert "Sizes differ (width x height): 192 x 192, 192 x 32\n" in (
+    report.getvalue()
+)
+
+# match_shapes:
+geoms_old = np.array(
+    [
+        shapely.box(0, 0, 1, 1),
+        shapely.Point(5, 5),
+        None,
+        shapely.box(10, 10, 12, 12),
+    ]
+)
+geoms_new = np.array(
+    [
+        shapely.Point(5, 5.000001),
+        shapely.box(10, 10, 12, 12.01),
+        shapely.box(0, 0, 1, 1),
+        None,
+        shapely.box(30, 30, 31, 31),
+    ]
+)
+matches, n_exact = match_shapes.match_shapes(geoms_old, geoms_new)
+assert matches.tolist() == [2, -1, 3, -1]
+assert n_exact == 2
+matches, n_exact = match_shapes.match_shapes(geoms_old, geoms_new, 0.01)
+assert matches.tolist() == [2, 0, 3, 1]
+assert n_exact == 2
+
+# shp_records:
+for name, rings in [
+    ("records_1", [[(0, 0), (1, 0), (1, 1)], [(2, 0), (3, 0), (3, 1)]] * 2),
+    (
+        "records_2",
+        [[(0, 0), (1, 0), (1, 1)], [(2, 0), (3, 0), (3, 2)]]
+        + [[(0, 0), (1, 0), (1, 1)], [(2, 0), (3, 0), (3, 1), (2, 1)]],
+    ),
+]:
+    with shapefile.Writer(path.join(tmp_dir, name), shapefile.POLYGON) as w:
+        w.field("n", "N")
+
+        for i, ring in enumerate(rings):
+            w.poly([ring])
+            w.record(i)
+
+with open(path.join(tmp_dir, "records_1.shx"), "rb") as shx_1, open(
+    path.join(tmp_dir, "records_2.shx"), "rb"
+) as shx_2:
+    index_1 = shp_records.read_index(shx_1)
+    index_2 = shp_records.read_index(shx_2)
+
+assert index_1[1].tolist() == [112] * 4
+assert index_2[1].tolist() == [112] * 3 + [128]
+
+with open(path.join(tmp_dir, "records_1.shp"), "rb") as shp_1, open(
+    path.join(tmp_dir, "records_2.shp"), "rb"
+) as shp_2:
+    map_1 = diff_bin.map_file(shp_1)
+    map_2 = diff_bin.map_file(shp_2)
+    assert shp_records.differing_records(
+        map_1, map_2, index_1, index_2, 0, 4
+    ).tolist() == [False, True, False, True]
+    assert shp_records.differing_records(
+        map_1, map_2, index_1, index_2, 0, 1
+    ).tolist() == [False]
+    geoms, decoded = shp_records.simple_geometries(map_1, index_1, 1, 3)
+    assert decoded.tolist() == [True, True]
+    assert shapely.equals(
+        geoms,
+        [
+            shapely.Polygon([(2, 0), (3, 0), (3, 1)]),
+            shapely.Polygon([(0, 0), (1, 0), (1, 1)]),
+        ],
+    ).all()
+    del geoms
+    map_1.close()
+    map_2.close()
+
+# registry:
+comparators = registry.parse_comparators(["txt=testcmp.diff_bin:diff_bin"])
+assert comparators == {".txt": diff_bin.diff_bin}
+
+for bad in ["txt", "txt=testcmp.diff_bin"]:
+    try:
+        registry.parse_comparators([bad])
+    except ValueError:
+        pass
+    else:
+        assert False
+
+assert "text" in registry.file_type(numbers_1)
+
+# Modification times of modules are only part of the version when the
+# modules may be edited:
+assert registry._development_mode() == any(
+    x.startswith("registry.py ") for x in registry.comparator_version()
+)
+report = io.StringIO()
+assert (
+    selective_diff.selective_diff(
+        [path.join(tmp_dir, "limit_1"), path.join(tmp_dir, "limit_2")],
+        comparator=["txt=testcmp.diff_bin:diff_bin"],
+        file_out=report,
+    )
+    == 1
+)
+assert "diff_bin" in report.getvalue()
+assert "diff_txt" not in report.getvalue()
+
+# profiling, last since it stays enabled:
+profiling.enable()
+profiling.start_trace(path.join(tmp_dir, "trace.json"))
+
+for i in range(2):
+    with profiling.span("category", "outer"):
+        with profiling.span("category", "inner"):
+            bytearray(1 << 20)
+
+report = io.StringIO()
+profiling.report(path.join(tmp_dir, "profile.json"), file=report)
+assert "category: outer\n" in report.getvalue()
+
+with open(path.join(tmp_dir, "profile.json")) as f_obj:
+    stats = {x["name"]: x for x in json.load(f_obj)}
+
+assert stats["outer"]["calls"] == 2
+assert stats["inner"]["peak_memory"] >= 1 << 20
+assert stats["outer"]["peak_memory"] >= stats["inner"]["peak_memory"]
+assert stats["outer"]["wall"] >= stats["inner"]["wall"]
+
+with open(path.join(tmp_dir, "trace.json")) as f_obj:
+    events = json.loads(f_obj.read().rstrip(",\n") + "]")
+
+assert [event["name"] for event in events] == ["inner", "outer"] * 2
+
+shutil.rmtree(tmp_dir)